@@ -23,6 +23,7 @@ import json
 import time
 import re
 from datetime import datetime
+from completion_estimator import replay_completion_history, update_completion_estimator
 
 # =============================================================================
 # CONFIGURATIONS
@@ -35,6 +36,9 @@ HUNTERS_STORAGE_PATH = "REPLACE_WITH_STORAGE_PATH"
 BTCPUZZLE_COMPLETED_FILE = os.path.join(HUNTERS_STORAGE_PATH, "BTCPUZZLE_completed.json")
 BTCPUZZLE_SPEED_FILE     = os.path.join(HUNTERS_STORAGE_PATH, "BTCPUZZLE_speed.json")
 
+# Half-life (seconds) of the completion-rate estimator; older progress fades out at this pace
+ESTIMATOR_HALF_LIFE = 6 * 3600
+
 # =============================================================================
 # HELPER FUNCTIONS FOR FILE HANDLING & CLEANUP
 # =============================================================================
@@ -147,8 +151,18 @@ def main():
     # 4) Update data and add to history
     now_ts = time.time()
 
+    estimator = completed_data.get("estimator")
+    if estimator is None:
+        # First run with the estimator: replay the retained history once
+        estimator = replay_completion_history(completed_data["history"], ESTIMATOR_HALF_LIFE)
+
     completed_data["current"] = completed
     completed_data["history"].append((now_ts, completed))
+    if completed > 0:
+        completed_data["estimator"] = update_completion_estimator(estimator, now_ts, completed, ESTIMATOR_HALF_LIFE)
+    else:
+        # Not parsed from the page; keep the estimator as it was
+        completed_data["estimator"] = estimator
 
     speed_data["current"] = speed
     speed_data["history"].append((now_ts, speed))
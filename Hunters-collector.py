@@ -24,6 +24,8 @@ import os
 import json
 import time
 from datetime import datetime
+from completion_estimator import replay_completion_history, update_completion_estimator
+from ranges_rollup import add_sample, build_rollup, prune_days
 
 # =============================================================================
 # CONFIGURATIONS
@@ -40,6 +42,19 @@ PREVIOUS_COMPLETED_FILE = os.path.join(HUNTERS_STORAGE_PATH, 'previous_completed
 PREVIOUS_SPEED_FILE     = os.path.join(HUNTERS_STORAGE_PATH, 'previous_speed.json')
 RANGES_HISTORY_FILE     = os.path.join(HUNTERS_STORAGE_PATH, 'ranges_history.json')
 TOTAL_RANGES_FILE       = os.path.join(HUNTERS_STORAGE_PATH, 'total_ranges.json')
+SPEED_STATS_FILE        = os.path.join(HUNTERS_STORAGE_PATH, 'speed_stats.json')
+RANGES_TAIL_FILE        = os.path.join(HUNTERS_STORAGE_PATH, 'ranges_tail.jsonl')
+RANGES_ROLLUP_FILE      = os.path.join(HUNTERS_STORAGE_PATH, 'ranges_rollup.json')
+
+# Half-life (seconds) of the completion-rate estimator; older progress fades out at this pace
+ESTIMATOR_HALF_LIFE     = 6 * 3600
+
+# Rolling pool speed statistics: window length and the bucket size used to expire old samples
+SPEED_STATS_WINDOW_DAYS = 30
+SPEED_STATS_BUCKET      = 3600
+
+# The ranges tail log is rewritten with its newest half once it grows past this size
+RANGES_TAIL_MAX_BYTES   = 4 * 1024 * 1024
 
 # =============================================================================
 # LOAD JSON DATA
@@ -56,9 +71,39 @@ def load_json(file_path):
 # =============================================================================
 # SAVE JSON DATA
 # =============================================================================
-def save_json(file_path, data):
-    with open(file_path, 'w') as file:
-        json.dump(data, file, indent=4)
+def save_json(file_path, data, indent=4):
+    # Write to a temporary file and swap it in, so readers never see a half-written file
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(data, file, indent=indent)
+    os.replace(tmp_path, file_path)
+
+# =============================================================================
+# RANGES TAIL LOG
+# =============================================================================
+def append_ranges_tail(tick, ts, user_data):
+    """
+    Appends this run's user samples as one JSON line to the tail log. The /stats bot
+    applies these lines to its in-memory data instead of re-reading ranges_history.json.
+    tick matches the "tick" saved in ranges_history.json, so a reader can tell whether it
+    missed a run. Once the log passes RANGES_TAIL_MAX_BYTES it is rewritten with its
+    newest half; readers that fall behind that reload the full history.
+    """
+    line = json.dumps({
+        "tick": tick,
+        "ts": ts,
+        "samples": {user: [submitted_ranges, speed] for user, (submitted_ranges, speed) in user_data.items()}
+    })
+    with open(RANGES_TAIL_FILE, 'a') as file:
+        file.write(line + "\n")
+
+    if os.path.getsize(RANGES_TAIL_FILE) > RANGES_TAIL_MAX_BYTES:
+        with open(RANGES_TAIL_FILE, 'r') as file:
+            lines = file.readlines()
+        tmp_path = f"{RANGES_TAIL_FILE}.tmp"
+        with open(tmp_path, 'w') as file:
+            file.writelines(lines[len(lines) // 2:])
+        os.replace(tmp_path, RANGES_TAIL_FILE)
 
 # =============================================================================
 # CLEAN OLD DATA
@@ -70,6 +115,112 @@ def clean_old_data(data, cutoff_time):
     """
     return {user: [(t, r, s) for t, r, s in entries if t >= cutoff_time] for user, entries in data.items()}
 
+# =============================================================================
+# ROLLING SPEED STATISTICS
+# =============================================================================
+def new_speed_stats():
+    return {
+        "buckets": [],          # [bucket_start, sum, count, max], oldest first
+        "max_deque": [],        # [bucket_start, max] with decreasing max, front is the window max
+        "window_sum": 0.0,
+        "window_count": 0,
+        "all_time_best_speed": 0,
+        "all_time_best_speed_holder": None,
+    }
+
+def update_speed_stats(stats, ts, pool_speed, cutoff_time):
+    """
+    Adds one pool speed sample to the rolling window and expires buckets older than cutoff_time.
+    The window sum/count are kept as running totals and the window max comes from a monotonic
+    deque, so each update is amortized O(1) and reading the stats never scans the history.
+    Samples are expired per SPEED_STATS_BUCKET, so the window edge has bucket granularity.
+    """
+    buckets = stats["buckets"]
+    max_deque = stats["max_deque"]
+    bucket_start = ts - (ts % SPEED_STATS_BUCKET)
+
+    if buckets and buckets[-1][0] == bucket_start:
+        bucket = buckets[-1]
+        bucket[1] += pool_speed
+        bucket[2] += 1
+        bucket[3] = max(bucket[3], pool_speed)
+    else:
+        buckets.append([bucket_start, pool_speed, 1, pool_speed])
+    stats["window_sum"] += pool_speed
+    stats["window_count"] += 1
+
+    while max_deque and max_deque[-1][1] <= pool_speed:
+        max_deque.pop()
+    if not max_deque or max_deque[-1][0] != bucket_start:
+        max_deque.append([bucket_start, pool_speed])
+
+    # Expire whole buckets that fell out of the window
+    cutoff_bucket = cutoff_time - (cutoff_time % SPEED_STATS_BUCKET)
+    expired = 0
+    while expired < len(buckets) and buckets[expired][0] < cutoff_bucket:
+        stats["window_sum"] -= buckets[expired][1]
+        stats["window_count"] -= buckets[expired][2]
+        expired += 1
+    if expired:
+        del buckets[:expired]
+    expired = 0
+    while expired < len(max_deque) and max_deque[expired][0] < cutoff_bucket:
+        expired += 1
+    if expired:
+        del max_deque[:expired]
+
+    if not buckets:
+        stats["window_sum"] = 0.0
+        stats["window_count"] = 0
+
+    stats["max_30d_speed"] = max_deque[0][1] if max_deque else 0
+    stats["avg_30d_speed"] = stats["window_sum"] / stats["window_count"] if stats["window_count"] else 0
+    stats["updated"] = ts
+    return stats
+
+def update_all_time_best(stats, user_data):
+    """Tracks the best single-user speed ever seen, together with its holder."""
+    for user, (_, speed) in user_data.items():
+        if speed > stats.get("all_time_best_speed", 0):
+            stats["all_time_best_speed"] = speed
+            stats["all_time_best_speed_holder"] = user
+    return stats
+
+def seed_speed_stats(speed_data, cutoff_time):
+    """
+    Builds the rolling statistics from the existing speed history on first run.
+    Carries over the all-time best speed that the daily report used to store in previous_speed.json.
+    """
+    stats = new_speed_stats()
+    history = sorted((h for h in speed_data.get("history", []) if len(h) == 2), key=lambda x: x[0])
+    for ts, speed in history:
+        if ts >= cutoff_time and isinstance(speed, (int, float)):
+            update_speed_stats(stats, ts, speed, cutoff_time)
+    stats["all_time_best_speed"] = speed_data.get("all_time_best_speed", 0)
+    stats["all_time_best_speed_holder"] = speed_data.get("all_time_best_speed_holder")
+    return stats
+
+def load_speed_stats(file_path, speed_data, cutoff_time):
+    """
+    Loads the rolling statistics from file_path. If the file is missing, unreadable or lacks
+    part of the rolling window (e.g. written by an older version), the window is rebuilt
+    from the speed history, keeping the better all-time best of the two. Other missing keys
+    get their defaults, so update_speed_stats always finds what it needs.
+    """
+    loaded = load_json(file_path) if os.path.exists(file_path) else {}
+    if not isinstance(loaded, dict):
+        loaded = {}
+    if all(key in loaded for key in ("buckets", "max_deque", "window_sum", "window_count")):
+        return {**new_speed_stats(), **loaded}
+
+    if loaded:
+        print(f"{file_path} is incomplete, rebuilding the rolling speed statistics.")
+    stats = seed_speed_stats(speed_data, cutoff_time)
+    if loaded.get("all_time_best_speed", 0) > stats["all_time_best_speed"]:
+        stats["all_time_best_speed"] = loaded["all_time_best_speed"]
+        stats["all_time_best_speed_holder"] = loaded.get("all_time_best_speed_holder")
+    return stats
+
 # =============================================================================
 # SCRAPE DASHBOARD
 # =============================================================================
@@ -151,7 +302,9 @@ def main():
     cutoff_time = current_time - (30 * 86400)  # 30 days ago
 
     # Load existing data
-    ranges_history   = load_json(RANGES_HISTORY_FILE).get("data", {})
+    ranges_file      = load_json(RANGES_HISTORY_FILE)
+    ranges_history   = ranges_file.get("data", {})
+    ranges_tick      = ranges_file.get("tick", 0) + 1
     completion_data  = load_json(PREVIOUS_COMPLETED_FILE)
     speed_data       = load_json(PREVIOUS_SPEED_FILE)
     total_ranges_data= load_json(TOTAL_RANGES_FILE)
@@ -163,6 +316,14 @@ def main():
 
     progress, pool_speed, total_ranges, user_data = process_dashboard(html)
 
+    # Update the daily/weekly rollups, which outlive the 30 days of raw history.
+    # Without a rollup file, start from the raw history that is still there.
+    ranges_rollup = load_json(RANGES_ROLLUP_FILE) or build_rollup(ranges_history)
+    for user, (submitted_ranges, speed) in user_data.items():
+        add_sample(ranges_rollup, user, current_time, submitted_ranges, speed)
+    prune_days(ranges_rollup, datetime.fromtimestamp(current_time).date())
+    ranges_rollup["tick"] = ranges_tick
+
     # Update ranges_history
     for user, (submitted_ranges, speed) in user_data.items():
         if user not in ranges_history:
@@ -174,8 +335,17 @@ def main():
     # Update completion_data
     if "history" not in completion_data:
         completion_data["history"] = []
+    estimator = completion_data.get("estimator")
+    if estimator is None:
+        # First run with the estimator: replay the retained history once
+        estimator = replay_completion_history(completion_data["history"], ESTIMATOR_HALF_LIFE)
     completion_data["current"] = progress
     completion_data["history"].append((current_time, progress))
+    if progress > 0:
+        completion_data["estimator"] = update_completion_estimator(estimator, current_time, progress, ESTIMATOR_HALF_LIFE)
+    else:
+        # Not parsed from the page; keep the estimator as it was
+        completion_data["estimator"] = estimator
 
     # Update speed_data
     if "history" not in speed_data:
@@ -183,17 +353,27 @@ def main():
     speed_data["current"] = pool_speed
     speed_data["history"].append((current_time, pool_speed))
 
+    # Update rolling speed statistics
+    speed_stats_window_cutoff = current_time - (SPEED_STATS_WINDOW_DAYS * 86400)
+    speed_stats = load_speed_stats(SPEED_STATS_FILE, speed_data, speed_stats_window_cutoff)
+    update_speed_stats(speed_stats, current_time, pool_speed, speed_stats_window_cutoff)
+    update_all_time_best(speed_stats, user_data)
+
     # Update total_ranges_data
     if "history" not in total_ranges_data:
         total_ranges_data["history"] = []
     total_ranges_data["current"] = total_ranges
     total_ranges_data["history"].append((current_time, total_ranges))
 
-    # Save all updates
-    save_json(RANGES_HISTORY_FILE, {"data": ranges_history})
+    # Save all updates. The rollups go first: a reader that sees this tick in the
+    # history also finds it in the rollups.
+    save_json(RANGES_ROLLUP_FILE, ranges_rollup, indent=None)
+    save_json(RANGES_HISTORY_FILE, {"data": ranges_history, "tick": ranges_tick})
+    append_ranges_tail(ranges_tick, current_time, user_data)
     save_json(PREVIOUS_COMPLETED_FILE, completion_data)
     save_json(PREVIOUS_SPEED_FILE, speed_data)
     save_json(TOTAL_RANGES_FILE, total_ranges_data)
+    save_json(SPEED_STATS_FILE, speed_stats)
 
     print("Data collection complete and saved.")
 
@@ -24,6 +24,7 @@ import json
 import time
 import re
 from datetime import datetime
+from completion_estimator import replay_completion_history, update_completion_estimator
 
 # =============================================================================
 # CONFIGURATION
@@ -39,6 +40,9 @@ HUNTERS_STORAGE_PATH      = "REPLACE_WITH_HUNTERS_STORAGE_PATH"
 TTD_COMPLETED_FILE        = os.path.join(HUNTERS_STORAGE_PATH, "TTD_minimal_completed.json")
 TTD_SPEED_FILE            = os.path.join(HUNTERS_STORAGE_PATH, "TTD_minimal_speed.json")
 
+# Half-life (seconds) of the completion-rate estimator; older progress fades out at this pace
+ESTIMATOR_HALF_LIFE       = 6 * 3600
+
 # =============================================================================
 # HELPER FUNCTIONS FOR FILE HANDLING & CLEANUP
 # =============================================================================
@@ -159,8 +163,18 @@ def main():
     now_ts = time.time()
 
     # Completed
+    estimator = completed_data.get("estimator")
+    if estimator is None:
+        # First run with the estimator: replay the retained history once
+        estimator = replay_completion_history(completed_data["history"], ESTIMATOR_HALF_LIFE)
+
     completed_data["current"] = percentage
     completed_data["history"].append((now_ts, percentage))
+    if percentage > 0:
+        completed_data["estimator"] = update_completion_estimator(estimator, now_ts, percentage, ESTIMATOR_HALF_LIFE)
+    else:
+        # Not parsed from the page; keep the estimator as it was
+        completed_data["estimator"] = estimator
 
     # Speed
     speed_data["current"] = speed
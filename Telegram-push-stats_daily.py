@@ -16,16 +16,30 @@
 
 
 
-import requests
 import os
+import sys
 import json
 import time
-import matplotlib.pyplot as plt
+import math
+import hmac
+import asyncio
+import signal
+import bisect
+import heapq
+import threading
 import matplotlib.dates as mdates
+from matplotlib.figure import Figure
 from matplotlib.ticker import FuncFormatter
 from datetime import datetime, timedelta
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
 import numpy as np
+from chart_cache import ChartCache, chart_key
+from chart_output import figure_template, figure_to_png
+from milestones import MILESTONES
+from ranges_rollup import (DAY_BUCKET_DAYS, active_users, add_sample, build_rollup, first_day, new_rollup,
+                           period_starts, prune_days, series)
+from telegram_client import FileIdCache, TelegramClient, TelegramError, content_hash
 
 # =============================================================================
 # CONFIGURATION
@@ -34,29 +48,98 @@ BOT_TOKEN = "REPLACE_WITH_BOT_TOKEN"  # Preferably use an environment variable!
 OFFICIAL_CHAT_ID = "REPLACE_WITH_OFFICIAL_CHAT_ID"  # Your official group chat ID
 OFFICIAL_THREAD_ID = "REPLACE_WITH_OFFICIAL_THREAD_ID"  # Specific forum thread ID
 
+# Bot API endpoint; point it at a local fake Telegram for end-to-end tests
+TELEGRAM_API_BASE = "https://api.telegram.org"
+
+# Webhook mode (--webhook): Telegram POSTs updates to WEBHOOK_URL, which must reach the
+# local server on WEBHOOK_HOST:WEBHOOK_PORT and WEBHOOK_PATH (usually via a reverse proxy)
+WEBHOOK_URL = "REPLACE_WITH_WEBHOOK_URL"  # Public HTTPS URL, e.g. https://bot.example.com/telegram-webhook
+WEBHOOK_SECRET = "REPLACE_WITH_WEBHOOK_SECRET"  # 1-256 characters: A-Z, a-z, 0-9, _ and -
+WEBHOOK_HOST = "127.0.0.1"
+WEBHOOK_PORT = 8081
+WEBHOOK_PATH = "/telegram-webhook"
+
 # Replace with your desired storage location
 HUNTERS_STORAGE_PATH = "REPLACE_WITH_STORAGE_PATH"
 RANGES_HISTORY_FILE = os.path.join(HUNTERS_STORAGE_PATH, "ranges_history.json")
+RANGES_TAIL_FILE = os.path.join(HUNTERS_STORAGE_PATH, "ranges_tail.jsonl")
+RANGES_ROLLUP_FILE = os.path.join(HUNTERS_STORAGE_PATH, "ranges_rollup.json")
 LAST_UPDATE_FILE = os.path.join(HUNTERS_STORAGE_PATH, "last_update_id.txt")
+RATE_LIMIT_FILE = os.path.join(HUNTERS_STORAGE_PATH, "stats_rate_limits.json")
+CHART_CACHE_DIR = os.path.join(HUNTERS_STORAGE_PATH, "chart_cache")
+TELEGRAM_FILE_ID_CACHE_FILE = os.path.join(HUNTERS_STORAGE_PATH, "telegram_file_ids.json")
+
+# Shared Bot API client: keep-alive session, retries on 429/5xx, per-chat rate limiting
+# and re-sending previously uploaded images by file_id
+TELEGRAM = TelegramClient(BOT_TOKEN, api_base=TELEGRAM_API_BASE, file_id_cache=FileIdCache(TELEGRAM_FILE_ID_CACHE_FILE))
+
+# Rendered charts are cached by a hash of their inputs; bump the version when chart styling changes
+CHART_RENDER_PARAMS = {"version": 4}
+CHART_CACHE = ChartCache(CHART_CACHE_DIR)
+
+# Charts are rendered in memory and uploaded directly. Set this to a directory
+# to also keep a copy of every chart on disk.
+CHART_SINK_PATH = None
+
+# Daemon mode (--daemon): long-poll timeout and pause after a failed getUpdates
+POLL_TIMEOUT = 30
+POLL_ERROR_DELAY = 5
+
+# Webhook server limits, and how many recent update_ids are remembered to drop redeliveries
+WEBHOOK_MAX_BODY = 1024 * 1024
+WEBHOOK_READ_TIMEOUT = 10
+WEBHOOK_SEEN_UPDATES = 1000
+
+# Daemon mode renders /stats charts on this many processes; replies are sent from SEND_WORKERS threads
+RENDER_WORKERS = os.cpu_count() or 1
+SEND_WORKERS = 4
+
+# Admission control for /stats: token buckets of (burst size, seconds per extra request)
+# per chat and per Telegram user (kept in RATE_LIMIT_FILE between one-shot runs), a cap
+# on renders waiting or running in daemon mode, and how long a posted chart counts as
+# "just posted" instead of being posted again
+CHAT_RATE_LIMIT = (10, 30)
+USER_RATE_LIMIT = (3, 60)
+MAX_PENDING_RENDERS = 20
+RECENT_POST_SECONDS = 600
+
+# Cache warming (daemon/webhook modes): whenever new collector samples arrive, the charts of
+# the WARM_TOP_USERS users with the most ranges in the last 24 hours are rendered in the
+# background, when no /stats request is waiting. Renders not started within
+# WARM_BUDGET_SECONDS are dropped. Set WARM_UPLOAD_CHAT_ID to a private chat or channel
+# to also upload each warmed chart there once, so replies reuse Telegram's file_id.
+WARM_TOP_USERS = 10
+WARM_BUDGET_SECONDS = 300
+WARM_UPLOAD_CHAT_ID = None
+
+# Webhook mode has no poll loop, so the data is also refreshed this often without traffic
+WEBHOOK_REFRESH_SECONDS = 30
+
+# Samples older than this are dropped from the in-memory data, like the collector does
+RANGES_RETENTION_DAYS = 30
+
+# Usernames on the website are cut to this length, so longer queries also match the cut name
+USERNAME_MATCH_LENGTH = 10
+# Max number of "did you mean" suggestions
+MAX_SUGGESTIONS = 5
+# Max number of users one /stats request can compare in a single chart
+MAX_COMPARE_USERS = 4
+
+# Chart windows for "/stats <username> [window]": days covered, None for all the rollups hold.
+# Windows longer than WEEKLY_AFTER_DAYS are plotted per week instead of per day; the
+# rollups only keep day buckets for DAY_BUCKET_DAYS.
+STATS_WINDOWS = {"7d": 7, "30d": 30, "90d": 90, "all": None}
+DEFAULT_STATS_WINDOW = "30d"
+WEEKLY_AFTER_DAYS = min(92, DAY_BUCKET_DAYS)
 
 
 # =============================================================================
 # TELEGRAM API FUNCTIONS
 # =============================================================================
 def get_updates(offset=None, timeout=2):
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/getUpdates"
-    params = {"timeout": timeout}
-    if offset is not None:
-        params["offset"] = offset
     try:
-        r = requests.get(url, params=params, timeout=timeout+5)
-        r.raise_for_status()
-        data = r.json()
-        if not data["ok"]:
-            print(f"getUpdates ok=False: {data}")
-            return []
-        return data.get("result", [])
-    except Exception as e:
+        return TELEGRAM.get_updates(offset=offset, timeout=timeout)
+    except TelegramError as e:
         print(f"Error in get_updates: {e}")
         return []
 
@@ -66,110 +149,304 @@ def send_message(chat_id, text, thread_id=None):
     Sends a text message to a Telegram chat.
     If thread_id is provided, sends the message in the specific forum thread.
     """
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-    payload = {
-        "chat_id": chat_id,
-        "text": text
-    }
-    if thread_id is not None:
-        payload["message_thread_id"] = thread_id
-
     try:
-        r = requests.post(url, data=payload, timeout=2)
-        r.raise_for_status()
-    except Exception as e:
+        TELEGRAM.send_message(chat_id, text, thread_id=thread_id)
+    except TelegramError as e:
         print(f"Error in send_message: {e}")
 
 
-def send_photo(chat_id, photo_path, caption="", thread_id=None):
+def send_photo(chat_id, png, caption="", thread_id=None):
     """
-    Sends a photo to a Telegram chat.
+    Sends in-memory PNG bytes as a photo to a Telegram chat.
     If thread_id is provided, sends the photo in the specific forum thread.
     """
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendPhoto"
     try:
-        with open(photo_path, 'rb') as img:
-            payload = {
-                "chat_id": chat_id,
-                "caption": caption
-            }
-            if thread_id is not None:
-                payload["message_thread_id"] = thread_id
-
-            files = {"photo": img}
-            r = requests.post(url, data=payload, files=files, timeout=30)
-            r.raise_for_status()
-    except Exception as e:
+        TELEGRAM.send_photo(chat_id, png, caption=caption, thread_id=thread_id, filename="stats.png")
+    except TelegramError as e:
         print(f"Error in send_photo: {e}")
 
 
 # =============================================================================
-# LOAD AND PLOT DATA
+# RESIDENT DATASET
 # =============================================================================
-def load_ranges_history():
-    if not os.path.exists(RANGES_HISTORY_FILE):
-        print(f"{RANGES_HISTORY_FILE} does not exist.")
-        return {}
-    try:
-        with open(RANGES_HISTORY_FILE, "r") as f:
-            data = json.load(f)
-            return data.get("data", {})
-    except Exception as e:
-        print(f"Error loading {RANGES_HISTORY_FILE}: {e}")
-        return {}
-
-
-def calculate_overall_avg_speed(all_data, thirty_days_ago_ts):
+class RangesStore:
     """
-    Calculates the average speed across all users for the last 30 days,
-    excluding speeds <= 1.
-    Returns the overall average speed and the number of contributing users.
+    In-memory copy of ranges_history.json, and of the daily/weekly rollups in
+    ranges_rollup.json, that can be kept up to date cheaply.
+
+    The Hunters collector stamps the history with a "tick" counter and appends each run's
+    samples to ranges_tail.jsonl. refresh() applies only the new tail lines, which costs a
+    stat() when nothing changed. It reloads the whole history if it missed a tick (e.g. after
+    the tail was rotated) or, without a tail log, whenever the history file's mtime changes.
+    Tail samples are added to the rollups too. Every change bumps version and drops the
+    values memoized with derived().
     """
-    total_speed = 0
-    count = 0
-    contributing_users = set()
-    for user, entries in all_data.items():
-        user_contributed = False
-        for e in entries:
-            if len(e) != 3:
-                print(f"Invalid entry for user {user}: {e}")
-                continue
-            ts, r, s = e
-            if not isinstance(ts, (int, float)) or not isinstance(r, int) or not isinstance(s, (int, float)):
-                print(f"Incorrect data types for user {user}: {e}")
-                continue
-            if s <= 1:
+
+    def __init__(self, history_file=RANGES_HISTORY_FILE, tail_file=RANGES_TAIL_FILE, rollup_file=RANGES_ROLLUP_FILE):
+        self.history_file = history_file
+        self.tail_file = tail_file
+        self.rollup_file = rollup_file
+        self.data = {}
+        self.rollup = new_rollup()
+        self.tick = None
+        self.version = 0
+        self._derived = {}
+        self._history_mtime = None
+        self._tail_inode = None
+        self._tail_pos = 0
+
+    def reload(self):
+        """Parses the full history file. On a read error the current data is kept."""
+        try:
+            mtime = os.path.getmtime(self.history_file)
+            with open(self.history_file, "r") as f:
+                raw = json.load(f)
+        except FileNotFoundError:
+            print(f"{self.history_file} does not exist.")
+            return
+        except Exception as e:
+            print(f"Error loading {self.history_file}: {e}")
+            return
+
+        self.data = raw.get("data", {})
+        self.tick = raw.get("tick")
+        self._history_mtime = mtime
+        self._tail_inode = None
+        self._tail_pos = 0
+        self.rollup = self._load_rollup()
+        self._changed()
+        if self.tick is not None:
+            # Catch up on anything the collector appended after saving the history
+            if self._apply_tail() == "gap":
+                # The tail does not continue this history; watch the history file's mtime instead
+                print(f"{self.tail_file} does not continue the history, falling back to full reloads.")
+                self.tick = None
+
+    def refresh(self):
+        """Picks up new collector samples. Returns True if the data changed."""
+        if self.tick is not None and os.path.exists(self.tail_file):
+            status = self._apply_tail()
+            if status == "gap":
+                self.reload()
+            return status != "unchanged"
+
+        try:
+            mtime = os.path.getmtime(self.history_file)
+        except OSError:
+            return False
+        if mtime == self._history_mtime:
+            return False
+        self.reload()
+        return True
+
+    def _load_rollup(self):
+        """
+        Reads the rollups the collector saves next to the history. The collector writes them
+        first, so they are at least as new as the history; tail samples they already contain
+        are not added twice. Without them, they are built from the raw history in memory.
+        """
+        try:
+            with open(self.rollup_file, "r") as f:
+                rollup = json.load(f)
+        except FileNotFoundError:
+            rollup = None
+        except Exception as e:
+            print(f"Error loading {self.rollup_file}: {e}")
+            rollup = None
+        if rollup and self.tick is not None and (rollup.get("tick") or 0) >= self.tick:
+            return rollup
+        print(f"No rollups matching {self.history_file}, building them from the history in memory.")
+        return build_rollup(self.data, self.tick)
+
+    def derived(self, key, compute):
+        """Returns compute(data), memoized until the data changes."""
+        if key not in self._derived:
+            self._derived[key] = compute(self.data)
+        return self._derived[key]
+
+    def _changed(self):
+        self.version += 1
+        self._derived.clear()
+
+    def _apply_tail(self):
+        """Applies new tail lines in tick order. Returns "applied", "unchanged" or "gap"."""
+        try:
+            st = os.stat(self.tail_file)
+        except OSError:
+            return "unchanged"
+        if st.st_ino != self._tail_inode or st.st_size < self._tail_pos:
+            # Rotated or replaced: read it again from the start, seen ticks are skipped
+            self._tail_inode = st.st_ino
+            self._tail_pos = 0
+        if st.st_size == self._tail_pos:
+            return "unchanged"
+
+        with open(self.tail_file, "rb") as f:
+            f.seek(self._tail_pos)
+            chunk = f.read()
+
+        status = "unchanged"
+        for line in chunk.splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                break  # The collector is still writing this line
+            self._tail_pos += len(line)
+            try:
+                entry = json.loads(line)
+                tick = entry["tick"]
+            except (ValueError, KeyError) as e:
+                print(f"Invalid line in {self.tail_file}: {e}")
+                return "gap"
+            if tick <= self.tick:
                 continue
-            if ts >= thirty_days_ago_ts:
-                total_speed += s
-                count += 1
-                user_contributed = True
-        if user_contributed:
-            contributing_users.add(user)
-    return (total_speed / count) if count > 0 else 0, len(contributing_users)
+            if tick != self.tick + 1:
+                return "gap"
+            self._apply_samples(entry["ts"], entry["samples"], tick)
+            self.tick = tick
+            status = "applied"
+
+        if status == "applied":
+            self._changed()
+        return status
+
+    def _apply_samples(self, ts, samples, tick):
+        for user, (submitted_ranges, speed) in samples.items():
+            self.data.setdefault(user, []).append([ts, submitted_ranges, speed])
+        if tick > (self.rollup["tick"] or 0):
+            for user, (submitted_ranges, speed) in samples.items():
+                add_sample(self.rollup, user, ts, submitted_ranges, speed)
+            prune_days(self.rollup, datetime.fromtimestamp(ts).date())
+            self.rollup["tick"] = tick
+
+        cutoff = time.time() - RANGES_RETENTION_DAYS * 86400
+        for entries in self.data.values():
+            expired = 0
+            while expired < len(entries) and entries[expired][0] < cutoff:
+                expired += 1
+            if expired:
+                del entries[:expired]
 
 
-def calculate_daily_overall_avg_speed(all_data, start_date, end_date):
+# =============================================================================
+# USERNAME INDEX
+# =============================================================================
+def edit_distance(a, b):
+    """Levenshtein distance between two strings."""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        current = [i]
+        for j, cb in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+class UsernameIndex:
     """
-    Calculates the daily overall average speed across all users for the given date range.
-    Returns a list of daily average speeds.
+    Case-insensitive lookup of usernames, built once per data version.
+    Exact and prefix matches use a sorted list and bisect; typo-tolerant matches use a
+    BK-tree over edit distance, so neither scans every username.
     """
-    daily_speed = defaultdict(list)
-    for user, entries in all_data.items():
-        for e in entries:
-            ts, r, s = e
-            entry_date = datetime.fromtimestamp(ts).date()
-            if start_date <= entry_date <= end_date and s > 1:
-                daily_speed[entry_date].append(s)
 
-    daily_avg_speed = []
-    date_range = [start_date + timedelta(days=i) for i in range(30)]
-    for date in date_range:
-        speeds = daily_speed.get(date, [])
-        avg = sum(speeds) / len(speeds) if speeds else 0
-        daily_avg_speed.append(avg)
+    def __init__(self, usernames):
+        self._by_lower = defaultdict(list)
+        for name in sorted(usernames):
+            self._by_lower[name.lower()].append(name)
+        self._sorted = sorted(self._by_lower)
+        self._tree = None
+        for lower in self._sorted:
+            self._tree_add(lower)
+
+    def lookup(self, query):
+        """
+        Returns (username, []) when the query identifies one user, otherwise
+        (None, candidates) with up to MAX_SUGGESTIONS ranked suggestions.
+        """
+        query = query.strip()
+        lower = query.lower()
+        short = lower[:USERNAME_MATCH_LENGTH]
+        for key in dict.fromkeys((lower, short)):
+            names = self._by_lower.get(key, [])
+            if len(names) == 1 or query in names:
+                return (query if query in names else names[0]), []
+            if names:
+                return None, names[:MAX_SUGGESTIONS]
+
+        prefixed = self.prefix_matches(short)
+        if len(prefixed) == 1:
+            return prefixed[0], []
+        if prefixed:
+            return None, prefixed[:MAX_SUGGESTIONS]
+        return None, self.fuzzy_matches(lower)[:MAX_SUGGESTIONS]
+
+    def prefix_matches(self, prefix):
+        """Usernames starting with prefix, shortest first."""
+        start = bisect.bisect_left(self._sorted, prefix)
+        matches = []
+        for lower in self._sorted[start:]:
+            if not lower.startswith(prefix):
+                break
+            matches.extend(self._by_lower[lower])
+        return sorted(matches, key=lambda name: (len(name), name.lower()))
+
+    def fuzzy_matches(self, query, max_distance=None):
+        """Usernames within max_distance edits of query (1 for short queries, else 2), closest first."""
+        if max_distance is None:
+            max_distance = 1 if len(query) <= 4 else 2
+        # Compare against the name as typed and as cut by the website
+        found = self._tree_search(query, max_distance)
+        for word, distance in self._tree_search(query[:USERNAME_MATCH_LENGTH], max_distance).items():
+            found[word] = min(distance, found.get(word, distance))
+        ranked = sorted(found, key=lambda word: (found[word], abs(len(word) - len(query)), word))
+        return [name for word in ranked for name in self._by_lower[word]]
+
+    def _tree_search(self, query, max_distance):
+        """Returns {word: distance} for every indexed word within max_distance of query."""
+        found = {}
+        stack = [self._tree] if self._tree else []
+        while stack:
+            word, children = stack.pop()
+            distance = edit_distance(query, word)
+            if distance <= max_distance:
+                found[word] = distance
+            # Triangle inequality: only subtrees at distance +-max_distance can hold matches
+            for child_distance, child in children.items():
+                if abs(child_distance - distance) <= max_distance:
+                    stack.append(child)
+        return found
+
+    def _tree_add(self, word):
+        if self._tree is None:
+            self._tree = (word, {})
+            return
+        node_word, children = self._tree
+        while True:
+            distance = edit_distance(word, node_word)
+            if distance not in children:
+                children[distance] = (word, {})
+                return
+            node_word, children = children[distance]
 
-    return daily_avg_speed
+
+# =============================================================================
+# LOAD AND PLOT DATA
+# =============================================================================
+def top_active_users(all_data, top_n, time_range=86400):
+    """
+    Returns up to top_n usernames ordered by the ranges they submitted within the last
+    time_range seconds, like the daily heroes. Entries are in time order, so only the
+    recent end of each user's list is read.
+    """
+    cutoff = time.time() - time_range
+    activity = []
+    for user, entries in all_data.items():
+        first = len(entries)
+        while first > 0 and entries[first - 1][0] >= cutoff:
+            first -= 1
+        if len(entries) - first > 1:
+            activity.append((entries[-1][1] - entries[first][1], user))
+    return [user for range_diff, user in heapq.nlargest(top_n, activity) if range_diff > 0]
 
 
 def moving_average(data, window_size=7):
@@ -184,258 +461,927 @@ def format_full_number(x, pos):
     return f'{int(x)}'
 
 
-def calculate_daily_ranges(entries, start_date, end_date):
+def window_title(window):
+    """Chart title part for a /stats window, e.g. "Last 90 Days"."""
+    days = STATS_WINDOWS[window]
+    return f"Last {days} Days" if days else "All Time"
+
+
+def stats_window(window, rollup, today):
     """
-    Calculates daily ranges by computing the difference between the first and last 'r' of each day.
+    Returns (period, starts) for a /stats window: whether its chart has a point per "day"
+    or per "week" (windows longer than WEEKLY_AFTER_DAYS), and the ISO start dates of the
+    points, oldest first, up to today.
     """
-    daily_first_r = {}
-    daily_last_r = {}
+    days = STATS_WINDOWS[window]
+    first = today - timedelta(days=days - 1) if days else (first_day(rollup) or today)
+    period = "day" if (today - first).days < WEEKLY_AFTER_DAYS else "week"
+    return period, period_starts(first, today, period)
 
-    # Sort entries by timestamp
-    sorted_entries = sorted(entries, key=lambda x: x[0])
 
-    for e in sorted_entries:
-        ts, r, s = e
-        entry_date = datetime.fromtimestamp(ts).date()
-        if not (start_date <= entry_date <= end_date):
-            continue
+def prepare_overall_stats(rollup, period, starts):
+    """Pool-wide average speed per point, and the number of users with speed samples since the first one."""
+    _, avg_speed = series(rollup["pool"][period], starts)
+    return {"avg_speed": avg_speed, "user_count": active_users(rollup, starts[0])}
 
-        if entry_date not in daily_first_r:
-            daily_first_r[entry_date] = r
-        daily_last_r[entry_date] = r
 
-    daily_ranges = {}
-    for date in daily_first_r:
-        daily_ranges[date] = daily_last_r[date] - daily_first_r[date]
+def prepare_user_stats(username, rollup, window, period, starts, overall):
+    """
+    Computes the series plot_user_stats draws for a window from the rollups: average speed
+    and ranges per day or week, next to the pool-wide series in overall (see
+    prepare_overall_stats). The cost depends on the number of points, not on how much
+    history they cover. Returns a dict of plain lists (usable as a chart cache key).
+    """
+    total_ranges, avg_speed = series(rollup["users"].get(username, {}).get(period, {}), starts)
+    return {
+        "username": username,
+        "title": window_title(window),
+        "period": period,
+        "dates": starts,
+        "avg_speed": avg_speed,
+        "total_ranges": total_ranges,
+        "overall_avg_speed": overall["avg_speed"],
+        "overall_user_count": overall["user_count"]
+    }
 
-    return daily_ranges
 
+def period_axis(ax, points, period):
+    """Date ticks for points per day or per week: on every point, or every few past a month's worth."""
+    interval = max(1, math.ceil(points / 31))
+    if period == "week":
+        ax.xaxis.set_major_locator(mdates.WeekdayLocator(byweekday=mdates.MO, interval=interval))
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+    else:
+        ax.xaxis.set_major_locator(mdates.DayLocator(interval=interval))
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%m-%d'))
 
-def plot_user_stats(username, entries, overall_avg_speed, overall_user_count, daily_overall_avg_speed):
+
+def padded_moving_average(values, window_size=7):
+    """moving_average() padded with NaN in front, so it lines up with the points."""
+    averages = moving_average(values, window_size=window_size)
+    return np.concatenate((np.full(len(values) - len(averages), np.nan), averages))
+
+
+class UserStatsTemplate:
+    """
+    The figure plot_user_stats draws, built once per render worker for a number of points
+    per day or week: the speed panel with its two lines and legend, the ranges panel with
+    one bar and one value label per point, and the date locators and formatters. render()
+    only updates the artists' data, so no figure, axes or text objects are created per chart.
+    """
+
+    def __init__(self, points, period):
+        self.fig = Figure(figsize=(15, 14), dpi=150)
+        step = 7 if period == "week" else 1
+        unit = period.title()
+
+        # Placeholder data as wide as real charts get, so the layout computed below fits them
+        start = datetime(2000, 1, 3)
+        times = [start + timedelta(days=i * step) for i in range(points)]
+        placeholder = [1000000] * points
+
+        # Subplot 1: Speed (user + overall avg)
+        ax1 = self.ax1 = self.fig.add_subplot(2, 1, 1)
+        self.speed_line, = ax1.plot(times, placeholder, color="blue", linestyle='-', linewidth=2,
+                                    label="Your Speed (BK/s)")
+        self.overall_line, = ax1.plot(times, placeholder, color="red", linewidth=2, linestyle='--',
+                                      label=f"Overall Average Speed (7-{unit} MA)")
+        ax1.set_title(" ")
+        ax1.set_ylabel("BK/s")
+        ax1.grid(True, which='both', linestyle='--', linewidth=0.5)
+        period_axis(ax1, points, period)
+        self.legend = ax1.legend(title="Contributing Users: 0")
+        ax1.tick_params(axis='x', labelbottom=False)
+
+        # Subplot 2: Ranges (bar + moving average), with a label on each bar
+        ax2 = self.ax2 = self.fig.add_subplot(2, 1, 2, sharex=ax1)
+        self.bars = ax2.bar(times, placeholder, width=0.8 * step, color="green", label="Ranges")
+        self.ranges_line, = ax2.plot(times, placeholder, color="orange", linewidth=2, linestyle='-',
+                                     label=f"7-{unit} Moving Average")
+        self.labels = [
+            ax2.text(0, 0, "", ha='center', va='bottom', fontsize=8, color='black', rotation=90)
+            for _ in range(points)
+        ]
+        ax2.set_title(" ")
+        ax2.set_ylabel("Ranges")
+        ax2.grid(True, which='both', linestyle='--', linewidth=0.5)
+        period_axis(ax2, points, period)
+        ax2.tick_params(axis='x', rotation=90)
+        ax2.legend()
+        ax2.yaxis.set_major_formatter(FuncFormatter(format_full_number))
+
+        self.fig.tight_layout()
+
+    def render(self, inputs):
+        username = inputs["username"]
+        title = inputs["title"]
+        times = mdates.date2num([datetime.strptime(d, "%Y-%m-%d") for d in inputs["dates"]])
+        total_ranges = inputs["total_ranges"]
+
+        self.speed_line.set_data(times, inputs["avg_speed"])
+        self.overall_line.set_data(times, padded_moving_average(inputs["overall_avg_speed"]))
+        self.ax1.set_title(f"{username} - Speed ({title})")
+        self.legend.set_title(f"Contributing Users: {inputs['overall_user_count']}")
+
+        for bar, label, x, range_value in zip(self.bars, self.labels, times, total_ranges):
+            bar.set_x(x - bar.get_width() / 2)
+            bar.set_height(range_value)
+            label.set_position((x, range_value))
+            label.set_text(f'{range_value}')
+            label.set_visible(range_value > 0)
+        self.ranges_line.set_data(times, padded_moving_average(total_ranges))
+        self.ax2.set_title(f"{username} - Ranges ({title})")
+
+        for ax in (self.ax1, self.ax2):
+            ax.relim()
+            ax.autoscale_view()
+
+        sink_path = (os.path.join(CHART_SINK_PATH, f"{username}_stats_{len(times)}{inputs['period']}.png")
+                     if CHART_SINK_PATH else None)
+        # Two dense panels with daily tick labels, so allow a bit more than the default size
+        return figure_to_png(self.fig, max_side=1600, sink_path=sink_path)
+
+
+def plot_user_stats(inputs):
     """
     Plots the user's speed as a line chart and "Average Speed" as a moving average line.
     Also plots ranges as a bar chart with a moving average.
     Includes the number of contributing users in the legend title.
-    Ensures each day within the last 30 days is represented on the x-axis.
+    Ensures each day (or week) of the window is represented on the x-axis.
+    The figure is a UserStatsTemplate reused across renders in the same process.
+    """
+    points = len(inputs["dates"])
+    period = inputs["period"]
+    template = figure_template(("plot_user_stats", points, period), lambda: UserStatsTemplate(points, period))
+    return template.render(inputs)
+
+
+def prepare_compare_stats(user_inputs):
+    """
+    Combines the prepare_user_stats() inputs of several users into the inputs of one
+    comparison chart. The pool-wide series are the same for everyone, so they are kept once.
+    """
+    first = user_inputs[0]
+    return {
+        "usernames": [inputs["username"] for inputs in user_inputs],
+        "title": first["title"],
+        "period": first["period"],
+        "dates": first["dates"],
+        "avg_speed": [inputs["avg_speed"] for inputs in user_inputs],
+        "total_ranges": [inputs["total_ranges"] for inputs in user_inputs],
+        "overall_avg_speed": first["overall_avg_speed"],
+        "overall_user_count": first["overall_user_count"]
+    }
+
+
+class CompareStatsTemplate:
+    """
+    The figure plot_compare_stats draws, built once per render worker for a number of points
+    per day or week and of users: one speed line per user plus the overall average in the
+    top panel, and one group of bars per point (a bar per user) in the bottom panel.
+    render() only updates the artists' data and labels.
+    """
+
+    def __init__(self, points, period, user_count):
+        self.fig = Figure(figsize=(15, 14), dpi=150)
+        colors = [f"C{i}" for i in range(user_count)]
+        step = 7 if period == "week" else 1
+
+        # Placeholder data as wide as real charts get, so the layout computed below fits them
+        start = datetime(2000, 1, 3)
+        times = [start + timedelta(days=i * step) for i in range(points)]
+        placeholder = [1000000] * points
+
+        # Subplot 1: Speed (one line per user + overall avg)
+        ax1 = self.ax1 = self.fig.add_subplot(2, 1, 1)
+        self.speed_lines = [
+            ax1.plot(times, placeholder, color=color, linestyle='-', linewidth=2, label=" ")[0]
+            for color in colors
+        ]
+        self.overall_line, = ax1.plot(times, placeholder, color="red", linewidth=2, linestyle='--',
+                                      label=f"Overall Average Speed (7-{period.title()} MA)")
+        ax1.set_title(" ")
+        ax1.set_ylabel("BK/s")
+        ax1.grid(True, which='both', linestyle='--', linewidth=0.5)
+        period_axis(ax1, points, period)
+        self.legend1 = ax1.legend(title="Contributing Users: 0")
+        ax1.tick_params(axis='x', labelbottom=False)
+
+        # Subplot 2: Ranges, the users' bars side by side within each day
+        ax2 = self.ax2 = self.fig.add_subplot(2, 1, 2, sharex=ax1)
+        width = 0.8 * step / user_count
+        self.bar_groups = [
+            ax2.bar(times, placeholder, width=width, color=color, label=" ")
+            for color in colors
+        ]
+        self.offsets = [(i - (user_count - 1) / 2) * width for i in range(user_count)]
+        ax2.set_title(" ")
+        ax2.set_ylabel("Ranges")
+        ax2.grid(True, which='both', linestyle='--', linewidth=0.5)
+        period_axis(ax2, points, period)
+        ax2.tick_params(axis='x', rotation=90)
+        self.legend2 = ax2.legend(ncols=user_count)
+        ax2.yaxis.set_major_formatter(FuncFormatter(format_full_number))
+
+        self.fig.tight_layout()
+
+    def render(self, inputs):
+        usernames = inputs["usernames"]
+        times = mdates.date2num([datetime.strptime(d, "%Y-%m-%d") for d in inputs["dates"]])
+
+        for line, speeds in zip(self.speed_lines, inputs["avg_speed"]):
+            line.set_data(times, speeds)
+        self.overall_line.set_data(times, padded_moving_average(inputs["overall_avg_speed"]))
+        self.ax1.set_title(f"Speed Comparison ({inputs['title']})")
+        self.legend1.set_title(f"Contributing Users: {inputs['overall_user_count']}")
+
+        for bars, offset, ranges in zip(self.bar_groups, self.offsets, inputs["total_ranges"]):
+            for bar, x, range_value in zip(bars, times, ranges):
+                bar.set_x(x + offset - bar.get_width() / 2)
+                bar.set_height(range_value)
+
+        # The legends list the users in drawing order, first in each panel
+        for legend in (self.legend1, self.legend2):
+            for text, username in zip(legend.get_texts(), usernames):
+                text.set_text(username)
+        self.ax2.set_title(f"Ranges Comparison ({inputs['title']})")
+
+        for ax in (self.ax1, self.ax2):
+            ax.relim()
+            ax.autoscale_view()
+
+        sink_path = (os.path.join(CHART_SINK_PATH, f"compare_{'_'.join(usernames)}.png")
+                     if CHART_SINK_PATH else None)
+        return figure_to_png(self.fig, max_side=1600, sink_path=sink_path)
+
+
+def plot_compare_stats(inputs):
+    """
+    Plots several users in one chart: their speeds as overlaid lines next to the overall
+    7-day average, and their daily ranges as grouped bars.
+    The figure is a CompareStatsTemplate reused across renders in the same process.
+    """
+    points = len(inputs["dates"])
+    period = inputs["period"]
+    user_count = len(inputs["usernames"])
+    template = figure_template(("plot_compare_stats", points, period, user_count),
+                               lambda: CompareStatsTemplate(points, period, user_count))
+    return template.render(inputs)
+
+
+def render_cached(chart_name, plot, inputs):
+    """Returns the PNG bytes for the prepared inputs, rendering only on a chart cache miss."""
+    key = chart_key(chart_name, inputs, CHART_RENDER_PARAMS)
+    cached_png = CHART_CACHE.get(key)
+    if cached_png:
+        return cached_png
+    return CHART_CACHE.put(key, plot(inputs))
+
+
+# =============================================================================
+# USER SUMMARY
+# =============================================================================
+def rank_by_total_ranges(all_data):
+    """Maps each user with entries to their rank (1 = most ranges) by latest total ranges."""
+    totals = sorted(((entries[-1][1], user) for user, entries in all_data.items() if entries), reverse=True)
+    return {user: rank for rank, (total, user) in enumerate(totals, start=1)}
+
+
+def ranges_since(entries, cutoff):
+    """
+    Ranges submitted since the cutoff timestamp: latest total minus the total of the last
+    sample before it, or of the first sample after it for a user who joined since.
     """
     if not entries:
-        return None
+        return 0
+    first = len(entries)
+    while first > 0 and entries[first - 1][0] >= cutoff:
+        first -= 1
+    baseline = entries[first - 1] if first > 0 else entries[0]
+    return entries[-1][1] - baseline[1]
+
+
+def milestone_status(total_ranges):
+    """Returns (reached milestone or None, next milestone or None) for a total."""
+    reached, upcoming = None, None
+    for milestone in MILESTONES:
+        if total_ranges >= milestone["threshold"]:
+            reached = milestone
+            break
+        upcoming = milestone
+    return reached, upcoming
+
 
-    # Sort entries by timestamp
-    entries = sorted(entries, key=lambda x: x[0])
-
-    # Define the time interval for the last 30 days
-    end_date = datetime.now().date()
-    start_date = end_date - timedelta(days=29)
-    date_range = [start_date + timedelta(days=i) for i in range(30)]
-
-    # Initialize dictionaries for daily data
-    daily_speed = defaultdict(list)
-    daily_ranges_calculated = calculate_daily_ranges(entries, start_date, end_date)
-
-    for e in entries:
-        ts, r, s = e
-        entry_date = datetime.fromtimestamp(ts).date()
-        if start_date <= entry_date <= end_date:
-            if s > 1:
-                daily_speed[entry_date].append(s)
-
-    # Calculate daily average speed
-    avg_speed_per_day = []
-    for date in date_range:
-        speeds = daily_speed.get(date, [])
-        avg = sum(speeds) / len(speeds) if speeds else 0
-        avg_speed_per_day.append(avg)
-
-    # Calculate daily total ranges
-    total_ranges_per_day = [daily_ranges_calculated.get(date, 0) for date in date_range]
-
-    # Calculate moving average for ranges
-    ranges_moving_avg = moving_average(total_ranges_per_day, window_size=7)
-    ranges_moving_avg = np.concatenate((
-        np.full(len(total_ranges_per_day) - len(ranges_moving_avg), np.nan),
-        ranges_moving_avg
-    ))
-
-    # Calculate moving average for overall average speed
-    overall_moving_avg = moving_average(daily_overall_avg_speed, window_size=7)
-    overall_moving_avg = np.concatenate((
-        np.full(len(daily_overall_avg_speed) - len(overall_moving_avg), np.nan),
-        overall_moving_avg
-    ))
-
-    times = [datetime.combine(date, datetime.min.time()) for date in date_range]
-
-    plt.figure(figsize=(15, 14), dpi=150)
-
-    # Subplot 1: Speed (user + overall avg)
-    ax1 = plt.subplot(2, 1, 1)
-    ax1.plot(
-        times,
-        avg_speed_per_day,
-        color="blue",
-        linestyle='-',
-        linewidth=2,
-        label="Your Speed (BK/s)"
-    )
-    ax1.plot(
-        times,
-        overall_moving_avg,
-        color="red",
-        linewidth=2,
-        linestyle='--',
-        label="Overall Average Speed (7-Day MA)"
-    )
-    ax1.set_title(f"{username} - Speed (Last 30 Days)")
-    ax1.set_ylabel("BK/s")
-    ax1.grid(True, which='both', linestyle='--', linewidth=0.5)
-    ax1.xaxis.set_major_formatter(mdates.DateFormatter('%m-%d'))
-    ax1.xaxis.set_major_locator(mdates.DayLocator())
-    ax1.legend(title=f"Contributing Users: {overall_user_count}")
-    plt.setp(ax1.get_xticklabels(), visible=False)
-
-    # Subplot 2: Ranges (bar + moving average)
-    ax2 = plt.subplot(2, 1, 2, sharex=ax1)
-    bars = ax2.bar(
-        times,
-        total_ranges_per_day,
-        color="green",
-        label="Ranges"
-    )
-    ax2.plot(
-        times,
-        ranges_moving_avg,
-        color="orange",
-        linewidth=2,
-        linestyle='-',
-        label="7-Day Moving Average"
-    )
-    # Add labels to each bar
-    for bar, range_value in zip(bars, total_ranges_per_day):
-        height = bar.get_height()
-        if height > 0:
-            ax2.text(
-                bar.get_x() + bar.get_width() / 2,
-                height,
-                f'{range_value}',
-                ha='center',
-                va='bottom',
-                fontsize=8,
-                color='black',
-                rotation=90
-            )
-
-    ax2.set_title(f"{username} - Ranges (Last 30 Days)")
-    ax2.set_ylabel("Ranges")
-    ax2.grid(True, which='both', linestyle='--', linewidth=0.5)
-    ax2.xaxis.set_major_formatter(mdates.DateFormatter('%m-%d'))
-    ax2.xaxis.set_major_locator(mdates.DayLocator())
-    ax2.tick_params(axis='x', rotation=90)
-    ax2.legend()
-    ax2.yaxis.set_major_formatter(FuncFormatter(format_full_number))
-
-    plt.tight_layout()
-    filename = f"/tmp/{username}_stats_{int(time.time())}.png"
-    plt.savefig(filename)
-    plt.close()
-    return filename
+def average_speed(entries):
+    """Average speed over the entries, ignoring speeds <= 1 like the charts do."""
+    speeds = [s for ts, r, s in entries if s > 1]
+    return sum(speeds) / len(speeds) if speeds else 0
+
+
+def format_user_summary(username, entries, ranking, window):
+    """
+    Builds the text reply sent before the chart: total ranges and rank, ranges submitted
+    in the last 24 hours/7 days/30 days, current and 30-day average speed, and milestone.
+    """
+    now = time.time()
+    total = entries[-1][1]
+    avg_speed = average_speed(entries)
+
+    lines = [
+        f"📊 Stats for {username}",
+        f"Total ranges: {total:,} (rank {ranking.get(username, '?')} of {len(ranking)})",
+        f"Last 24h: +{ranges_since(entries, now - 86400):,} | 7d: +{ranges_since(entries, now - 7 * 86400):,}"
+        f" | 30d: +{ranges_since(entries, now - 30 * 86400):,}",
+        f"Speed: {entries[-1][2]:.2f} BK/s now, {avg_speed:.2f} BK/s average (30d)",
+    ]
+
+    reached, upcoming = milestone_status(total)
+    milestone = f"{reached['emoji']} {reached['name']}" if reached else "none yet"
+    if upcoming:
+        milestone += f", {upcoming['threshold'] - total:,} ranges to {upcoming['name']} {upcoming['emoji']}"
+    lines.append(f"Milestone: {milestone}")
+    lines.append(f"The chart ({window_title(window)}) follows shortly.")
+    return "\n".join(lines)
+
+
+def format_compare_summary(usernames, data, ranking, window):
+    """
+    Builds the text reply sent before a comparison chart: one line per user with total
+    ranges and rank, ranges submitted in the last 24 hours and 30 days, and average speed.
+    """
+    now = time.time()
+    lines = [f"📊 Comparing {len(usernames)} users"]
+    for username in usernames:
+        entries = data[username]
+        lines.append(
+            f"{username}: {entries[-1][1]:,} ranges (rank {ranking.get(username, '?')}) | "
+            f"24h: +{ranges_since(entries, now - 86400):,} | 30d: +{ranges_since(entries, now - 30 * 86400):,} | "
+            f"{average_speed(entries):.2f} BK/s average"
+        )
+    lines.append(f"The comparison chart ({window_title(window)}) follows shortly.")
+    return "\n".join(lines)
 
 
 # =============================================================================
 # COMMAND HANDLING
 # =============================================================================
-def handle_stats_command(incoming_chat_id, full_user, data, incoming_thread_id=None):
+def reply_in_official_thread(incoming_chat_id, incoming_thread_id, official_text, redirect_text):
     """
-    Handles the /stats command.
-    incoming_chat_id and incoming_thread_id are kept for compatibility.
+    Posts official_text in the official stats thread. Requests from other chats or threads
+    also get redirect_text, pointing them there.
     """
-    short_user = full_user[:10].lower()
-    found_key = None
+    send_message(OFFICIAL_CHAT_ID, official_text, thread_id=OFFICIAL_THREAD_ID)
 
-    # Try to match user using startswith (case-insensitive)
-    for k in data.keys():
-        if k.lower().startswith(short_user):
-            found_key = k
-            break
+    if (incoming_chat_id != OFFICIAL_CHAT_ID) or (incoming_thread_id != OFFICIAL_THREAD_ID):
+        send_message(incoming_chat_id, redirect_text, thread_id=incoming_thread_id)
+
+
+def prepare_stats_request(full_user, store, window):
+    """
+    Resolves the requested user and prepares the chart inputs for a STATS_WINDOWS window,
+    which is cheap compared to rendering. Returns (found_key, inputs, None), or
+    (found_key, None, (official_text, redirect_text)) when there is nothing to render.
+    """
+    data = store.data
+    index = store.derived("username_index", UsernameIndex)
+    found_key, candidates = index.lookup(full_user)
 
     if not found_key:
-        message = (
-            f"Hello! We couldn't find the user '{full_user}'.\n"
-            "Make sure you're using the exact username/nickname from the website."
-        )
-        send_message(OFFICIAL_CHAT_ID, message, thread_id=OFFICIAL_THREAD_ID)
-        
-        if (incoming_chat_id != OFFICIAL_CHAT_ID) or (incoming_thread_id != OFFICIAL_THREAD_ID):
-            send_message(
-                incoming_chat_id,
-                "We couldn't find that user. See info posted in the official stats thread.",
-                thread_id=incoming_thread_id
-            )
-        return
+        message = f"Hello! We couldn't find the user '{full_user}'.\n"
+        if candidates:
+            message += f"Did you mean: {', '.join(candidates)}?\n"
+        message += "Make sure you're using the exact username/nickname from the website."
+        return None, None, (message, "We couldn't find that user. See info posted in the official stats thread.")
 
     entries = data[found_key]
     if not entries:
-        send_message(OFFICIAL_CHAT_ID, f"No entries found for {found_key}", thread_id=OFFICIAL_THREAD_ID)
-        
-        if (incoming_chat_id != OFFICIAL_CHAT_ID) or (incoming_thread_id != OFFICIAL_THREAD_ID):
-            send_message(
-                incoming_chat_id,
-                "No entries found",
-                thread_id=incoming_thread_id
-            )
+        return found_key, None, (f"No entries found for {found_key}", "No entries found")
+
+    return found_key, user_stats_inputs(found_key, store, window), None
+
+
+def prepare_compare_request(names, store, window):
+    """
+    Resolves several requested users in one pass over the username index and combines
+    their chart inputs for a window. Returns (usernames, inputs, None), or (None, None,
+    (official_text, redirect_text)) if any name is unknown. Names resolving to the same
+    user count once.
+    """
+    index = store.derived("username_index", UsernameIndex)
+    usernames, problems = [], []
+    for name in names:
+        found_key, candidates = index.lookup(name)
+        if not found_key:
+            problems.append(f"'{name}'" + (f" (did you mean: {', '.join(candidates)}?)" if candidates else ""))
+        elif not store.data[found_key]:
+            problems.append(f"'{name}' (no entries)")
+        elif found_key not in usernames:
+            usernames.append(found_key)
+
+    if problems:
+        message = (f"Hello! We couldn't find: {'; '.join(problems)}.\n"
+                   "Make sure you're using the exact usernames/nicknames from the website.")
+        return None, None, (message, "We couldn't find some of those users. See info posted in the official stats thread.")
+
+    inputs = prepare_compare_stats([user_stats_inputs(username, store, window) for username in usernames])
+    return usernames, inputs, None
+
+
+def user_stats_inputs(found_key, store, window):
+    """
+    Returns the plot_user_stats inputs for a user and window, read from the rollups. They,
+    and the pool-wide series they include, are computed once per data version, day and
+    window, and shared by every /stats request (single or comparison) and by cache warming.
+    """
+    today = datetime.now().date()
+    period, starts = store.derived(("stats_window", window, today), lambda d: stats_window(window, store.rollup, today))
+    overall = store.derived(("overall_stats", window, today), lambda d: prepare_overall_stats(store.rollup, period, starts))
+    return store.derived(("user_stats", found_key, window, today), lambda d: prepare_user_stats(
+        found_key, store.rollup, window, period, starts, overall))
+
+
+def stats_label(usernames, window):
+    """How replies and captions name a /stats chart, e.g. "alice, bob (Last 90 Days)"."""
+    return f"{', '.join(usernames)} ({window_title(window)})"
+
+
+RECENT_POSTS = {}   # chart key -> time the chart was posted in the official thread
+RECENT_POSTS_LOCK = threading.Lock()
+
+
+def claim_official_post(key):
+    """Returns True if the chart with this key was not posted recently, and records it as posted now."""
+    now = time.time()
+    with RECENT_POSTS_LOCK:
+        for old_key in [k for k, posted in RECENT_POSTS.items() if now - posted > RECENT_POST_SECONDS]:
+            del RECENT_POSTS[old_key]
+        if key in RECENT_POSTS:
+            return False
+        RECENT_POSTS[key] = now
+        return True
+
+
+def release_official_post(key):
+    """Forgets a claimed post that was not made, so the next request posts it."""
+    with RECENT_POSTS_LOCK:
+        RECENT_POSTS.pop(key, None)
+
+
+def deliver_user_stats(label, png):
+    """Posts the rendered chart in the official thread, after the text summary."""
+    if not png:
+        send_message(OFFICIAL_CHAT_ID, f"Sorry, the chart for {label} could not be rendered.",
+                     thread_id=OFFICIAL_THREAD_ID)
         return
+    send_photo(OFFICIAL_CHAT_ID, png, caption=f"Stats for {label}", thread_id=OFFICIAL_THREAD_ID)
 
-    end_date = datetime.now().date()
-    start_date = end_date - timedelta(days=29)
 
-    thirty_days_ago_ts = time.time() - (30 * 86400)
-    overall_avg_speed, overall_user_count = calculate_overall_avg_speed(data, thirty_days_ago_ts)
-    daily_overall_avg_speed = calculate_daily_overall_avg_speed(data, start_date, end_date)
+def deliver_compare_stats(label, png):
+    """Posts the rendered comparison chart in the official thread, after the text summary."""
+    if not png:
+        send_message(OFFICIAL_CHAT_ID, f"Sorry, the comparison chart for {label} could not be rendered.",
+                     thread_id=OFFICIAL_THREAD_ID)
+        return
+    send_photo(OFFICIAL_CHAT_ID, png, caption=f"Comparison of {label}", thread_id=OFFICIAL_THREAD_ID)
 
-    png_path = plot_user_stats(found_key, entries, overall_avg_speed, overall_user_count, daily_overall_avg_speed)
-    if not png_path:
-        send_message(OFFICIAL_CHAT_ID, f"No recent data (within 30 days) for {found_key}", thread_id=OFFICIAL_THREAD_ID)
 
-        if (incoming_chat_id != OFFICIAL_CHAT_ID) or (incoming_thread_id != OFFICIAL_THREAD_ID):
-            send_message(
-                incoming_chat_id,
-                "No recent data for that user. See info posted in the official stats thread.",
-                thread_id=incoming_thread_id
-            )
+def handle_stats_command(incoming_chat_id, full_user, store, incoming_thread_id=None, render_queue=None):
+    """
+    Handles the /stats command.
+    A text summary is posted right away from the in-memory data; the chart follows once
+    rendered. With a render_queue (daemon mode) it is rendered and sent in the background;
+    otherwise before returning. A user whose stats were posted within RECENT_POST_SECONDS
+    is not posted again. A trailing STATS_WINDOWS name (7d, 90d, all, ...) picks the
+    chart window. Several space-separated names that are not one username get a single
+    comparison chart instead.
+    """
+    index = store.derived("username_index", UsernameIndex)
+    names = full_user.split()
+    window = DEFAULT_STATS_WINDOW
+    if len(names) > 1 and names[-1].lower() in STATS_WINDOWS and not index.lookup(full_user)[0]:
+        window = names.pop().lower()
+        full_user = " ".join(names)
+
+    if len(names) > 1 and not index.lookup(full_user)[0]:
+        handle_compare_command(incoming_chat_id, names, window, store, incoming_thread_id, render_queue)
+    else:
+        handle_user_stats(incoming_chat_id, full_user, window, store, incoming_thread_id, render_queue)
+
+
+def handle_user_stats(incoming_chat_id, full_user, window, store, incoming_thread_id=None, render_queue=None):
+    """Handles /stats for one user: the summary and the user's chart for the window."""
+    found_key, inputs, error = prepare_stats_request(full_user, store, window)
+    if error:
+        reply_in_official_thread(incoming_chat_id, incoming_thread_id, *error)
         return
 
-    # Send the statistics to the OFFICIAL_THREAD
-    send_photo(OFFICIAL_CHAT_ID, png_path, caption=f"Stats for {found_key} (Last 30 Days)", thread_id=OFFICIAL_THREAD_ID)
+    ranking = store.derived("rank_by_total_ranges", rank_by_total_ranges)
+    post_stats(incoming_chat_id, incoming_thread_id, store, render_queue, stats_label([found_key], window),
+               lambda: format_user_summary(found_key, store.data[found_key], ranking, window),
+               "plot_user_stats", plot_user_stats, deliver_user_stats, inputs)
 
-    if (incoming_chat_id != OFFICIAL_CHAT_ID) or (incoming_thread_id != OFFICIAL_THREAD_ID):
-        send_message(
-            incoming_chat_id,
-            "Your stats have been posted in the official stats topic",
-            thread_id=incoming_thread_id
-        )
 
+def handle_compare_command(incoming_chat_id, names, window, store, incoming_thread_id=None, render_queue=None):
+    """
+    Handles /stats with several usernames (at most MAX_COMPARE_USERS): one text summary
+    and one comparison chart for all of them, so they are rendered and uploaded once.
+    """
+    if len(names) > MAX_COMPARE_USERS:
+        reply_in_official_thread(incoming_chat_id, incoming_thread_id,
+                                 f"You can compare up to {MAX_COMPARE_USERS} users at once.",
+                                 f"You can compare up to {MAX_COMPARE_USERS} users at once")
+        return
+
+    usernames, inputs, error = prepare_compare_request(names, store, window)
+    if error:
+        reply_in_official_thread(incoming_chat_id, incoming_thread_id, *error)
+        return
+    if len(usernames) == 1:
+        handle_user_stats(incoming_chat_id, usernames[0], window, store, incoming_thread_id, render_queue)
+        return
+
+    ranking = store.derived("rank_by_total_ranges", rank_by_total_ranges)
+    post_stats(incoming_chat_id, incoming_thread_id, store, render_queue, stats_label(usernames, window),
+               lambda: format_compare_summary(usernames, store.data, ranking, window),
+               "plot_compare_stats", plot_compare_stats, deliver_compare_stats, inputs)
+
+
+def post_stats(incoming_chat_id, incoming_thread_id, store, render_queue, label, summary,
+               chart_name, plot, deliver, inputs):
+    """
+    Posts the summary() text and then the chart drawn by plot(inputs) for a /stats request
+    about label, unless the same chart was posted within RECENT_POST_SECONDS.
+    deliver(label, png) sends the chart; png is None if it could not be rendered.
+    """
+    key = chart_key(chart_name, inputs, CHART_RENDER_PARAMS)
+
+    def deliver_chart(label, png):
+        if not png:
+            # Nothing was posted, so a retry should not be told it was
+            release_official_post(key)
+        deliver(label, png)
+
+    if not claim_official_post(key):
+        reply_in_official_thread(incoming_chat_id, incoming_thread_id,
+                                 f"Stats for {label} were just posted above.",
+                                 f"Stats for {label} were just posted in the official stats topic")
+        return
 
-def handle_message(update, data):
+    reply_in_official_thread(incoming_chat_id, incoming_thread_id, summary(),
+                             "Your stats have been posted in the official stats topic")
+
+    if render_queue:
+        if not render_queue.submit(incoming_chat_id, label, store.version, key, inputs, plot, deliver_chart):
+            release_official_post(key)
+            send_message(OFFICIAL_CHAT_ID, "The stats bot is busy right now, so the chart was skipped. "
+                         "Please try again in a minute.", thread_id=OFFICIAL_THREAD_ID)
+    else:
+        try:
+            png = render_cached(chart_name, plot, inputs)
+        except Exception as e:
+            print(f"Error rendering stats for {label}: {e}")
+            png = None
+        deliver_chart(label, png)
+
+
+def handle_message(update, store, render_queue=None):
     msg = update.get("message", {})
     text = msg.get("text", "")
     chat_id = msg.get("chat", {}).get("id")
     thread_id = msg.get("message_thread_id")
+    user_id = msg.get("from", {}).get("id")
 
     if text.startswith("/stats"):
+        allowed, wait, warn = REQUEST_LIMITER.check(chat_id, user_id)
+        if not allowed:
+            if warn:
+                send_message(chat_id, f"Please wait {math.ceil(wait)} seconds before asking for stats again.",
+                             thread_id=thread_id)
+            return
+
         parts = text.split(maxsplit=1)
         if len(parts) < 2:
-            send_message(OFFICIAL_CHAT_ID, "Usage: /stats <username on website>", thread_id=OFFICIAL_THREAD_ID)
-            
-            if (chat_id != OFFICIAL_CHAT_ID) or (thread_id != OFFICIAL_THREAD_ID):
-                send_message(
-                    chat_id,
-                    "Please provide a username",
-                    thread_id=thread_id
-                )
+            reply_in_official_thread(chat_id, thread_id,
+                                     "Usage: /stats <username on website> [more usernames to compare] "
+                                     f"[{'|'.join(STATS_WINDOWS)}]",
+                                     "Please provide a username")
             return
 
         full_user = parts[1].strip()
-        handle_stats_command(chat_id, full_user, data, thread_id)
+        handle_stats_command(chat_id, full_user, store, thread_id, render_queue)
+
+
+# =============================================================================
+# ADMISSION CONTROL
+# =============================================================================
+class TokenBucket:
+    """Allows bursts of `capacity` requests, refilled at one per `refill_seconds`."""
+
+    def __init__(self, capacity, refill_seconds, tokens=None, updated=None, warned=False):
+        self.capacity = capacity
+        self.refill_seconds = refill_seconds
+        self.tokens = capacity if tokens is None else min(capacity, tokens)
+        # Wall-clock time, so a bucket saved by one run is still valid in the next
+        self.updated = time.time() if updated is None else updated
+        self.warned = warned
+
+    def wait_time(self):
+        """Returns 0 if a request may go through now, else the seconds until it may."""
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + max(0, now - self.updated) / self.refill_seconds)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) * self.refill_seconds
+
+    def consume(self):
+        self.tokens -= 1
+        self.warned = False
+
+    def is_full(self):
+        return self.wait_time() == 0 and self.tokens >= self.capacity
+
+
+class RequestLimiter:
+    """
+    Per-chat and per-user token buckets for /stats. A request must pass both. A refused
+    requester is told once how long to wait; further refusals are dropped silently,
+    so the bot does not answer spam with more messages.
+    The daemon and webhook modes keep the buckets in memory; the one-shot mode loads
+    and saves them around each run, so the limits hold across runs too.
+    """
+
+    def __init__(self, chat_limit=CHAT_RATE_LIMIT, user_limit=USER_RATE_LIMIT):
+        self.chat_limit = chat_limit
+        self.user_limit = user_limit
+        self._chats = {}
+        self._users = {}
+
+    def check(self, chat_id, user_id):
+        """Returns (allowed, wait_seconds, warn), warn being True on the first refusal."""
+        buckets = [self._bucket(self._chats, str(chat_id), self.chat_limit)]
+        if user_id is not None:
+            buckets.append(self._bucket(self._users, str(user_id), self.user_limit))
+
+        waits = [bucket.wait_time() for bucket in buckets]
+        if not any(waits):
+            for bucket in buckets:
+                bucket.consume()
+            return True, 0, False
+
+        limited = [bucket for bucket, wait in zip(buckets, waits) if wait]
+        warn = not all(bucket.warned for bucket in limited)
+        for bucket in limited:
+            bucket.warned = True
+        return False, max(waits), warn
+
+    def load(self, path):
+        """Restores the buckets saved by `save`; a missing or unreadable file leaves them all full."""
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            for buckets, name, limit in ((self._chats, "chats", self.chat_limit),
+                                         (self._users, "users", self.user_limit)):
+                for key, (tokens, updated, warned) in data.get(name, {}).items():
+                    buckets[key] = TokenBucket(*limit, tokens=tokens, updated=updated, warned=warned)
+        except Exception as e:
+            print(f"Error reading {path}: {e}")
+
+    def save(self, path):
+        """Writes the buckets that are not full; full ones behave exactly like new ones."""
+        data = {name: {key: [bucket.tokens, bucket.updated, bucket.warned]
+                       for key, bucket in buckets.items() if not bucket.is_full()}
+                for name, buckets in (("chats", self._chats), ("users", self._users))}
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Error writing to {path}: {e}")
+
+    @staticmethod
+    def _bucket(buckets, key, limit):
+        if key not in buckets:
+            if len(buckets) > 10000:
+                # Forget full buckets; they behave exactly like new ones
+                for old_key in [k for k, b in buckets.items() if b.is_full()]:
+                    del buckets[old_key]
+            buckets[key] = TokenBucket(*limit)
+        return buckets[key]
+
+
+REQUEST_LIMITER = RequestLimiter()
+
+
+# =============================================================================
+# RENDER QUEUE
+# =============================================================================
+def reset_worker_signals():
+    """Render workers leave SIGINT/SIGTERM to the daemon, which shuts the pool down."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+class StatsRenderQueue:
+    """
+    Renders /stats charts in the background for the daemon.
+    - At most `workers` charts render at once, on a process pool (one worker thread
+      when there is a single CPU).
+    - A chart for a user and data version that is already queued or rendering is not
+      queued again.
+    - Waiting renders are taken round-robin per chat, so one busy chat cannot hold up
+      the others.
+    - Cached charts skip the queue. Charts are sent from a small thread pool.
+    - At most max_pending charts wait or render at once; submit() refuses more.
+    - warm() queues renders that only fill the chart cache. They run when no /stats
+      render is waiting, and are dropped once their deadline has passed. A /stats request
+      for a chart that is being warmed gets that render instead of starting another.
+    - If the process pool breaks (a worker died), the affected requests are answered
+      without a chart and a new pool is started.
+    Each chart is drawn by the plot function it was submitted with and sent by its
+    deliver function.
+    """
+
+    def __init__(self, workers, send_workers, max_pending):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pool = self._new_pool()
+        if workers > 1:
+            # Start the worker processes now, before any other thread exists
+            self.pool.submit(os.getpid).result()
+        self.sender = ThreadPoolExecutor(max_workers=send_workers)
+        self._lock = threading.Lock()
+        self._queues = OrderedDict()   # chat_id -> deque of (job key, chart key, inputs, plot, deliver), round-robin
+        self._pending = set()          # (label, version) of charts queued or rendering for /stats
+        self._warm = deque()           # (job key, chart key, inputs, deadline) of plot_user_stats charts to pre-render
+        self._warming = {}             # job key of a warm-up render in progress -> deliver functions waiting for it
+        self._running = 0
+
+    def submit(self, chat_id, label, version, key, inputs, plot, deliver):
+        """
+        Queues a /stats chart, rendered as plot(inputs) and sent with deliver(label, png).
+        Returns False if too many renders are pending already.
+        """
+        png = CHART_CACHE.get(key)
+        if png:
+            self.sender.submit(deliver, label, png)
+            return True
+
+        job = (label, version)
+        with self._lock:
+            waiting = self._warming.get(job)
+            if waiting is not None:
+                # Being rendered for the cache right now; send that render to this request too
+                waiting.append(deliver)
+                return True
+            if job in self._pending:
+                return True
+            if len(self._pending) >= self.max_pending:
+                return False
+            self._pending.add(job)
+            self._queues.setdefault(chat_id, deque()).append((job, key, inputs, plot, deliver))
+            started = self._dispatch()
+        self._watch(started)
+        return True
+
+    def warm(self, jobs, deadline):
+        """
+        Replaces the pending warm-up renders with jobs, a list of (label, version,
+        inputs). Charts that are cached already are skipped. Returns the number queued.
+        """
+        warm = deque()
+        for label, version, inputs in jobs:
+            key = chart_key("plot_user_stats", inputs, CHART_RENDER_PARAMS)
+            if not CHART_CACHE.contains(key):
+                warm.append(((label, version), key, inputs, deadline))
+        queued = len(warm)
+        with self._lock:
+            self._warm = warm
+            started = self._dispatch()
+        self._watch(started)
+        return queued
+
+    def shutdown(self):
+        """Finishes queued renders and replies, then stops the pools."""
+        with self._lock:
+            self._warm.clear()
+        while True:
+            with self._lock:
+                if not self._pending and not self._running:
+                    break
+            time.sleep(0.1)
+        self.pool.shutdown()
+        self.sender.shutdown()
+
+    def _new_pool(self):
+        if self.workers > 1:
+            return ProcessPoolExecutor(max_workers=self.workers, initializer=reset_worker_signals)
+        return ThreadPoolExecutor(max_workers=1)
+
+    def _dispatch(self):
+        # Called with the lock held: start renders round-robin over chats while workers are
+        # free, then warm-up renders if nobody is waiting. Returns the started renders for
+        # _watch(), which the caller must run after releasing the lock.
+        started = []
+        while self._running < self.workers and self._queues:
+            chat_id, queue = self._queues.popitem(last=False)
+            job, key, inputs, plot, deliver = queue.popleft()
+            if queue:
+                self._queues[chat_id] = queue
+            started.append(self._start(job, key, inputs, plot, deliver))
+
+        while self._running < self.workers and self._warm:
+            job, key, inputs, deadline = self._warm.popleft()
+            if time.monotonic() > deadline:
+                print(f"Cache warming stopped, {len(self._warm) + 1} chart(s) left over budget.")
+                self._warm.clear()
+                break
+            # A /stats request for the same chart renders it already
+            if job not in self._pending and job not in self._warming and not CHART_CACHE.contains(key):
+                self._warming[job] = []
+                started.append(self._start(job, key, inputs, plot_user_stats))
+        return [render for render in started if render]
+
+    def _start(self, job, key, inputs, plot, deliver=None):
+        # Called with the lock held. deliver is None for warm-up renders. Returns the
+        # render for _watch(), or None if the pool is broken.
+        try:
+            future = self.pool.submit(plot, inputs)
+        except BrokenExecutor as e:
+            print(f"Render pool is broken ({e}), starting a new one.")
+            self.pool.shutdown(wait=False)
+            self.pool = self._new_pool()
+            self.sender.submit(self._deliver_all, job[0], None, self._release(job, deliver))
+            return None
+        self._running += 1
+        return future, job, key, deliver
+
+    def _watch(self, started):
+        # Called without the lock: a future that is done already runs its callback right
+        # away on this thread, and _finished takes the lock
+        for future, job, key, deliver in started:
+            future.add_done_callback(lambda f, job=job, key=key, deliver=deliver: self._finished(job, key, f, deliver))
+
+    def _release(self, job, deliver):
+        # Called with the lock held: forgets a finished render and returns the deliver
+        # functions waiting for it
+        if deliver:
+            self._pending.discard(job)
+            return [deliver]
+        return self._warming.pop(job, [])
+
+    def _deliver_all(self, label, png, delivers):
+        for deliver in delivers:
+            deliver(label, png)
+
+    def _finished(self, job, key, future, deliver=None):
+        try:
+            png = CHART_CACHE.put(key, future.result())
+        except Exception as e:
+            print(f"Error rendering stats for {job[0]}: {e}")
+            png = None
+        with self._lock:
+            self._running -= 1
+            delivers = self._release(job, deliver)
+            started = self._dispatch()
+        self._watch(started)
+        if delivers:
+            self.sender.submit(self._deliver_all, job[0], png, delivers)
+        elif png and WARM_UPLOAD_CHAT_ID:
+            self.sender.submit(preupload_chart, job[0], png)
+
+
+def preupload_chart(label, png):
+    """Uploads a warmed chart to WARM_UPLOAD_CHAT_ID once, so later replies send its file_id."""
+    if TELEGRAM.file_id_cache and TELEGRAM.file_id_cache.get(content_hash(png)):
+        return
+    send_photo(WARM_UPLOAD_CHAT_ID, png, caption=f"Stats for {label}")
+
+
+def warm_chart_cache(store, render_queue):
+    """Queues background renders of the most active users' default window charts for the current data."""
+    users = store.derived("top_active_users", lambda d: top_active_users(d, WARM_TOP_USERS))
+    jobs = []
+    for username in users:
+        found_key, inputs, error = prepare_stats_request(username, store, DEFAULT_STATS_WINDOW)
+        if not error and inputs:
+            # Named like the /stats request for the same chart, so the two are not rendered twice
+            jobs.append((stats_label([found_key], DEFAULT_STATS_WINDOW), store.version, inputs))
+    queued = render_queue.warm(jobs, time.monotonic() + WARM_BUDGET_SECONDS)
+    if queued:
+        print(f"Warming the chart cache for {queued} active user(s).")
+
+
+def refresh_data(store, render_queue, full_reload=False):
+    """Brings the resident data up to date and warms the chart cache when it changed."""
+    if full_reload:
+        store.reload()
+        changed = True
+    else:
+        changed = store.refresh()
+    if changed and WARM_TOP_USERS:
+        warm_chart_cache(store, render_queue)
 
 
 # =============================================================================
@@ -463,38 +1409,297 @@ def set_last_update_id(update_id):
 # =============================================================================
 # MAIN FUNCTION
 # =============================================================================
+def process_update(upd, store, render_queue=None):
+    """Handles one update and commits the offset right after it, so it is never handled twice."""
+    update_id = upd.get("update_id")
+    message = upd.get("message", {})
+
+    # Check if message contains text; handle commands
+    if "text" in message:
+        handle_message(upd, store, render_queue)
+
+    # Update offset
+    if update_id is not None:
+        set_last_update_id(update_id + 1)
+
+
 def main():
     # Get the latest offset
     last_update_id = get_last_update_id()
 
     # Fetch new updates
-    updates = get_updates(offset=last_update_id, timeout=30)
+    updates = get_updates(offset=last_update_id, timeout=POLL_TIMEOUT)
 
     if not updates:
         print("No new updates.")
         return
 
     # Load ranges history
-    data = load_ranges_history()
+    store = RangesStore()
+    store.reload()
+
+    # Each run is a new process, so carry the /stats rate limits over from the last one
+    REQUEST_LIMITER.load(RATE_LIMIT_FILE)
+    try:
+        for upd in updates:
+            process_update(upd, store)
+    finally:
+        REQUEST_LIMITER.save(RATE_LIMIT_FILE)
 
-    for upd in updates:
-        update_id = upd.get("update_id")
-        message = upd.get("message", {})
+    # Example: Automatically post to a designated thread (optional)
+    # send_message(OFFICIAL_CHAT_ID, "Automated greeting in specific thread", thread_id=OFFICIAL_THREAD_ID)
 
-        # Check if message contains text; handle commands
-        if "text" in message:
-            handle_message(upd, data)
 
-        # Update offset
-        if update_id is not None:
-            last_update_id = update_id + 1
+# =============================================================================
+# DAEMON MODE
+# =============================================================================
+DAEMON_STATE = {"stopping": False, "busy": False, "reload": False}
 
-    # Save latest offset
-    set_last_update_id(last_update_id)
 
-    # Example: Automatically post to a designated thread (optional)
-    # send_message(OFFICIAL_CHAT_ID, "Automated greeting in specific thread", thread_id=OFFICIAL_THREAD_ID)
+def request_stop(signum, frame):
+    """
+    SIGTERM/SIGINT handler. While waiting on the long poll nothing is in flight (offsets
+    are committed per update), so exit right away; otherwise finish the current update first.
+    """
+    print(f"Received signal {signum}, shutting down.")
+    DAEMON_STATE["stopping"] = True
+    if not DAEMON_STATE["busy"]:
+        raise SystemExit(0)
+
+
+def request_reload(signum, frame):
+    """SIGHUP handler: fully reload ranges_history.json before handling the next update."""
+    DAEMON_STATE["reload"] = True
+
+
+def run_daemon():
+    """
+    Long-polls getUpdates in a loop and answers /stats from a dataset kept in memory,
+    so a request only costs the chart render and upload. New collector samples are
+    applied after every poll and right before handling updates.
+    """
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, request_reload)
+
+    store = RangesStore()
+    store.reload()
+    offset = get_last_update_id()
+    render_queue = StatsRenderQueue(RENDER_WORKERS, SEND_WORKERS, MAX_PENDING_RENDERS)
+    print(f"Stats bot running, {len(store.data)} users loaded, {render_queue.workers} render worker(s).")
+    if WARM_TOP_USERS:
+        warm_chart_cache(store, render_queue)
+
+    try:
+        poll_updates(store, offset, render_queue)
+    finally:
+        render_queue.shutdown()
+        print("Stats bot stopped.")
+
+
+def poll_updates(store, offset, render_queue):
+    """Long-polls until a stop is requested, refreshing the data before handling each batch."""
+    while not DAEMON_STATE["stopping"]:
+        try:
+            updates = TELEGRAM.get_updates(offset=offset, timeout=POLL_TIMEOUT)
+        except TelegramError as e:
+            print(f"Error in get_updates: {e}")
+            time.sleep(POLL_ERROR_DELAY)
+            continue
+
+        DAEMON_STATE["busy"] = True
+        try:
+            if DAEMON_STATE["reload"]:
+                DAEMON_STATE["reload"] = False
+                refresh_data(store, render_queue, full_reload=True)
+                print(f"Reloaded ranges history, {len(store.data)} users.")
+            else:
+                refresh_data(store, render_queue)
+
+            for upd in updates:
+                process_update(upd, store, render_queue)
+                if upd.get("update_id") is not None:
+                    offset = upd["update_id"] + 1
+                if DAEMON_STATE["stopping"]:
+                    break
+        finally:
+            DAEMON_STATE["busy"] = False
+
+
+# =============================================================================
+# WEBHOOK MODE
+# =============================================================================
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+                405: "Method Not Allowed", 413: "Payload Too Large"}
+
+
+class WebhookReceiver:
+    """
+    Accepts updates POSTed by Telegram and hands them to a single worker thread, which
+    runs the same handle_message path as polling, in arrival order. Telegram redelivers
+    an update until it gets a 2xx reply, so recently seen update_ids are dropped instead
+    of being handled twice; no offset needs to be stored.
+    """
+
+    def __init__(self, store, render_queue, secret, path):
+        self.store = store
+        self.render_queue = render_queue
+        self.secret = secret
+        self.path = path
+        self.handler = ThreadPoolExecutor(max_workers=1)
+        self._seen = set()
+        self._seen_order = deque()
+
+    def receive(self, method, path, headers, body):
+        """Validates one HTTP request and queues its update. Returns the HTTP status code."""
+        if path.split("?", 1)[0] != self.path:
+            return 404
+        if method != "POST":
+            return 405
+        token = headers.get("x-telegram-bot-api-secret-token", "")
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            return 401
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return 400
+        if not isinstance(update, dict):
+            return 400
+
+        update_id = update.get("update_id")
+        if update_id is not None:
+            if update_id in self._seen:
+                return 200
+            self._seen.add(update_id)
+            self._seen_order.append(update_id)
+            if len(self._seen_order) > WEBHOOK_SEEN_UPDATES:
+                self._seen.discard(self._seen_order.popleft())
+
+        self.handler.submit(self.handle_update, update)
+        return 200
+
+    def handle_update(self, update):
+        try:
+            refresh_data(self.store, self.render_queue)
+            if "text" in update.get("message", {}):
+                handle_message(update, self.store, self.render_queue)
+        except Exception as e:
+            print(f"Error handling update {update.get('update_id')}: {e}")
+
+    def reload(self):
+        """Fully reloads the ranges history on the handler thread, between updates."""
+        self.handler.submit(refresh_data, self.store, self.render_queue, True)
+
+    def refresh(self):
+        """Picks up new collector samples on the handler thread, between updates."""
+        self.handler.submit(refresh_data, self.store, self.render_queue)
+
+    async def serve_connection(self, reader, writer):
+        """Minimal HTTP/1.1 handling: one request per connection, empty response body."""
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), WEBHOOK_READ_TIMEOUT)
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), WEBHOOK_READ_TIMEOUT)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            length = int(headers.get("content-length", 0))
+            if length > WEBHOOK_MAX_BODY:
+                status = 413
+            else:
+                body = await asyncio.wait_for(reader.readexactly(length), WEBHOOK_READ_TIMEOUT)
+                status = self.receive(method, path, headers, body)
+        except (ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            status = 400
+
+        try:
+            writer.write(f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+                         "Content-Length: 0\r\nConnection: close\r\n\r\n".encode())
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def shutdown(self):
+        self.handler.shutdown()
+
+
+WEBHOOK_STATE = {"stopping": False, "loop": None, "stop": None}
+
+
+def stop_webhook():
+    """Stops the webhook server from another thread, as SIGTERM does; also before it has started."""
+    WEBHOOK_STATE["stopping"] = True
+    loop, stop = WEBHOOK_STATE["loop"], WEBHOOK_STATE["stop"]
+    if loop is not None:
+        loop.call_soon_threadsafe(stop.set)
+
+
+async def serve_webhook(receiver, host, port):
+    """Serves webhook requests until SIGTERM/SIGINT or stop_webhook()."""
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+    if hasattr(signal, "SIGHUP"):
+        loop.add_signal_handler(signal.SIGHUP, receiver.reload)
+
+    server = await asyncio.start_server(receiver.serve_connection, host, port)
+    print(f"Webhook server listening on {host}:{port}{receiver.path}")
+    WEBHOOK_STATE.update(loop=loop, stop=stop)
+    if WEBHOOK_STATE["stopping"]:
+        stop.set()
+    try:
+        async with server:
+            while not stop.is_set():
+                try:
+                    await asyncio.wait_for(stop.wait(), WEBHOOK_REFRESH_SECONDS)
+                except asyncio.TimeoutError:
+                    receiver.refresh()
+    finally:
+        WEBHOOK_STATE.update(loop=None, stop=None)
+    print("Webhook server stopping.")
+
+
+def run_webhook(register=True):
+    """
+    Receives updates through a webhook instead of polling: answers as soon as Telegram
+    delivers a message. With register, the webhook is (re)registered with Telegram first.
+    Switch back to polling with deleteWebhook, as getUpdates is refused while it is set.
+    """
+    store = RangesStore()
+    store.reload()
+    render_queue = StatsRenderQueue(RENDER_WORKERS, SEND_WORKERS, MAX_PENDING_RENDERS)
+    receiver = WebhookReceiver(store, render_queue, WEBHOOK_SECRET, WEBHOOK_PATH)
+
+    if register:
+        try:
+            TELEGRAM.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET, allowed_updates=["message"])
+        except TelegramError as e:
+            print(f"Error in set_webhook: {e}")
+            return
+
+    print(f"Stats bot running, {len(store.data)} users loaded, {render_queue.workers} render worker(s).")
+    if WARM_TOP_USERS:
+        warm_chart_cache(store, render_queue)
+    try:
+        asyncio.run(serve_webhook(receiver, WEBHOOK_HOST, WEBHOOK_PORT))
+    finally:
+        receiver.shutdown()
+        render_queue.shutdown()
+        print("Stats bot stopped.")
 
 
 if __name__ == "__main__":
-    main()
+    if "--webhook" in sys.argv[1:]:
+        run_webhook(register="--no-register" not in sys.argv[1:])
+    elif "--daemon" in sys.argv[1:]:
+        run_daemon()
+    else:
+        main()
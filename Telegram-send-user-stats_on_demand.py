@@ -19,14 +19,25 @@
 import json
 import time
 import os
-import requests
+import sys
 from datetime import datetime, timedelta
 import random
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
+from matplotlib.figure import Figure
 import pytz
 import logging
 import math
+import numpy as np
+import threading
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from chart_cache import ChartCache, chart_key
+from chart_output import figure_template, figure_to_png, lttb, pixel_width
+from chart_pillow import bar_chart, line_chart
+from milestones import MILESTONES
+from telegram_client import FileIdCache, TelegramClient
+from telegram_outbox import Outbox
 
 # Define the Stockholm timezone
 STOCKHOLM = pytz.timezone('Europe/Stockholm')
@@ -36,6 +47,12 @@ BOT_TOKEN = 'REPLACE_WITH_BOT_TOKEN'  # Replace with your actual BOT_TOKEN
 CHAT_ID = 'REPLACE_WITH_CHAT_ID'       # Replace with your actual CHAT_ID
 MESSAGE_THREAD_ID = 'REPLACE_WITH_MESSAGE_THREAD_ID'  # Specific thread ID
 
+# Every (chat_id, message_thread_id) the report is published to. The report is computed and
+# rendered once, then sent to all targets concurrently; use None as thread ID for chats without topics.
+REPORT_TARGETS = [
+    (CHAT_ID, MESSAGE_THREAD_ID),
+]
+
 # Define file paths
 HUNTERS_STORAGE_PATH = 'REPLACE_WITH_STORAGE_PATH'
 PREVIOUS_COMPLETED_FILE = os.path.join(HUNTERS_STORAGE_PATH, 'previous_completed.json')
@@ -43,6 +60,18 @@ PREVIOUS_SPEED_FILE = os.path.join(HUNTERS_STORAGE_PATH, 'previous_speed.json')
 RANGES_HISTORY_FILE = os.path.join(HUNTERS_STORAGE_PATH, 'ranges_history.json')
 TOTAL_RANGES_FILE = os.path.join(HUNTERS_STORAGE_PATH, 'total_ranges.json')
 ACHIEVED_MILESTONES_FILE = os.path.join(HUNTERS_STORAGE_PATH, 'achieved_milestones.json')
+SPEED_STATS_FILE = os.path.join(HUNTERS_STORAGE_PATH, 'speed_stats.json')
+CHART_CACHE_DIR = os.path.join(HUNTERS_STORAGE_PATH, 'chart_cache')
+TELEGRAM_FILE_ID_CACHE_FILE = os.path.join(HUNTERS_STORAGE_PATH, 'telegram_file_ids.json')
+OUTBOX_FILE = os.path.join(HUNTERS_STORAGE_PATH, 'telegram_outbox.sqlite')
+
+# The report run spends at most this many seconds delivering. Whatever Telegram has not
+# accepted by then (e.g. during an outage) is left to "--drain" runs, see drain_outbox().
+REPORT_DRAIN_SECONDS = 60
+
+# Shared Bot API client: keep-alive session, retries on 429/5xx, per-chat rate limiting
+# and re-sending previously uploaded images by file_id
+TELEGRAM = TelegramClient(BOT_TOKEN, file_id_cache=FileIdCache(TELEGRAM_FILE_ID_CACHE_FILE))
 
 # === Pool lists (Hunters, TTD, BTCPuzzle) ===
 POOLS_SPEED = [
@@ -75,20 +104,6 @@ POOLS_COMPLETION = [
     }
 ]
 
-# Define milestones (ordered from highest to lowest)
-MILESTONES = [
-    {"level": 1,  "name": "Diamond",   "threshold": 1000000, "emoji": "💎"},
-    {"level": 2,  "name": "Pearl",     "threshold": 500001,  "emoji": "⚪️"},
-    {"level": 3,  "name": "Sapphire",  "threshold": 250001,  "emoji": "🔹"},
-    {"level": 4,  "name": "Ruby",      "threshold": 100001,  "emoji": "♦️"},
-    {"level": 5,  "name": "Emerald",   "threshold": 50001,   "emoji": "🟢"},
-    {"level": 6,  "name": "Platinum",  "threshold": 25001,   "emoji": "🪞"},
-    {"level": 7,  "name": "Gold",      "threshold": 10001,   "emoji": "🥇"},
-    {"level": 8,  "name": "Silver",    "threshold": 5001,    "emoji": "🥈"},
-    {"level": 9,  "name": "Bronze",    "threshold": 1001,    "emoji": "🥉"},
-    {"level": 10, "name": "Copper",    "threshold": 1,       "emoji": "🟤"},
-]
-
 APPROACHING_THRESHOLD_PERCENT = 0.10
 
 # Total keys for Puzzle 67
@@ -239,6 +254,25 @@ COMMENTS = {
 
 GOAL_PERCENTAGE_INCREASE = 0.07  # 0.07% daily increase goal
 
+# Number of processes used to render the report charts in parallel (1 renders inline)
+RENDER_WORKERS = os.cpu_count() or 1
+
+# Simple charts drawn with the lightweight Pillow renderer (chart_pillow.py) instead of
+# matplotlib. Remove a chart's plot function name to draw it with matplotlib again.
+PILLOW_CHARTS = {"plot_user_speed_graph", "plot_active_users_30days", "plot_daily_percentage_increase"}
+
+# Rendered charts are cached by a hash of their inputs; bump the version when chart styling changes
+CHART_RENDER_PARAMS = {"version": 4, "pillow": sorted(PILLOW_CHARTS)}
+CHART_CACHE = ChartCache(CHART_CACHE_DIR)
+
+# Charts are rendered in memory and uploaded directly. Set this to a directory
+# (e.g. HUNTERS_STORAGE_PATH) to also keep a named copy of every chart on disk.
+CHART_SINK_PATH = None
+
+# Completion targets to estimate in the report, and the z-score for their confidence bounds (95%)
+ETA_TARGETS = [25, 50, 100]
+ETA_CONFIDENCE_Z = 1.96
+
 logging.basicConfig(
     level=logging.DEBUG,
     format='[%(asctime)s] %(levelname)s: %(message)s',
@@ -260,45 +294,49 @@ def set_emoji_font():
     else:
         log_warning("Emoji font not found. Emojis may not display correctly.")
 
-def send_text_to_telegram(message):
-    url = f'https://api.telegram.org/bot{BOT_TOKEN}/sendMessage'
-    payload = {
-        'chat_id': CHAT_ID,
-        'text': message,
-        'parse_mode': 'HTML',
-        'message_thread_id': MESSAGE_THREAD_ID
-    }
+def log_report_item_error(item, error):
+    log_warning(f"Failed to send report {item['type']}: {error}")
+
+def publish_report(report_id, report_items):
+    """
+    Puts the report items in the durable outbox and delivers them to every chat in
+    REPORT_TARGETS. A drainer thread sends items in order while later charts are still
+    rendering. Each chart is uploaded once and reaches the other chats by file_id.
+    Delivery stops after REPORT_DRAIN_SECONDS; anything Telegram did not accept by then
+    stays in the outbox for drain_outbox() or the next run. Items are keyed by report_id,
+    so running the report twice for the same day does not post it twice.
+    """
+    outbox = Outbox(OUTBOX_FILE)
+    enqueued = threading.Event()
+    drainer = threading.Thread(target=outbox.drain, args=(TELEGRAM,),
+                               kwargs={"targets": REPORT_TARGETS, "closed": enqueued,
+                                       "max_wait": REPORT_DRAIN_SECONDS, "on_error": log_report_item_error})
+    drainer.start()
     try:
-        response = requests.post(url, data=payload, timeout=10)
-        response.raise_for_status()
-        log_debug("Text message sent successfully.")
-    except requests.exceptions.RequestException as e:
-        response_text = response.text if 'response' in locals() else 'No response received'
-        log_warning(f"Failed to send message: {e}")
-        log_warning(f"Response: {response_text}")
-
-def send_photo_to_telegram(photo_path, caption=""):
-    url = f'https://api.telegram.org/bot{BOT_TOKEN}/sendPhoto'
+        outbox.enqueue_items(report_id, REPORT_TARGETS, report_items, parse_mode='HTML', on_error=log_report_item_error)
+        log_debug("Report enqueued.")
+    finally:
+        enqueued.set()
+        outbox.wake()
+        drainer.join()
+        outbox.prune()
+        outbox.close()
+    log_debug("Report published.")
+
+def drain_outbox():
+    """
+    Delivers what earlier runs left in the outbox, without computing a report. Run it with
+    --drain from cron (e.g. every 10 minutes), so a report held up by an outage goes out
+    soon after Telegram recovers instead of with the next report.
+    """
+    outbox = Outbox(OUTBOX_FILE)
     try:
-        with open(photo_path, 'rb') as photo:
-            payload = {
-                'chat_id': CHAT_ID,
-                'caption': caption,
-                'parse_mode': 'HTML',
-                'message_thread_id': MESSAGE_THREAD_ID
-            }
-            files = {'photo': photo}
-            response = requests.post(url, data=payload, files=files, timeout=10)
-            response.raise_for_status()
-        log_debug("Photo sent successfully.")
-    except requests.exceptions.RequestException as e:
-        response_text = response.text if 'response' in locals() else 'No response received'
-        log_warning(f"Failed to send photo: {e}")
-        log_warning(f"Response: {response_text}")
-    except FileNotFoundError:
-        log_warning(f"Photo file not found: {photo_path}")
+        outbox.drain(TELEGRAM, on_error=log_report_item_error)
+        outbox.prune()
+    finally:
+        outbox.close()
 
-def send_long_message_in_parts(full_message, max_length=4000):
+def split_message_in_parts(full_message, max_length=4000):
     parts = []
     current_part = ""
     for line in full_message.split("\n"):
@@ -312,8 +350,7 @@ def send_long_message_in_parts(full_message, max_length=4000):
                 current_part = line
     if current_part:
         parts.append(current_part)
-    for part in parts:
-        send_text_to_telegram(part)
+    return parts
 
 def random_comment(category, level=None):
     if category == "milestones" and level:
@@ -380,12 +417,6 @@ def resample_history(history_list, interval_seconds=600, aggregation='last'):
     resampled = [item for item in resampled if item[1] is not None]
     return resampled
 
-def filter_old_speed_data(history_list, days):
-    cutoff = time.time() - days * 86400
-    filtered = [entry for entry in history_list if entry[0] >= cutoff]
-    log_debug(f"Filtered {len(filtered)} speed entries from the last {days} days.")
-    return filtered
-
 def get_value_at_utc_midnight(history_list, days_ago=0):
     if not history_list:
         return None
@@ -532,7 +563,7 @@ def clean_old_ranges(history_data, days=30):
         after = len(history_data[user])
         log_debug(f"Cleaned user {user}: before={before}, after={after}")
 
-def plot_active_users_30days(ranges_data):
+def prepare_active_users_30days(ranges_data):
     days = 30
     day_counts = []
     day_labels = []
@@ -548,10 +579,17 @@ def plot_active_users_30days(ranges_data):
                     break
         day_counts.append(len(active_users))
         date_obj = datetime.now(STOCKHOLM) - timedelta(days=d)
-        day_labels.append(date_obj)
+        day_labels.append(date_obj.strftime('%Y-%m-%d'))
         log_debug(f"Day: {date_obj.strftime('%Y-%m-%d')}, Active Users: {len(active_users)}")
 
-    img_path = os.path.join(HUNTERS_STORAGE_PATH, "active_users_30days.png")
+    return {"day_labels": day_labels, "day_counts": day_counts}
+
+def plot_active_users_30days(inputs):
+    if "plot_active_users_30days" in PILLOW_CHARTS:
+        return draw_active_users_30days(inputs)
+    day_labels = [datetime.strptime(day, '%Y-%m-%d').replace(tzinfo=STOCKHOLM) for day in inputs["day_labels"]]
+    day_counts = inputs["day_counts"]
+
     plt.figure(figsize=(20, 10))
     plt.plot(day_labels, day_counts, marker='o', linestyle='-', color='purple')
     plt.title("👥 Active Users per Day (Last 30 Days)")
@@ -562,10 +600,21 @@ def plot_active_users_30days(ranges_data):
     plt.xticks(rotation=90)
     plt.grid(True, which='both', linestyle='--', linewidth=0.5)
     plt.tight_layout()
-    plt.savefig(img_path)
+    png = figure_to_png(plt.gcf(), sink_path=chart_sink_path("active_users_30days.png"))
     plt.close()
-    log_debug(f"Saved active users graph to {img_path}")
-    return img_path
+    log_debug(f"Rendered active users graph ({len(png)} bytes)")
+    return png
+
+def draw_active_users_30days(inputs):
+    """Pillow version of plot_active_users_30days."""
+    days = list(range(len(inputs["day_labels"])))
+    png = line_chart([{"x": days, "y": inputs["day_counts"], "color": "purple", "markers": True}],
+                     size=(1280, 640), title="Active Users per Day (Last 30 Days)", xlabel="Day",
+                     ylabel="Number of Active Users", x_ticks=list(zip(days, inputs["day_labels"])),
+                     x_tick_rotation=90, font_size=12, margins=(70, 34, 20, 110),
+                     sink_path=chart_sink_path("active_users_30days.png"))
+    log_debug(f"Drew active users graph ({len(png)} bytes)")
+    return png
 
 def get_last_value_of_each_day(history_list, days=30, current_val=None):
     if not history_list:
@@ -594,7 +643,7 @@ def get_last_value_of_each_day(history_list, days=30, current_val=None):
     results.reverse()
     return results
 
-def plot_daily_percentage_increase(completion_data):
+def prepare_daily_percentage_increase(completion_data):
     days = 30
     history = completion_data.get("history", [])
     if not history:
@@ -618,8 +667,7 @@ def plot_daily_percentage_increase(completion_data):
             prev_day, prev_val = daily_values[i-1]
             inc = current_val - prev_val if prev_val != 0 else 0
         percentage_increases.append(inc)
-        date_obj = datetime.strptime(current_day, '%Y-%m-%d').replace(tzinfo=STOCKHOLM)
-        day_labels.append(date_obj)
+        day_labels.append(current_day)
         log_debug(f"Day: {current_day}, Percentage Increase: {inc:.4f}%")
 
     if len(percentage_increases) > 1 and percentage_increases[1] > GOAL_PERCENTAGE_INCREASE:
@@ -627,7 +675,14 @@ def plot_daily_percentage_increase(completion_data):
         percentage_increases.pop(1)
         day_labels.pop(1)
 
-    img_path = os.path.join(HUNTERS_STORAGE_PATH, "completion_percentage_increase_30days.png")
+    return {"day_labels": day_labels, "percentage_increases": percentage_increases}
+
+def plot_daily_percentage_increase(inputs):
+    if "plot_daily_percentage_increase" in PILLOW_CHARTS:
+        return draw_daily_percentage_increase(inputs)
+    day_labels = [datetime.strptime(day, '%Y-%m-%d').replace(tzinfo=STOCKHOLM) for day in inputs["day_labels"]]
+    percentage_increases = inputs["percentage_increases"]
+
     plt.figure(figsize=(20, 10))
     colors = ['green' if inc >= GOAL_PERCENTAGE_INCREASE else 'red' for inc in percentage_increases]
     bars = plt.bar(day_labels, percentage_increases, color=colors, edgecolor='black', alpha=0.7)
@@ -656,23 +711,34 @@ def plot_daily_percentage_increase(completion_data):
                      ha='center', va='bottom', fontsize=8)
 
     plt.tight_layout()
-    plt.savefig(img_path, dpi=300)
+    # 30 labelled bars: a little larger than the default, far below the old 6000 px at dpi 300
+    png = figure_to_png(plt.gcf(), max_side=1600, sink_path=chart_sink_path("completion_percentage_increase_30days.png"))
     plt.close()
-    log_debug(f"Saved percentage increase graph to {img_path}")
-    return img_path
+    log_debug(f"Rendered percentage increase graph ({len(png)} bytes)")
+    return png
+
+def draw_daily_percentage_increase(inputs):
+    """Pillow version of plot_daily_percentage_increase."""
+    percentage_increases = inputs["percentage_increases"]
+    colors = ['green' if inc >= GOAL_PERCENTAGE_INCREASE else 'red' for inc in percentage_increases]
+    y_max = max(max(percentage_increases) + 0.05, GOAL_PERCENTAGE_INCREASE + 0.1)
+    png = bar_chart(inputs["day_labels"], percentage_increases, colors, size=(1600, 800),
+                    title="Daily Percentage Increase of Puzzle Completion (Last 30 Days)", xlabel="Day",
+                    ylabel="Percentage Increase (%)", y_limits=(0, y_max),
+                    reference=(GOAL_PERCENTAGE_INCREASE, "blue", f"Goal: {GOAL_PERCENTAGE_INCREASE}%"),
+                    value_format="{:.2f}%", font_size=13, margins=(80, 40, 20, 120),
+                    sink_path=chart_sink_path("completion_percentage_increase_30days.png"))
+    log_debug(f"Drew percentage increase graph ({len(png)} bytes)")
+    return png
 
 def compute_sma(values, window=600):
-    sma_values = []
-    for i in range(len(values)):
-        if i < window:
-            subset = values[:i+1]
-        else:
-            subset = values[i-window+1 : i+1]
-        avg = sum(subset) / len(subset)
-        sma_values.append(avg)
-    return sma_values
+    # Running sums: O(n) instead of summing every window again. The first window-1
+    # points average over what is available so far.
+    sums = np.cumsum(np.asarray(values, dtype=float))
+    sums[window:] = sums[window:] - sums[:-window]
+    return sums / np.minimum(np.arange(1, len(sums) + 1), window)
 
-def plot_pool_speed(speed_data):
+def prepare_pool_speed(speed_data):
     hist = speed_data.get("history", [])
     if not hist or len(hist) < 2:
         log_warning("No pool_speed history available.")
@@ -688,31 +754,62 @@ def plot_pool_speed(speed_data):
         return None
     resampled_hist.sort(key=lambda x: x[0])
 
-    times = [datetime.fromtimestamp(t, tz=STOCKHOLM) for t, _ in resampled_hist]
-    values = [v for _, v in resampled_hist]
-
-    sma_window = 600
-    sma_values = compute_sma(values, window=sma_window)
-
-    img_path = os.path.join(HUNTERS_STORAGE_PATH, "pool_speed.png")
-    plt.figure(figsize=(15, 7))
-    plt.plot(times, values, linestyle='-', color='blue', label='Pool Speed')
-    plt.plot(times, sma_values, linestyle='--', color='red', label=f'SMA{sma_window}')
-    plt.title("🏊‍♂️ Pool Speed Over Time (10-Min Intervals + SMA600)")
-    plt.xlabel("Time")
-    plt.ylabel("Speed (BKeys/s)")
-    plt.gca().xaxis.set_major_locator(mdates.DayLocator(interval=1))
-    plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-    plt.xticks(rotation=90)
-    plt.grid(True, which='both', linestyle='--', linewidth=0.5)
-    plt.legend()
-    plt.tight_layout()
-    plt.savefig(img_path)
-    plt.close()
-    log_debug(f"Saved pool speed graph (with SMA600) to {img_path}")
-    return img_path
-
-def plot_user_speed_graph(user, ranges_data, days=1):
+    return {"times": [t for t, _ in resampled_hist], "values": [v for _, v in resampled_hist]}
+
+def to_plot_series(times, values, max_points):
+    """
+    Downsamples a time series with LTTB to at most max_points (the chart's pixel width)
+    and converts the epoch timestamps kept to datetimes.
+    """
+    times, values = lttb(times, values, max_points)
+    return [datetime.fromtimestamp(t, tz=STOCKHOLM) for t in times], values
+
+class PoolSpeedTemplate:
+    """
+    Figure for plot_pool_speed, built once per render process: the speed and SMA lines,
+    titles, date locator/formatter and layout. render() only swaps in the line data.
+    """
+    SMA_WINDOW = 600
+
+    def __init__(self):
+        self.fig = Figure(figsize=(15, 7))
+        ax = self.ax = self.fig.add_subplot()
+        # Placeholder data as wide as real charts get, so the layout computed below fits them
+        now = datetime.now(tz=STOCKHOLM)
+        times = [now - timedelta(days=30), now]
+        self.speed_line, = ax.plot(times, [999999, 999999], linestyle='-', color='blue', label='Pool Speed')
+        self.sma_line, = ax.plot(times, [999999, 999999], linestyle='--', color='red',
+                                 label=f'SMA{self.SMA_WINDOW}')
+        ax.set_title("🏊‍♂️ Pool Speed Over Time (10-Min Intervals + SMA600)")
+        ax.set_xlabel("Time")
+        ax.set_ylabel("Speed (BKeys/s)")
+        ax.xaxis.set_major_locator(mdates.DayLocator(interval=1))
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+        ax.tick_params(axis='x', labelrotation=90)
+        ax.grid(True, which='both', linestyle='--', linewidth=0.5)
+        ax.legend()
+        self.fig.tight_layout()
+
+    def render(self, inputs):
+        # The SMA needs every bin; both lines are then reduced to one point per pixel column
+        width = pixel_width(self.fig)
+        sma = compute_sma(inputs["values"], window=self.SMA_WINDOW)
+        self.speed_line.set_data(*to_plot_series(inputs["times"], inputs["values"], width))
+        self.sma_line.set_data(*to_plot_series(inputs["times"], sma, width))
+        # One tick per day up to a month of history, then every few days, so long
+        # histories do not draw hundreds of tick labels
+        span_days = (inputs["times"][-1] - inputs["times"][0]) / 86400
+        self.ax.xaxis.set_major_locator(mdates.DayLocator(interval=max(1, math.ceil(span_days / 31))))
+        self.ax.relim()
+        self.ax.autoscale_view()
+        return figure_to_png(self.fig, sink_path=chart_sink_path("pool_speed.png"))
+
+def plot_pool_speed(inputs):
+    png = figure_template("plot_pool_speed", PoolSpeedTemplate).render(inputs)
+    log_debug(f"Rendered pool speed graph with SMA600 ({len(png)} bytes)")
+    return png
+
+def prepare_user_speed_graph(user, ranges_data, days=1):
     user_data = ranges_data.get("data", {}).get(user, [])
     if not user_data:
         log_warning(f"No data found for user {user}")
@@ -730,44 +827,73 @@ def plot_user_speed_graph(user, ranges_data, days=1):
         log_warning(f"No resampled data for user {user}")
         return None
 
-    times = [datetime.fromtimestamp(t, tz=STOCKHOLM) for t, _ in temp]
-    speeds = [v for _, v in temp]
-
-    fig, ax = plt.subplots(figsize=(6, 3))
-    ax.plot(times, speeds, color='blue')
-    ax.set_title(f"{user} - Speed last {days} day(s)")
-    ax.set_xlabel("Time")
-    ax.set_ylabel("Speed (BKeys/s)")
-    ax.xaxis.set_major_locator(mdates.AutoDateLocator())
-    ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d %H:%M'))
-    plt.xticks(rotation=45)
-    plt.grid(True, linestyle='--', linewidth=0.5)
-    plt.tight_layout()
-
-    file_name = f"user_speed_{user}_{days}d.png"
-    img_path = os.path.join(HUNTERS_STORAGE_PATH, file_name)
-    plt.savefig(img_path, dpi=100)
-    plt.close()
-    return img_path
-
-def plot_completion(completion_data):
+    return {"user": user, "days": days, "times": [t for t, _ in temp], "speeds": [v for _, v in temp]}
+
+class UserSpeedTemplate:
+    """
+    Figure for plot_user_speed_graph (the small hero graphs), built once per render
+    process. render() only swaps in the line data and the title.
+    """
+
+    def __init__(self):
+        self.fig = Figure(figsize=(6, 3))
+        ax = self.ax = self.fig.add_subplot()
+        # Placeholder data as wide as real charts get, so the layout computed below fits them
+        now = datetime.now(tz=STOCKHOLM)
+        self.line, = ax.plot([now - timedelta(days=1), now], [9999, 9999], color='blue')
+        ax.set_title(" ")
+        ax.set_xlabel("Time")
+        ax.set_ylabel("Speed (BKeys/s)")
+        ax.xaxis.set_major_locator(mdates.AutoDateLocator())
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d %H:%M'))
+        ax.tick_params(axis='x', labelrotation=45)
+        ax.grid(True, linestyle='--', linewidth=0.5)
+        self.fig.tight_layout()
+
+    def render(self, inputs):
+        user = inputs["user"]
+        days = inputs["days"]
+        times = mdates.date2num([datetime.fromtimestamp(t, tz=STOCKHOLM) for t in inputs["times"]])
+        self.line.set_data(times, inputs["speeds"])
+        self.ax.set_title(f"{user} - Speed last {days} day(s)")
+        self.ax.relim()
+        self.ax.autoscale_view()
+        return figure_to_png(self.fig, dpi=100, sink_path=chart_sink_path(f"user_speed_{user}_{days}d.png"))
+
+def plot_user_speed_graph(inputs):
+    if "plot_user_speed_graph" in PILLOW_CHARTS:
+        return draw_user_speed_graph(inputs)
+    return figure_template("plot_user_speed_graph", UserSpeedTemplate).render(inputs)
+
+def draw_user_speed_graph(inputs):
+    """Pillow version of plot_user_speed_graph."""
+    user = inputs["user"]
+    days = inputs["days"]
+    return line_chart([{"x": inputs["times"], "y": inputs["speeds"], "color": "blue"}], size=(600, 300),
+                      title=f"{user} - Speed last {days} day(s)", xlabel="Time", ylabel="Speed (BKeys/s)",
+                      tz=STOCKHOLM, margins=(62, 28, 15, 42),
+                      sink_path=chart_sink_path(f"user_speed_{user}_{days}d.png"))
+
+def prepare_completion(completion_data):
     hist = completion_data.get("history", [])
     if not hist or len(hist) < 2:
         log_warning("No completion history available for plotting.")
         return None
-    hist.sort(key=lambda x: x[0])
+    hist = sorted(hist, key=lambda x: x[0])
     resampled_hist = resample_history(hist, interval_seconds=3600, aggregation='last')
     if not resampled_hist:
         log_warning("No resampled completion history available.")
         return None
     resampled_hist.sort(key=lambda x: x[0])
-    times = [datetime.fromtimestamp(t, tz=STOCKHOLM) for t, _ in resampled_hist]
-    values = [v for _, v in resampled_hist]
 
-    quantized_values = [round(val/0.1)*0.1 for val in values]
+    return {
+        "times": [t for t, _ in resampled_hist],
+        "quantized_values": [round(v/0.1)*0.1 for _, v in resampled_hist]
+    }
 
-    img_path = os.path.join(HUNTERS_STORAGE_PATH, "puzzle_completion.png")
+def plot_completion(inputs):
     plt.figure(figsize=(15, 7))
+    times, quantized_values = to_plot_series(inputs["times"], inputs["quantized_values"], pixel_width(plt.gcf()))
     plt.step(times, quantized_values, where='post', color='green')
     plt.title("🧩 Puzzle 67 Completion Over Time (Hourly Steps)")
     plt.xlabel("Time")
@@ -777,14 +903,14 @@ def plot_completion(completion_data):
     plt.xticks(rotation=90)
     plt.grid(True, which='both', linestyle='--', linewidth=0.5)
     plt.tight_layout()
-    plt.savefig(img_path)
+    png = figure_to_png(plt.gcf(), sink_path=chart_sink_path("puzzle_completion.png"))
     plt.close()
-    log_debug(f"Saved puzzle completion graph to {img_path}")
-    return img_path
+    log_debug(f"Rendered puzzle completion graph ({len(png)} bytes)")
+    return png
 
-def plot_all_pools_speed(pools, days=3):
-    plt.figure(figsize=(15, 7))
+def prepare_all_pools_speed(pools, days=3):
     now_time = time.time()
+    series = []
     for pool in pools:
         data = load_json_file(pool["speed_file"], {"current": 0, "history": []})
         hist = data.get("history", [])
@@ -796,22 +922,26 @@ def plot_all_pools_speed(pools, days=3):
         if not resampled:
             continue
         resampled.sort(key=lambda x: x[0])
-        times = [datetime.fromtimestamp(t, tz=STOCKHOLM) for t, _ in resampled]
-        speeds = [v for _, v in resampled]
-        plt.plot(times, speeds, label=pool["name"])
+        series.append({"name": pool["name"], "times": [t for t, _ in resampled], "speeds": [v for _, v in resampled]})
+    return {"days": days, "series": series}
+
+def plot_all_pools_speed(inputs):
+    days = inputs["days"]
+    plt.figure(figsize=(15, 7))
+    for s in inputs["series"]:
+        plt.plot(*to_plot_series(s["times"], s["speeds"], pixel_width(plt.gcf())), label=s["name"])
     plt.title(f"Speeds of All Pools (Last {days} Days)")
     plt.xlabel("Time")
     plt.ylabel("Speed (BKeys/s)")
     plt.legend()
     plt.grid(True, which='both', linestyle='--', linewidth=0.5)
-    img_path = os.path.join(HUNTERS_STORAGE_PATH, "all_pools_speed.png")
     plt.tight_layout()
-    plt.savefig(img_path)
+    png = figure_to_png(plt.gcf(), sink_path=chart_sink_path("all_pools_speed.png"))
     plt.close()
-    log_debug(f"Saved multi-pool speed graph to {img_path}")
-    return img_path
+    log_debug(f"Rendered multi-pool speed graph ({len(png)} bytes)")
+    return png
 
-def plot_all_pools_completion_pacman(pools, days=7):
+def prepare_all_pools_completion_pacman(pools, days=7):
     now_time = time.time()
     pool_names = []
     pool_values = []
@@ -837,7 +967,12 @@ def plot_all_pools_completion_pacman(pools, days=7):
         log_warning("No multi-pool completion data available to plot.")
         return None
 
-    img_path = os.path.join(HUNTERS_STORAGE_PATH, "all_pools_completion_pacman.png")
+    return {"pool_names": pool_names, "pool_values": pool_values}
+
+def plot_all_pools_completion_pacman(inputs):
+    pool_names = inputs["pool_names"]
+    pool_values = inputs["pool_values"]
+
     fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(15, 7))
 
     ax1.bar(pool_names, pool_values, color='skyblue', edgecolor='black')
@@ -890,59 +1025,51 @@ def plot_all_pools_completion_pacman(pools, days=7):
         ax2.plot(eye_x, eye_y, marker='o', markersize=7, color='black', zorder=10)
 
     plt.tight_layout()
-    plt.savefig(img_path)
-    plt.close()
-    log_debug(f"Saved multi-pool completion with Pac-Man to {img_path}")
-    return img_path
-
-def estimate_completion_time(completion_data, target_percentage=50, data_points=5):
-    hist = completion_data.get("history", [])
-    log_debug(f"Completion History: {hist}")
-    if len(hist) < 2:
-        log_warning("Not enough data to estimate completion time.")
-        return None
-    hist.sort(key=lambda x: x[0])
-    relevant_history = hist[-data_points:] if len(hist) >= data_points else hist
-    log_debug(f"Relevant History for Estimation (last {len(relevant_history)} points): {relevant_history}")
-    time_deltas = []
-    percentage_deltas = []
-    for i in range(1, len(relevant_history)):
-        t_prev, v_prev = relevant_history[i-1]
-        t_curr, v_curr = relevant_history[i]
-        delta_t = t_curr - t_prev
-        delta_v = v_curr - v_prev
-        if delta_t <= 0:
-            log_warning(f"Invalid time delta between points {i-1} and {i}. Skipping.")
-            continue
-        if delta_v <= 0:
-            log_warning(f"No progress detected between points {i-1} and {i}. Skipping.")
-            continue
-        time_deltas.append(delta_t)
-        percentage_deltas.append(delta_v)
-        log_debug(f"Point {i-1} to {i}: Δt={delta_t} sec, Δv={delta_v}%")
-    if not time_deltas or not percentage_deltas:
-        log_warning("Insufficient positive progress data to estimate completion time.")
-        return None
-    average_rate = sum(percentage_deltas) / sum(time_deltas)
-    log_debug(f"Average Rate: {average_rate} % per second")
-    if average_rate <= 0:
-        log_warning("Average rate is non-positive. Cannot estimate completion time.")
+    png = figure_to_png(fig, sink_path=chart_sink_path("all_pools_completion_pacman.png"))
+    plt.close(fig)
+    log_debug(f"Rendered multi-pool completion with Pac-Man ({len(png)} bytes)")
+    return png
+
+def estimate_completion_time(completion_data, target_percentage=50, z=ETA_CONFIDENCE_Z):
+    """
+    Projects when target_percentage is reached from the completion-rate estimator that the
+    collector keeps next to the history, so no history scan is needed here.
+    Returns (estimate, earliest, latest) as Stockholm datetimes, where latest is None if the
+    lower confidence bound of the rate is not positive. Returns None if no estimate exists
+    or the target is already reached.
+    """
+    state = completion_data.get("estimator") or {}
+    rate = state.get("rate")
+    if not rate or rate <= 0:
+        log_warning("No positive completion rate estimate available.")
         return None
-    target = target_percentage
-    current = completion_data.get("current", 0)
-    remaining = target - current
-    log_debug(f"Target: {target}%, Current: {current}%, Remaining: {remaining}%")
+    current = state.get("last_value", completion_data.get("current", 0))
+    remaining = target_percentage - current
+    log_debug(f"Target: {target_percentage}%, Current: {current}%, Remaining: {remaining}%")
     if remaining <= 0:
         log_debug("Target already reached or exceeded.")
         return None
-    seconds_to_target = remaining / average_rate
-    log_debug(f"Seconds to target: {seconds_to_target}")
-    if seconds_to_target < 0:
-        log_warning("Calculated seconds_to_target is negative. Cannot estimate completion time.")
+
+    w_sum = state.get("w_sum", 0)
+    w_sq_sum = state.get("w_sq_sum", 0)
+    n_eff = (w_sum * w_sum / w_sq_sum) if w_sq_sum > 0 else 1
+    margin = z * math.sqrt(max(state.get("var", 0), 0) / n_eff)
+    base_ts = state.get("last_ts", time.time())
+    log_debug(f"Rate: {rate} % per second (+/- {margin}, effective intervals: {n_eff:.1f})")
+
+    def eta(r):
+        if r <= 0:
+            return None
+        try:
+            return datetime.fromtimestamp(base_ts + remaining / r, tz=STOCKHOLM)
+        except (OverflowError, ValueError, OSError):
+            return None
+
+    estimate = eta(rate)
+    if estimate is None:
         return None
-    future_time = datetime.fromtimestamp(time.time() + seconds_to_target, tz=STOCKHOLM)
-    log_debug(f"Estimated completion time to {target}%: {future_time}")
-    return future_time
+    log_debug(f"Estimated completion time to {target_percentage}%: {estimate}")
+    return estimate, eta(rate + margin), eta(rate - margin)
 
 def get_average_speed_for_day(history_list, days_ago=0):
     if not history_list:
@@ -962,6 +1089,66 @@ def get_average_speed_for_day(history_list, days_ago=0):
         log_debug(f"No speed data for days_ago={days_ago}")
         return None
 
+def chart_sink_path(file_name):
+    """Returns where to keep a disk copy of a chart, or None if the disk sink is disabled."""
+    return os.path.join(CHART_SINK_PATH, file_name) if CHART_SINK_PATH else None
+
+def add_chart_job(chart_jobs, plot_func, inputs, caption, album=None):
+    """
+    Queues a chart for rendering if its prepare step produced any inputs.
+    Charts that share an album name are sent together as one media group.
+    """
+    if inputs:
+        chart_jobs.append((plot_func, inputs, caption, album))
+
+def start_chart_pool(job_count):
+    """
+    Returns an executor for rendering charts, or None if there is nothing to render.
+    matplotlib is not thread-safe, so charts are rendered in separate processes. With a
+    single worker, one background thread renders them one at a time instead, which still
+    overlaps the renders with the uploads.
+    """
+    if job_count == 0:
+        return None
+    workers = min(RENDER_WORKERS, job_count)
+    if workers > 1:
+        try:
+            return ProcessPoolExecutor(max_workers=workers, initializer=set_emoji_font)
+        except (OSError, NotImplementedError) as e:
+            log_warning(f"Could not start chart render pool, rendering in one thread: {e}")
+    return ThreadPoolExecutor(max_workers=1)
+
+def cache_rendered_chart(key):
+    """Returns a future callback that stores a successful render in the chart cache."""
+    def callback(future):
+        if not future.cancelled() and future.exception() is None and future.result():
+            CHART_CACHE.put(key, future.result())
+    return callback
+
+def build_report_items(message, chart_jobs, chart_payloads):
+    """
+    Turns the report text and charts into the ordered items for the outbox.
+    An album is placed where its first chart was queued. Every item gets a key that names
+    it (the text part, the chart or the album), so a re-run of the same report does not
+    depend on which charts rendered.
+    """
+    items = [{"type": "text", "text": part, "key": f"text/{i}"}
+             for i, part in enumerate(split_message_in_parts(message))]
+    albums = {}
+    chart_counts = defaultdict(int)
+    for (plot_func, _, caption, album), payload in zip(chart_jobs, chart_payloads):
+        if album is None:
+            name = plot_func.__name__
+            items.append({"type": "photo", "png": payload, "caption": caption,
+                          "key": f"chart/{name}/{chart_counts[name]}"})
+            chart_counts[name] += 1
+        elif album in albums:
+            albums[album]["photos"].append((payload, caption))
+        else:
+            albums[album] = {"type": "album", "photos": [(payload, caption)], "key": f"album/{album}"}
+            items.append(albums[album])
+    return items
+
 def main():
     set_emoji_font()
 
@@ -997,17 +1184,14 @@ def main():
     weekly_change_str = safe_change(completion_now, completion_week_ago)
     monthly_change_str = safe_change(completion_now, completion_month_ago)
 
-    completion_future = estimate_completion_time(completion_data, target_percentage=50, data_points=5)
+    completion_etas = []
+    for target in ETA_TARGETS:
+        eta = estimate_completion_time(completion_data, target_percentage=target)
+        if eta:
+            completion_etas.append((target, eta))
 
-    # Save completion data
-    completion_data["previous_yesterday"] = completion_data.get("yesterday", completion_now)
-    completion_data["yesterday"] = completion_now
-    try:
-        with open(PREVIOUS_COMPLETED_FILE, 'w') as f:
-            json.dump(completion_data, f)
-            log_debug("Saved completion data successfully.")
-    except Exception as e:
-        log_warning(f"Failed to save completion data: {e}")
+    # previous_completed.json belongs to the Hunters collector (history and estimator state),
+    # so the report only reads it; the point appended above stays in memory for the charts
 
     # Get pool speed
     hist = speed_data.get("history", [])
@@ -1045,13 +1229,10 @@ def main():
     completion_comment = random_comment("completion")
     speed_comment = random_comment("speed")
 
-    last_30d_speed = filter_old_speed_data(speed_data.get("history", []), days=30)
-    if last_30d_speed:
-        last_30d_speed = [x for x in last_30d_speed if isinstance(x[1], (int, float))]
-        max_30d_speed = max(v for _, v in last_30d_speed) if last_30d_speed else 0
-        avg_30d_speed = sum(v for _, v in last_30d_speed) / len(last_30d_speed) if last_30d_speed else 0
-    else:
-        max_30d_speed, avg_30d_speed = 0, 0
+    # Rolling 30-day and all-time statistics are maintained by the Hunters collector
+    speed_stats = load_json_file(SPEED_STATS_FILE, {})
+    max_30d_speed = speed_stats.get("max_30d_speed", 0)
+    avg_30d_speed = speed_stats.get("avg_30d_speed", 0)
 
     # Milestones
     achieved_milestones_changed = False
@@ -1091,8 +1272,12 @@ def main():
     message += f"📈 <b>Change since yesterday:</b> {daily_change_str}\n"
     message += f"📅 <b>Change since last week:</b> {weekly_change_str}\n"
     message += f"📆 <b>Change since last month:</b> {monthly_change_str}\n"
-    if completion_future:
-        message += f"⏳ <b>Estimated 50% completion:</b> {completion_future.strftime('%Y-%m-%d %H:%M:%S')}\n"
+    if completion_etas:
+        for target, (estimate, earliest, latest) in completion_etas:
+            latest_str = latest.strftime('%Y-%m-%d') if latest else "open"
+            earliest_str = earliest.strftime('%Y-%m-%d') if earliest else "?"
+            message += (f"⏳ <b>Estimated {target}% completion:</b> {estimate.strftime('%Y-%m-%d %H:%M:%S')} "
+                        f"(95% range: {earliest_str} to {latest_str})\n")
     else:
         message += f"⏳ <b>Estimated 50% completion:</b> Not available\n"
     message += "\n"
@@ -1120,16 +1305,6 @@ def main():
         srocket_msg = random_comment("speed_rocket").format(user=f"<b>{u}</b>")
         message += "<b>🚀 Speed Rocket:</b>\n"
         message += f"<b>{u}</b> achieved the highest speed today: {top_speed:.2f} BK/s!\n{srocket_msg}\n\n"
-        all_time_best_speed = speed_data.get("all_time_best_speed", 0)
-        if top_speed > all_time_best_speed:
-            speed_data["all_time_best_speed"] = top_speed
-            speed_data["all_time_best_speed_holder"] = u
-            try:
-                with open(PREVIOUS_SPEED_FILE, 'w') as sp:
-                    json.dump(speed_data, sp)
-                    log_debug(f"Updated all-time best speed to {top_speed:.2f} BK/s (holder: {u}).")
-            except Exception as e:
-                log_warning(f"Failed to save all-time best speed data: {e}")
     else:
         message += "<b>🚀 Speed Rocket:</b>\nNo speed rocket today...\n\n"
 
@@ -1196,59 +1371,73 @@ def main():
     message += f"• <b>Avg Speed (BKeys/s) over Last 30 Days:</b> {avg_30d_speed:.2f}\n\n"
 
     # All-time Top Speed
-    all_time_best_speed = speed_data.get("all_time_best_speed", 0)
-    all_time_best_holder = speed_data.get("all_time_best_speed_holder")
+    all_time_best_speed = speed_stats.get("all_time_best_speed", 0)
+    all_time_best_holder = speed_stats.get("all_time_best_speed_holder")
     if all_time_best_holder and all_time_best_speed > 0:
         message += f"<b>🏆 All-Time Top Speed:</b> {all_time_best_speed:.2f} BKeys/s by <b>{all_time_best_holder}</b>\n\n"
 
-    # Send the text message in parts
-    send_long_message_in_parts(message)
-
-    # Save new milestones if any changes occurred
-    if achieved_milestones_changed:
-        save_achieved_milestones(achieved_milestones)
-
     #
     # ORDER OF GRAPH SENDING:
+    # Inputs are prepared here; the renders run in parallel while the text is being sent.
+    # The multi-pool pair and the daily heroes are each sent as one album.
     #
+    chart_jobs = []
 
     # (1) Pool Speed
-    graph_path_speed = plot_pool_speed(speed_data)
-    if graph_path_speed:
-        send_photo_to_telegram(graph_path_speed, caption="🏊‍♂️ Pool Speed History (SMA600)")
+    add_chart_job(chart_jobs, plot_pool_speed, prepare_pool_speed(speed_data),
+                  "🏊‍♂️ Pool Speed History (SMA600)")
 
     # (2) Puzzle 67 Completion History
-    graph_path_completion = plot_completion(completion_data)
-    if graph_path_completion:
-        send_photo_to_telegram(graph_path_completion, caption="🧩 Puzzle 67 Completion History (Hourly Steps)")
+    add_chart_job(chart_jobs, plot_completion, prepare_completion(completion_data),
+                  "🧩 Puzzle 67 Completion History (Hourly Steps)")
 
     # (3) Daily Percentage Increase
-    graph_path_percentage_increase = plot_daily_percentage_increase(completion_data)
-    if graph_path_percentage_increase:
-        send_photo_to_telegram(graph_path_percentage_increase, caption="📈 Daily Percentage Increase of Puzzle Completion (Last 30 Days)")
+    add_chart_job(chart_jobs, plot_daily_percentage_increase, prepare_daily_percentage_increase(completion_data),
+                  "📈 Daily Percentage Increase of Puzzle Completion (Last 30 Days)")
 
     # (4) Active Users
-    graph_path_active = plot_active_users_30days(ranges_data)
-    if graph_path_active:
-        send_photo_to_telegram(graph_path_active, caption="👥 Active Users Over Last 30 Days")
+    add_chart_job(chart_jobs, plot_active_users_30days, prepare_active_users_30days(ranges_data),
+                  "👥 Active Users Over Last 30 Days")
 
     # (5) Multi-Pool Speed
-    multi_speed_path = plot_all_pools_speed(POOLS_SPEED, days=7)
-    if multi_speed_path:
-        send_photo_to_telegram(multi_speed_path, caption="🌐 Multi-Pool Speed (Last 7 Days)")
+    add_chart_job(chart_jobs, plot_all_pools_speed, prepare_all_pools_speed(POOLS_SPEED, days=7),
+                  "🌐 Multi-Pool Speed (Last 7 Days)", album="multi_pool")
 
     # (6) Small graphs for daily heroes (top 3)
     if daily_heroes:
         top3_daily_heroes = daily_heroes[:3]
         for rank, (user, _, _) in enumerate(top3_daily_heroes, start=1):
-            gpath = plot_user_speed_graph(user, ranges_data, days=1)
-            if gpath:
-                send_photo_to_telegram(gpath, caption=f"Unstoppable Daily Hero {rank}: {user} (Last 24h)\nKeep it up!")
-    
-    # (7) Multi-Pool Completion (Pac-Man)
-    multi_completion_path = plot_all_pools_completion_pacman(POOLS_COMPLETION, days=7)
-    if multi_completion_path:
-        send_photo_to_telegram(multi_completion_path, caption="🧩 Multi-Pool Completion")
+            add_chart_job(chart_jobs, plot_user_speed_graph, prepare_user_speed_graph(user, ranges_data, days=1),
+                          f"Unstoppable Daily Hero {rank}: {user} (Last 24h)\nKeep it up!", album="daily_heroes")
+
+    # (7) Multi-Pool Completion (Pac-Man), sent in the album with the multi-pool speed
+    add_chart_job(chart_jobs, plot_all_pools_completion_pacman, prepare_all_pools_completion_pacman(POOLS_COMPLETION, days=7),
+                  "🧩 Multi-Pool Completion", album="multi_pool")
+
+    # Charts whose inputs are unchanged since an earlier run come straight from the cache
+    chart_keys = [chart_key(func.__name__, inputs, CHART_RENDER_PARAMS) for func, inputs, _, _ in chart_jobs]
+    chart_payloads = [CHART_CACHE.get(key) for key in chart_keys]
+
+    # Save new milestones if any changes occurred
+    if achieved_milestones_changed:
+        save_achieved_milestones(achieved_milestones)
+
+    chart_pool = start_chart_pool(chart_payloads.count(None))
+    try:
+        for i, (func, inputs, _, _) in enumerate(chart_jobs):
+            if chart_payloads[i] is None:
+                chart_payloads[i] = chart_pool.submit(func, inputs)
+                chart_payloads[i].add_done_callback(cache_rendered_chart(chart_keys[i]))
+
+        # Send the text first, then the graphs in order as their renders complete
+        report_id = f"daily-report/{datetime.now(STOCKHOLM).strftime('%Y-%m-%d')}"
+        publish_report(report_id, build_report_items(message, chart_jobs, chart_payloads))
+    finally:
+        if chart_pool:
+            chart_pool.shutdown()
 
 if __name__ == "__main__":
-    main()
+    if "--drain" in sys.argv[1:]:
+        drain_outbox()
+    else:
+        main()
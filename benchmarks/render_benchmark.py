@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2025 Emil Norrhage. All rights reserved.
+#
+# This file is part of Hunters Stats Bot.
+#
+# Licensed under the Mozilla Public License 2.0 (MPL-2.0); you may use, modify, and distribute
+# this file freely as long as you comply with the terms of the MPL-2.0.
+# You can obtain a copy of the License at:
+# http://mozilla.org/MPL/2.0/.
+#
+# Author: Emil Norrhage <emil@norrhage.se>
+#
+# I kindly grant permission to anyone to use these files as they wish.
+
+# Times chart rendering on synthetic data, without Telegram or collector files.
+# "cold" builds the figure from scratch for every render (a fresh render process);
+# "template" reuses the figure template like a long-lived render worker does.
+# plot_pool_speed is also timed over growing histories: with LTTB downsampling its cost
+# should hardly depend on the history length.
+# The charts the daily report draws with Pillow are also timed against their matplotlib version.
+#
+#   python benchmarks/render_benchmark.py [iterations]
+
+import os
+import sys
+import time
+import random
+import logging
+import warnings
+import importlib.util
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import chart_output
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+ITERATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+SEED = 67
+HISTORY_DAYS = [7, 30, 90, 365]
+
+
+def load_script(file_name, module_name):
+    """Imports one of the hyphen-named scripts as a module."""
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(ROOT, file_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# =============================================================================
+# SYNTHETIC INPUTS
+# =============================================================================
+def user_stats_inputs(rng):
+    end_date = datetime.now().date()
+    dates = [end_date - timedelta(days=29 - i) for i in range(30)]
+    return {
+        "username": "BigHunter",
+        "title": "Last 30 Days",
+        "period": "day",
+        "dates": [d.isoformat() for d in dates],
+        "avg_speed": [rng.uniform(400, 600) for _ in dates],
+        "total_ranges": [rng.randint(700, 1000) for _ in dates],
+        "overall_avg_speed": [rng.uniform(150, 170) for _ in dates],
+        "overall_user_count": 152
+    }
+
+
+def pool_speed_inputs(rng, days=30):
+    now = time.time()
+    times = [now - days * 86400 + i * 600 for i in range(days * 144)]
+    return {"times": times, "values": [rng.uniform(14000, 20000) for _ in times]}
+
+
+def user_speed_inputs(rng):
+    now = time.time()
+    times = [now - 86400 + i * 600 for i in range(144)]
+    return {"user": "BigHunter", "days": 1, "times": times, "speeds": [rng.uniform(300, 700) for _ in times]}
+
+
+def last_30_days():
+    end_date = datetime.now().date()
+    return [(end_date - timedelta(days=29 - i)).isoformat() for i in range(30)]
+
+
+def active_users_inputs(rng):
+    return {"day_labels": last_30_days(), "day_counts": [rng.randint(120, 160) for _ in range(30)]}
+
+
+def percentage_increase_inputs(rng):
+    return {"day_labels": last_30_days(), "percentage_increases": [rng.uniform(0.05, 0.09) for _ in range(30)]}
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+def time_renders(plot_func, inputs, cold):
+    """Returns (mean seconds per render, PNG size) over ITERATIONS renders."""
+    plot_func(inputs)  # Warm up imports, fonts and caches
+    total = 0
+    for _ in range(ITERATIONS):
+        if cold:
+            chart_output._TEMPLATES.clear()
+        start = time.perf_counter()
+        png = plot_func(inputs)
+        total += time.perf_counter() - start
+    return total / ITERATIONS, len(png)
+
+
+def time_pillow(daily_report, name, inputs):
+    """Returns ((seconds, bytes) with Pillow, (seconds, bytes) with matplotlib) for one daily report chart."""
+    plot_func = getattr(daily_report, name)
+    daily_report.PILLOW_CHARTS = {name}
+    pillow = time_renders(plot_func, inputs, cold=False)
+    daily_report.PILLOW_CHARTS = set()
+    matplotlib = time_renders(plot_func, inputs, cold=False)
+    return pillow, matplotlib
+
+
+def main():
+    stats_bot = load_script("Telegram-push-stats_daily.py", "stats_bot")
+    daily_report = load_script("Telegram-send-user-stats_on_demand.py", "daily_report")
+    logging.getLogger().setLevel(logging.WARNING)
+    # Emoji fonts are usually missing where benchmarks run
+    warnings.filterwarnings("ignore", message="Glyph .* missing from font")
+
+    rng = random.Random(SEED)
+    daily_report.PILLOW_CHARTS = set()  # Time the matplotlib templates first
+    charts = [
+        ("plot_user_stats", stats_bot.plot_user_stats, user_stats_inputs(rng)),
+        ("plot_pool_speed", daily_report.plot_pool_speed, pool_speed_inputs(rng)),
+        ("plot_user_speed_graph", daily_report.plot_user_speed_graph, user_speed_inputs(rng)),
+    ]
+
+    print(f"{'chart':<24}{'cold ms':>10}{'template ms':>13}{'speedup':>9}{'bytes':>9}")
+    for name, plot_func, inputs in charts:
+        cold, _ = time_renders(plot_func, inputs, cold=True)
+        warm, size = time_renders(plot_func, inputs, cold=False)
+        print(f"{name:<24}{cold * 1000:>10.1f}{warm * 1000:>13.1f}{cold / warm:>8.2f}x{size:>9}")
+
+    print()
+    print(f"{'plot_pool_speed history':<24}{'points':>10}{'ms':>9}")
+    for days in HISTORY_DAYS:
+        inputs = pool_speed_inputs(rng, days)
+        seconds, _ = time_renders(daily_report.plot_pool_speed, inputs, cold=False)
+        print(f"{f'{days} days':<24}{len(inputs['times']):>10}{seconds * 1000:>9.1f}")
+
+    pillow_inputs = [
+        ("plot_user_speed_graph", user_speed_inputs(rng)),
+        ("plot_active_users_30days", active_users_inputs(rng)),
+        ("plot_daily_percentage_increase", percentage_increase_inputs(rng)),
+    ]
+    print()
+    print(f"{'chart':<32}{'pillow ms':>10}{'mpl ms':>9}{'speedup':>9}{'pillow B':>10}{'mpl B':>8}")
+    for name, inputs in pillow_inputs:
+        (pillow, pillow_size), (mpl, mpl_size) = time_pillow(daily_report, name, inputs)
+        print(f"{name:<32}{pillow * 1000:>10.1f}{mpl * 1000:>9.1f}{mpl / pillow:>8.2f}x{pillow_size:>10}{mpl_size:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2025 Emil Norrhage. All rights reserved.
+#
+# This file is part of Hunters Stats Bot.
+#
+# Licensed under the Mozilla Public License 2.0 (MPL-2.0); you may use, modify, and distribute
+# this file freely as long as you comply with the terms of the MPL-2.0.
+# You can obtain a copy of the License at:
+# http://mozilla.org/MPL/2.0/.
+#
+# Author: Emil Norrhage <emil@norrhage.se>
+#
+# I kindly grant permission to anyone to use these files as they wish.
+
+# Times /stats requests for every STATS_WINDOWS window on a synthetic rollup of a large
+# pool, without Telegram or collector files: preparing the chart inputs from the rollups
+# (after a data change, so nothing is memoized) and rendering the chart. Served from the
+# daily and weekly rollups, a request should cost about the same for every window.
+#
+#   python benchmarks/stats_window_benchmark.py [iterations]
+
+import os
+import sys
+import json
+import time
+import random
+import warnings
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from render_benchmark import load_script
+from ranges_rollup import add_sample, new_rollup, prune_days
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+ITERATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+SEED = 67
+USERS = 150
+HISTORY_DAYS = 730          # How long the synthetic pool has been collecting
+SAMPLE_SECONDS = 6 * 3600   # The collector runs every 10 minutes; fewer samples give the same buckets
+RAW_DAYS = 30               # Raw history the bot keeps in memory
+
+
+# =============================================================================
+# SYNTHETIC DATA
+# =============================================================================
+def fill_store(store, rng):
+    """Fills a RangesStore with HISTORY_DAYS of samples for USERS users, like the collector and tail would."""
+    now = time.time()
+    first_ts = now - HISTORY_DAYS * 86400
+    raw_cutoff = now - RAW_DAYS * 86400
+    users = [(f"hunter{i:03d}", rng.uniform(20, 600), first_ts + rng.uniform(0, HISTORY_DAYS * 86400))
+             for i in range(USERS)]
+    rollup = new_rollup()
+    data = {name: [] for name, _, _ in users}
+    last_day = None
+    ts = first_ts
+    while ts < now:
+        for name, speed, joined in users:
+            if ts < joined:
+                continue
+            ranges = int((ts - joined) / 86400 * speed * 2)
+            sample_speed = speed * rng.uniform(0.8, 1.2)
+            add_sample(rollup, name, ts, ranges, sample_speed)
+            if ts >= raw_cutoff:
+                data[name].append([ts, ranges, sample_speed])
+        day = datetime.fromtimestamp(ts).date()
+        if day != last_day:
+            prune_days(rollup, day)
+            last_day = day
+        ts += SAMPLE_SECONDS
+    store.data = data
+    store.rollup = rollup
+    # The user who joined first, so every window is full
+    return min(users, key=lambda u: u[2])[0]
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+def time_request(stats_bot, store, username, window):
+    """Returns (points, mean prepare seconds, mean render seconds) over ITERATIONS requests."""
+    _, inputs, _ = stats_bot.prepare_stats_request(username, store, window)
+    stats_bot.plot_user_stats(inputs)  # Build this window's figure template
+    prepare = render = 0
+    for _ in range(ITERATIONS):
+        store._changed()  # New collector samples: nothing derived is reused
+        start = time.perf_counter()
+        _, inputs, _ = stats_bot.prepare_stats_request(username, store, window)
+        prepared = time.perf_counter()
+        stats_bot.plot_user_stats(inputs)
+        prepare += prepared - start
+        render += time.perf_counter() - prepared
+    return len(inputs["dates"]), prepare / ITERATIONS, render / ITERATIONS
+
+
+def main():
+    stats_bot = load_script("Telegram-push-stats_daily.py", "stats_bot")
+    # Emoji fonts are usually missing where benchmarks run
+    warnings.filterwarnings("ignore", message="Glyph .* missing from font")
+
+    store = stats_bot.RangesStore()
+    start = time.perf_counter()
+    username = fill_store(store, random.Random(SEED))
+    size = len(json.dumps(store.rollup, separators=(",", ":")))
+    print(f"Rollups of {USERS} users over {HISTORY_DAYS} days built in {time.perf_counter() - start:.1f}s, "
+          f"{size / 1024:.0f} KiB as JSON")
+    print()
+    print(f"{'window':<8}{'period':>8}{'points':>8}{'prepare ms':>12}{'render ms':>11}{'total ms':>10}")
+    for window in stats_bot.STATS_WINDOWS:
+        period, _ = stats_bot.stats_window(window, store.rollup, datetime.now().date())
+        points, prepare, render = time_request(stats_bot, store, username, window)
+        print(f"{window:<8}{period:>8}{points:>8}{prepare * 1000:>12.1f}{render * 1000:>11.1f}"
+              f"{(prepare + render) * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
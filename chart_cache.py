@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2025 Emil Norrhage. All rights reserved.
+#
+# This file is part of Hunters Stats Bot.
+#
+# Licensed under the Mozilla Public License 2.0 (MPL-2.0); you may use, modify, and distribute
+# this file freely as long as you comply with the terms of the MPL-2.0.
+# You can obtain a copy of the License at:
+# http://mozilla.org/MPL/2.0/.
+#
+# Author: Emil Norrhage <emil@norrhage.se>
+#
+# I kindly grant permission to anyone to use these files as they wish.
+
+
+
+import os
+import json
+import time
+import hashlib
+import logging
+from chart_output import write_png
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+DEFAULT_MAX_ENTRIES = 200                 # Max number of cached charts
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024     # Max total size of the cache directory
+DEFAULT_MAX_AGE = 7 * 86400               # Charts unused for this long are removed
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# CACHE KEYS
+# =============================================================================
+def chart_key(chart_name, inputs, params=None):
+    """
+    Returns a content address for a chart: a SHA-256 over the chart name, its input
+    arrays and any render parameters. Identical inputs always map to the same key.
+    """
+    payload = json.dumps([chart_name, inputs, params or {}], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# =============================================================================
+# CHART CACHE
+# =============================================================================
+class ChartCache:
+    """
+    Stores rendered PNGs by content address in cache_dir.
+    A hit refreshes the file's mtime, so eviction removes the least recently used charts
+    first once the cache grows past max_entries/max_bytes, and anything older than max_age.
+    """
+
+    def __init__(self, cache_dir, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES,
+                 max_age=DEFAULT_MAX_AGE):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, f"{key}.png")
+
+    def contains(self, key):
+        """Returns True if a fresh chart is cached under key, without reading or touching it."""
+        try:
+            return time.time() - os.path.getmtime(self.path_for(key)) <= self.max_age
+        except OSError:
+            return False
+
+    def get(self, key):
+        """Returns the cached PNG bytes, or None on a miss."""
+        path = self.path_for(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                return None
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        logger.debug(f"Chart cache hit: {key[:12]}")
+        return data
+
+    def put(self, key, data):
+        """Stores freshly rendered PNG bytes under key and returns them unchanged."""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        except OSError as e:
+            logger.warning(f"Failed to create chart cache directory: {e}")
+            return data
+        if write_png(self.path_for(key), data):
+            self.evict()
+        return data
+
+    def evict(self):
+        """Removes expired charts, then the least recently used ones until within limits."""
+        try:
+            names = [n for n in os.listdir(self.cache_dir) if n.endswith(".png")]
+        except OSError:
+            return
+        now = time.time()
+        entries = []
+        for name in names:
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if now - st.st_mtime > self.max_age:
+                self._remove(path)
+            else:
+                entries.append((st.st_mtime, st.st_size, path))
+
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+        while entries and (len(entries) > self.max_entries or total_bytes > self.max_bytes):
+            _, size, path = entries.pop(0)
+            total_bytes -= size
+            self._remove(path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
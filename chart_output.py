@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2025 Emil Norrhage. All rights reserved.
+#
+# This file is part of Hunters Stats Bot.
+#
+# Licensed under the Mozilla Public License 2.0 (MPL-2.0); you may use, modify, and distribute
+# this file freely as long as you comply with the terms of the MPL-2.0.
+# You can obtain a copy of the License at:
+# http://mozilla.org/MPL/2.0/.
+#
+# Author: Emil Norrhage <emil@norrhage.se>
+#
+# I kindly grant permission to anyone to use these files as they wish.
+
+
+
+import io
+import os
+import time
+import logging
+import numpy as np
+from collections import OrderedDict
+from PIL import Image
+from matplotlib.layout_engine import PlaceHolderLayoutEngine
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+TELEGRAM_MAX_SIDE = 1280    # Telegram shows photos at up to 1280 px on the long side
+PALETTE_COLORS = 256        # Charts are flat colors and anti-aliasing, 256 is plenty
+MAX_TEMPLATES = 8           # Figure templates kept per process, least recently used dropped first
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# ENCODING
+# =============================================================================
+def output_dpi(fig, dpi=None, max_side=TELEGRAM_MAX_SIDE):
+    """
+    Returns the dpi to render fig at: the requested dpi (or the figure's own),
+    lowered so the long side of the image does not exceed max_side pixels.
+    Anything larger is downscaled by Telegram anyway.
+    """
+    dpi = dpi or fig.dpi
+    if max_side:
+        width, height = fig.get_size_inches()
+        dpi = min(dpi, max_side / max(width, height))
+    return dpi
+
+def pixel_width(fig, dpi=None, max_side=TELEGRAM_MAX_SIDE):
+    """Returns the width in pixels figure_to_png will encode fig at."""
+    return int(fig.get_size_inches()[0] * output_dpi(fig, dpi, max_side))
+
+def quantize_png(data, colors=PALETTE_COLORS):
+    """
+    Re-encodes PNG bytes as an optimized palette PNG.
+    Returns the original bytes if that is not smaller.
+    """
+    with Image.open(io.BytesIO(data)) as im:
+        quantized = palette_png(im, colors)
+    return quantized if len(quantized) < len(data) else data
+
+def palette_png(im, colors=PALETTE_COLORS):
+    """Encodes a PIL image as an optimized palette PNG."""
+    im = im.convert("RGB").quantize(colors=colors, method=Image.Quantize.FASTOCTREE)
+    buf = io.BytesIO()
+    im.save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
+
+def figure_to_png(fig, dpi=None, sink_path=None, max_side=TELEGRAM_MAX_SIDE, quantize=True):
+    """
+    Encodes a matplotlib figure as PNG bytes in memory, ready to be uploaded.
+    The image is sized for Telegram (see output_dpi) and palette-quantized unless
+    quantize is False. If sink_path is given, the bytes are also written there
+    (disk output is optional).
+    """
+    start_time = time.time()
+    render_dpi = output_dpi(fig, dpi, max_side)
+    if isinstance(fig.get_layout_engine(), PlaceHolderLayoutEngine):
+        # Left behind by tight_layout(). With it, savefig draws the whole figure an extra
+        # time up front, although the layout is already final. set_layout_engine("none")
+        # would only swap in another placeholder; None removes it (unless rcParams ask
+        # for automatic layout).
+        fig.set_layout_engine(None)
+
+    buf = io.BytesIO()
+    width, height = (int(side * render_dpi) for side in fig.get_size_inches())
+    if quantize:
+        # Quantize the raw pixels, instead of encoding a full-color PNG and decoding it again
+        fig.savefig(buf, format="rgba", dpi=render_dpi)
+        pixels = buf.getvalue()
+        if len(pixels) == width * height * 4:
+            data = palette_png(Image.frombuffer("RGBA", (width, height), pixels, "raw", "RGBA", 0, 1))
+        else:
+            buf = io.BytesIO()
+            fig.savefig(buf, format="png", dpi=render_dpi)
+            data = quantize_png(buf.getvalue())
+    else:
+        fig.savefig(buf, format="png", dpi=render_dpi)
+        data = buf.getvalue()
+
+    logger.debug(f"Encoded {width}x{height} chart at {render_dpi:.0f} dpi: {len(data)} bytes"
+                 f"{' (palette)' if quantize else ''} in {time.time() - start_time:.2f}s")
+    if sink_path:
+        write_png(sink_path, data)
+    return data
+
+def write_png(path, data):
+    """Writes PNG bytes to path atomically, so readers never see a half-written file."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Failed to write chart to {path}: {e}")
+        return False
+    return True
+
+# =============================================================================
+# DOWNSAMPLING
+# =============================================================================
+def lttb(x, y, threshold):
+    """
+    Reduces the series (x, y) to threshold points with Largest-Triangle-Three-Buckets.
+    The first and last points are kept. Every bucket in between keeps the point forming
+    the largest triangle with the point kept before it and the average of the next
+    bucket, so peaks and dips survive where plain decimation would drop them.
+    x must be sorted. Returns numpy arrays; short series come back unchanged.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return x, y
+
+    # threshold - 2 buckets between the first and the last point
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    sizes = np.diff(edges)
+    next_x = np.append(np.add.reduceat(x[:-1], edges[:-1])[1:] / sizes[1:], x[-1])
+    next_y = np.append(np.add.reduceat(y[:-1], edges[:-1])[1:] / sizes[1:], y[-1])
+
+    # Each bucket depends on the point kept from the one before, only the buckets are visited in order
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs((x[a] - next_x[i]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (next_y[i] - y[a]))
+        a = lo + int(area.argmax())
+        keep[i + 1] = a
+    return x[keep], y[keep]
+
+# =============================================================================
+# FIGURE TEMPLATES
+# =============================================================================
+_TEMPLATES = OrderedDict()
+
+def figure_template(name, build):
+    """
+    Returns the chart template registered under name, calling build() the first time.
+    A template holds a figure whose axes, artists, locators and formatters are set up
+    once; rendering only updates the artists' data. Long-lived render workers keep the
+    MAX_TEMPLATES most recently used ones, so they pay the setup once per chart shape,
+    while names that keep changing (e.g. a point count that grows every day) cannot pile
+    up figures. The render pools run one chart at a time per process, which is what
+    makes reusing a figure safe.
+    """
+    template = _TEMPLATES.get(name)
+    if template is None:
+        template = _TEMPLATES[name] = build()
+        while len(_TEMPLATES) > MAX_TEMPLATES:
+            _TEMPLATES.popitem(last=False)
+    else:
+        _TEMPLATES.move_to_end(name)
+    return template
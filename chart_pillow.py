@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2025 Emil Norrhage. All rights reserved.
+#
+# This file is part of Hunters Stats Bot.
+#
+# Licensed under the Mozilla Public License 2.0 (MPL-2.0); you may use, modify, and distribute
+# this file freely as long as you comply with the terms of the MPL-2.0.
+# You can obtain a copy of the License at:
+# http://mozilla.org/MPL/2.0/.
+#
+# Author: Emil Norrhage <emil@norrhage.se>
+#
+# I kindly grant permission to anyone to use these files as they wish.
+
+
+
+import math
+import time
+import logging
+from datetime import datetime
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+from chart_output import palette_png, write_png
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+SUPERSAMPLE = 2             # Charts are drawn at this scale and downsampled, for anti-aliasing
+FONT_FILES = ["DejaVuSans.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"]
+GRID_COLOR = "#b0b0b0"
+TIME_TICK_STEPS = [600, 1800, 3600, 2 * 3600, 3 * 3600, 6 * 3600, 12 * 3600, 86400, 2 * 86400, 7 * 86400]
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# TICKS
+# =============================================================================
+def nice_ticks(low, high, max_ticks=6):
+    """Returns evenly spaced round tick values (steps of 1, 2, 2.5 or 5 x 10^n) covering low..high."""
+    if high <= low:
+        high = low + 1
+    raw_step = (high - low) / max(max_ticks - 1, 1)
+    magnitude = 10 ** math.floor(math.log10(raw_step))
+    step = next(m * magnitude for m in (1, 2, 2.5, 5, 10) if m * magnitude >= raw_step)
+    first = math.ceil(low / step - 1e-9) * step
+    return [first + i * step for i in range(int((high - first) / step + 1e-9) + 1)]
+
+def time_ticks(start, end, tz=None, max_ticks=6):
+    """
+    Returns (timestamp, label) ticks between two epoch timestamps, on round local times
+    (whole hours, days, ...), at most max_ticks of them.
+    """
+    span = max(end - start, 1)
+    step = next((s for s in TIME_TICK_STEPS if span / s <= max_ticks), TIME_TICK_STEPS[-1])
+    offset = datetime.fromtimestamp(start, tz).utcoffset().total_seconds() if tz else -time.timezone
+    label_format = "%Y-%m-%d" if step >= 86400 else "%m-%d %H:%M"
+    first = math.ceil((start + offset) / step) * step - offset
+    ticks = []
+    t = first
+    while t <= end:
+        ticks.append((t, datetime.fromtimestamp(t, tz).strftime(label_format)))
+        t += step
+    return ticks
+
+def format_tick(value):
+    if value == int(value):
+        return f"{value:,.0f}"
+    return f"{value:,.2f}".rstrip("0") if abs(value) >= 100 else f"{value:g}"
+
+# =============================================================================
+# CANVAS
+# =============================================================================
+def load_font(size):
+    for font_file in FONT_FILES:
+        try:
+            return ImageFont.truetype(font_file, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+class ChartCanvas:
+    """
+    A white image with one plot area, drawn SUPERSAMPLE times larger than the output.
+    Coordinates passed in are output pixels; data values are mapped with x_to_px/y_to_px
+    once set_limits() is called.
+    """
+
+    def __init__(self, size, font_size=11, margins=(60, 30, 15, 50)):
+        self.size = size
+        self.scale = SUPERSAMPLE
+        self.image = Image.new("RGB", (size[0] * self.scale, size[1] * self.scale), "white")
+        self.draw = ImageDraw.Draw(self.image)
+        self.font = load_font(font_size * self.scale)
+        self.title_font = load_font(round(font_size * 1.25) * self.scale)
+        left, top, right, bottom = margins
+        self.plot_box = (left, top, size[0] - right, size[1] - bottom)
+        self.x_limits = (0, 1)
+        self.y_limits = (0, 1)
+
+    def set_limits(self, x_limits, y_limits):
+        self.x_limits = x_limits
+        self.y_limits = y_limits
+
+    def x_to_px(self, x):
+        left, _, right, _ = self.plot_box
+        low, high = self.x_limits
+        return left + (x - low) / ((high - low) or 1) * (right - left)
+
+    def y_to_px(self, y):
+        _, top, _, bottom = self.plot_box
+        low, high = self.y_limits
+        return bottom - (y - low) / ((high - low) or 1) * (bottom - top)
+
+    def line(self, points, color, width=1.0, dashed=False):
+        points = [(x * self.scale, y * self.scale) for x, y in points]
+        width = max(1, round(width * self.scale))
+        if not dashed:
+            self.draw.line(points, fill=color, width=width, joint="curve")
+            return
+        dash, gap = 5 * self.scale, 3 * self.scale
+        for (x0, y0), (x1, y1) in zip(points, points[1:]):
+            length = math.hypot(x1 - x0, y1 - y0)
+            position = 0
+            while position < length:
+                end = min(position + dash, length)
+                self.draw.line([(x0 + (x1 - x0) * position / length, y0 + (y1 - y0) * position / length),
+                                (x0 + (x1 - x0) * end / length, y0 + (y1 - y0) * end / length)],
+                               fill=color, width=width)
+                position += dash + gap
+
+    def rectangle(self, box, fill, outline=None):
+        x0, y0, x1, y1 = (v * self.scale for v in box)
+        self.draw.rectangle((min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)), fill=fill, outline=outline,
+                            width=self.scale)
+
+    def dot(self, x, y, radius, color):
+        x, y, r = x * self.scale, y * self.scale, radius * self.scale
+        self.draw.ellipse((x - r, y - r, x + r, y + r), fill=color)
+
+    def text(self, xy, text, anchor="mm", font=None, color="black", rotation=0):
+        font = font or self.font
+        x, y = xy[0] * self.scale, xy[1] * self.scale
+        if not rotation:
+            self.draw.text((x, y), text, fill=color, font=font, anchor=anchor)
+            return
+        # Rotated text: draw it on its own layer, rotate that and paste it with the text as mask
+        left, top, right, bottom = self.draw.textbbox((0, 0), text, font=font, anchor="lt")
+        layer = Image.new("L", (right - left + 2, bottom - top + 2), 0)
+        ImageDraw.Draw(layer).text((1 - left, 1 - top), text, fill=255, font=font, anchor="lt")
+        layer = layer.rotate(rotation, expand=True, resample=Image.BICUBIC)
+        # anchor "rm" for 90 degrees: the end of the text touches (x, y) from below
+        paste_x = round(x - layer.width / 2)
+        paste_y = round(y) if anchor == "rm" else round(y - layer.height / 2)
+        self.image.paste(Image.new("RGB", layer.size, color), (paste_x, paste_y), layer)
+
+    def axes(self, x_ticks, y_ticks, title="", xlabel="", ylabel="", x_tick_rotation=0):
+        """Draws the grid, frame, tick labels, axis labels and title."""
+        left, top, right, bottom = self.plot_box
+        for value in y_ticks:
+            y = self.y_to_px(value)
+            self.line([(left, y), (right, y)], GRID_COLOR, width=0.5, dashed=True)
+            self.text((left - 5, y), format_tick(value), anchor="rm")
+        for value, label in x_ticks:
+            x = self.x_to_px(value)
+            self.line([(x, top), (x, bottom)], GRID_COLOR, width=0.5, dashed=True)
+            self.line([(x, bottom), (x, bottom + 4)], "black")
+            if x_tick_rotation:
+                self.text((x, bottom + 6), label, anchor="rm", rotation=x_tick_rotation)
+            else:
+                self.text((x, bottom + 6), label, anchor="mt")
+        self.rectangle((left, top, right, bottom), fill=None, outline="black")
+
+        if title:
+            self.text(((left + right) / 2, top / 2), title, font=self.title_font)
+        if xlabel:
+            self.text(((left + right) / 2, self.size[1] - 4), xlabel, anchor="md")
+        if ylabel:
+            self.text((10, (top + bottom) / 2), ylabel, rotation=90)
+
+    def legend(self, entries):
+        """Draws (label, color, dashed) entries in the top right corner of the plot area."""
+        _, top, right, _ = self.plot_box
+        width = max(self.draw.textlength(label, font=self.font) for label, _, _ in entries) / self.scale + 40
+        x0, y0 = right - width - 8, top + 8
+        self.rectangle((x0, y0, right - 8, y0 + 18 * len(entries) + 6), fill="white", outline=GRID_COLOR)
+        for i, (label, color, dashed) in enumerate(entries):
+            y = y0 + 12 + 18 * i
+            self.line([(x0 + 6, y), (x0 + 28, y)], color, width=1.5, dashed=dashed)
+            self.text((x0 + 34, y), label, anchor="lm")
+
+    def to_png(self, sink_path=None):
+        """Downsamples the drawing to the output size and encodes it as a palette PNG."""
+        png = palette_png(self.image.resize(self.size, Image.LANCZOS))
+        if sink_path:
+            write_png(sink_path, png)
+        return png
+
+# =============================================================================
+# CHARTS
+# =============================================================================
+def line_chart(series, size, title="", xlabel="", ylabel="", tz=None, x_ticks=None, x_tick_rotation=0,
+               font_size=11, margins=(60, 30, 15, 50), legend=False, sink_path=None):
+    """
+    Renders line series as PNG bytes. Each series is a dict with "x" (epoch timestamps
+    unless x_ticks are given), "y", "color" and optionally "dashed", "markers" and "label".
+    Without x_ticks, round local times in tz are labelled. Like figure_to_png, the bytes
+    are also written to sink_path if given.
+    """
+    start_time = time.time()
+    canvas = ChartCanvas(size, font_size=font_size, margins=margins)
+    xs = [x for s in series for x in s["x"]]
+    ys = [y for s in series for y in s["y"] if y is not None and not math.isnan(y)]
+    if not xs or not ys:
+        return None
+
+    x_low, x_high = min(xs), max(xs)
+    x_margin = (x_high - x_low) * 0.05 or 1
+    y_low, y_high = min(ys), max(ys)
+    y_margin = (y_high - y_low) * 0.05 or 1
+    canvas.set_limits((x_low - x_margin, x_high + x_margin), (y_low - y_margin, y_high + y_margin))
+
+    if x_ticks is None:
+        plot_width = canvas.plot_box[2] - canvas.plot_box[0]
+        x_ticks = time_ticks(x_low, x_high, tz, max_ticks=max(2, int(plot_width / 95)))
+    y_ticks = nice_ticks(y_low - y_margin, y_high + y_margin)
+    y_ticks = [y for y in y_ticks if y_low - y_margin <= y <= y_high + y_margin]
+    canvas.axes(x_ticks, y_ticks, title, xlabel, ylabel, x_tick_rotation)
+
+    for s in series:
+        # NaN or None splits the line, like matplotlib leaves gaps
+        segment = []
+        for x, y in list(zip(s["x"], s["y"])) + [(None, None)]:
+            if y is None or (isinstance(y, float) and math.isnan(y)):
+                if len(segment) > 1:
+                    canvas.line(segment, s["color"], width=1.5, dashed=s.get("dashed", False))
+                segment = []
+            else:
+                segment.append((canvas.x_to_px(x), canvas.y_to_px(y)))
+        if s.get("markers"):
+            for x, y in zip(s["x"], s["y"]):
+                if y is not None:
+                    canvas.dot(canvas.x_to_px(x), canvas.y_to_px(y), 3, s["color"])
+
+    if legend:
+        canvas.legend([(s["label"], s["color"], s.get("dashed", False)) for s in series if s.get("label")])
+
+    png = canvas.to_png(sink_path)
+    logger.debug(f"Drew {size[0]}x{size[1]} line chart: {len(png)} bytes in {time.time() - start_time:.2f}s")
+    return png
+
+def bar_chart(labels, values, colors, size, title="", xlabel="", ylabel="", y_limits=None, reference=None,
+              value_format=None, x_tick_rotation=90, font_size=11, margins=(60, 30, 15, 90), sink_path=None):
+    """
+    Renders one bar per label as PNG bytes. colors is a color per bar. reference is an
+    optional (value, color, legend label) horizontal line. value_format, e.g. "{:.2f}%",
+    prints each value above its bar.
+    """
+    start_time = time.time()
+    canvas = ChartCanvas(size, font_size=font_size, margins=margins)
+    if not values:
+        return None
+
+    if y_limits is None:
+        y_limits = (min(0, min(values)), max(values) * 1.05 or 1)
+    count = len(values)
+    canvas.set_limits((-0.7, count - 0.3), y_limits)
+    canvas.axes([(i, label) for i, label in enumerate(labels)], nice_ticks(*y_limits), title, xlabel, ylabel,
+                x_tick_rotation)
+
+    zero = canvas.y_to_px(0)
+    half_width = (canvas.x_to_px(0.4) - canvas.x_to_px(0))
+    for i, (value, color) in enumerate(zip(values, colors)):
+        x = canvas.x_to_px(i)
+        # Only the drawn bar is clamped to the axes; the label shows the real value
+        top = canvas.y_to_px(min(max(value, y_limits[0]), y_limits[1]))
+        fill = ImageColor.getrgb(color)
+        # Bars are drawn at 70% opacity on white, like alpha=0.7
+        fill = tuple(round(255 - (255 - c) * 0.7) for c in fill)
+        canvas.rectangle((x - half_width, zero, x + half_width, top), fill=fill, outline="black")
+        if value_format:
+            canvas.text((x, top - 3), value_format.format(value), anchor="md")
+
+    left, _, right, _ = canvas.plot_box
+    canvas.line([(left, zero), (right, zero)], "black", width=0.8)
+    if reference:
+        value, color, label = reference
+        y = canvas.y_to_px(value)
+        canvas.line([(left, y), (right, y)], color, width=1, dashed=True)
+        if label:
+            canvas.legend([(label, color, True)])
+
+    png = canvas.to_png(sink_path)
+    logger.debug(f"Drew {size[0]}x{size[1]} bar chart: {len(png)} bytes in {time.time() - start_time:.2f}s")
+    return png
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2025 Emil Norrhage. All rights reserved.
+#
+# This file is part of Hunters Stats Bot.
+#
+# Licensed under the Mozilla Public License 2.0 (MPL-2.0); you may use, modify, and distribute
+# this file freely as long as you comply with the terms of the MPL-2.0.
+# You can obtain a copy of the License at:
+# http://mozilla.org/MPL/2.0/.
+#
+# Author: Emil Norrhage <emil@norrhage.se>
+#
+# I kindly grant permission to anyone to use these files as they wish.
+
+
+
+import math
+
+# =============================================================================
+# ONLINE COMPLETION-RATE ESTIMATOR
+# =============================================================================
+# Shared by the collectors, which keep the state under "estimator" in their completed
+# files. The daily report reads it to project when the next milestone is reached.
+
+def update_completion_estimator(state, ts, value, half_life):
+    """
+    Folds one (timestamp, completed %) sample into a time-decayed estimate of the
+    completion rate (% per second). Each interval is weighted by its length, so the
+    estimate is sum(delta %) / sum(delta t) with older intervals fading out.
+    Also tracks the weighted variance and the effective number of intervals so the
+    report can derive confidence bounds. O(1) per sample; the state is a plain dict
+    that is stored next to the history.
+    """
+    if not state or "last_ts" not in state:
+        return {"last_ts": ts, "last_value": value, "rate": None, "var": 0.0, "w_sum": 0.0, "w_sq_sum": 0.0}
+
+    dt = ts - state["last_ts"]
+    dv = value - state["last_value"]
+    if dt <= 0 or dv < 0:
+        # Completion never decreases. Drop the sample and keep measuring from the last good
+        # one, so a bad reading cannot turn the next interval into a huge jump.
+        return state
+    state["last_ts"] = ts
+    state["last_value"] = value
+
+    rate = dv / dt
+    decay = math.exp(-dt * math.log(2) / half_life)
+    state["w_sum"] = decay * state["w_sum"] + dt
+    state["w_sq_sum"] = decay * decay * state["w_sq_sum"] + dt * dt
+    if state["rate"] is None:
+        state["rate"] = rate
+        state["var"] = 0.0
+    else:
+        alpha = dt / state["w_sum"]
+        diff = rate - state["rate"]
+        state["rate"] += alpha * diff
+        state["var"] = (1 - alpha) * (state["var"] + alpha * diff * diff)
+    return state
+
+
+def replay_completion_history(history, half_life):
+    """
+    Builds the estimator from a retained (timestamp, completed %) history, for the first
+    run with the estimator. Unparsed readings (0 or less) are skipped.
+    """
+    state = None
+    for ts, value in sorted(history, key=lambda x: x[0]):
+        if value > 0:
+            state = update_completion_estimator(state, ts, value, half_life)
+    return state
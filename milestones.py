@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2025 Emil Norrhage. All rights reserved.
+#
+# This file is part of Hunters Stats Bot.
+#
+# Licensed under the Mozilla Public License 2.0 (MPL-2.0); you may use, modify, and distribute
+# this file freely as long as you comply with the terms of the MPL-2.0.
+# You can obtain a copy of the License at:
+# http://mozilla.org/MPL/2.0/.
+#
+# Author: Emil Norrhage <emil@norrhage.se>
+#
+# I kindly grant permission to anyone to use these files as they wish.
+
+# =============================================================================
+# MILESTONES
+# =============================================================================
+# Shared by the daily report (milestone announcements and progress) and the /stats
+# bot (milestone in the summary), so both always use the same tiers.
+
+# Milestone tiers, ordered from highest to lowest threshold
+MILESTONES = [
+    {"level": 1,  "name": "Diamond",   "threshold": 1000000, "emoji": "💎"},
+    {"level": 2,  "name": "Pearl",     "threshold": 500001,  "emoji": "⚪️"},
+    {"level": 3,  "name": "Sapphire",  "threshold": 250001,  "emoji": "🔹"},
+    {"level": 4,  "name": "Ruby",      "threshold": 100001,  "emoji": "♦️"},
+    {"level": 5,  "name": "Emerald",   "threshold": 50001,   "emoji": "🟢"},
+    {"level": 6,  "name": "Platinum",  "threshold": 25001,   "emoji": "🪞"},
+    {"level": 7,  "name": "Gold",      "threshold": 10001,   "emoji": "🥇"},
+    {"level": 8,  "name": "Silver",    "threshold": 5001,    "emoji": "🥈"},
+    {"level": 9,  "name": "Bronze",    "threshold": 1001,    "emoji": "🥉"},
+    {"level": 10, "name": "Copper",    "threshold": 1,       "emoji": "🟤"},
+]
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2025 Emil Norrhage. All rights reserved.
+#
+# This file is part of Hunters Stats Bot.
+#
+# Licensed under the Mozilla Public License 2.0 (MPL-2.0); you may use, modify, and distribute
+# this file freely as long as you comply with the terms of the MPL-2.0.
+# You can obtain a copy of the License at:
+# http://mozilla.org/MPL/2.0/.
+#
+# Author: Emil Norrhage <emil@norrhage.se>
+#
+# I kindly grant permission to anyone to use these files as they wish.
+
+
+
+from datetime import date, datetime, timedelta
+
+# =============================================================================
+# ROLLUP FORMAT
+# =============================================================================
+# Per-day and per-week totals of the ranges history, kept for as long as the rollup file
+# exists (the raw history only keeps 30 days):
+#
+#   {"tick": <tick of the last sample added>,
+#    "users": {user: {"day": {start: bucket}, "week": {start: bucket}}},
+#    "pool":  {"day": {start: bucket}, "week": {start: bucket}}}
+#
+# start is the ISO date of the local day, or of the Monday the week starts on. Every bucket
+# begins with [ranges, speed sum, speed count]: ranges are the sum of each day's last minus
+# first submitted ranges (like the daily charts count them), and only speeds > 1 are summed.
+# User day buckets also keep the day's last submitted ranges as a fourth value.
+#
+# Day buckets are only kept for DAY_BUCKET_DAYS (see prune_days); older days are still
+# counted in their week buckets, so the file grows by a week bucket per user and week.
+PERIODS = ("day", "week")
+DAY_BUCKET_DAYS = 100   # Must cover every window /stats plots per day
+
+
+def new_rollup(tick=None):
+    return {"tick": tick, "users": {}, "pool": {"day": {}, "week": {}}}
+
+
+def sample_starts(ts):
+    """Returns the ISO start dates of the local day and of the week that timestamp ts falls in."""
+    day = datetime.fromtimestamp(ts).date()
+    return day.isoformat(), (day - timedelta(days=day.weekday())).isoformat()
+
+
+def add_sample(rollup, user, ts, submitted_ranges, speed):
+    """
+    Adds one collector sample of a user to the rollups. Samples must arrive in time order
+    per user. Costs a few dict lookups, independent of how much history the rollups hold.
+    """
+    user_rollup = rollup["users"].setdefault(user, {"day": {}, "week": {}})
+    day, week = sample_starts(ts)
+    daily = user_rollup["day"].get(day)
+    if daily is None:
+        daily = user_rollup["day"][day] = [0, 0, 0, submitted_ranges]
+    ranges = submitted_ranges - daily[3]
+    daily[3] = submitted_ranges
+
+    buckets = [
+        daily,
+        user_rollup["week"].setdefault(week, [0, 0, 0]),
+        rollup["pool"]["day"].setdefault(day, [0, 0, 0]),
+        rollup["pool"]["week"].setdefault(week, [0, 0, 0]),
+    ]
+    for bucket in buckets:
+        bucket[0] += ranges
+        if speed > 1:
+            bucket[1] += speed
+            bucket[2] += 1
+
+
+def build_rollup(ranges_history, tick=None):
+    """
+    Builds the rollups from raw ranges history ({user: [(ts, ranges, speed), ...]}), for
+    a first run or when no rollup file exists. Only covers the days the history still holds.
+    """
+    rollup = new_rollup(tick)
+    for user, entries in ranges_history.items():
+        valid = [
+            e for e in entries
+            if len(e) == 3 and isinstance(e[0], (int, float)) and isinstance(e[1], int)
+            and isinstance(e[2], (int, float))
+        ]
+        for ts, submitted_ranges, speed in sorted(valid, key=lambda e: e[0]):
+            add_sample(rollup, user, ts, submitted_ranges, speed)
+    return rollup
+
+
+def prune_days(rollup, today):
+    """
+    Drops day buckets older than DAY_BUCKET_DAYS before today (a date). add_sample counts
+    every sample in a week bucket too, so their totals are kept per week. A user's day
+    buckets are stored in time order, so only the expired ones at the front are visited.
+    """
+    since = (today - timedelta(days=DAY_BUCKET_DAYS)).isoformat()
+    for user_rollup in rollup["users"].values():
+        days = user_rollup["day"]
+        expired = []
+        for day in days:
+            if day >= since:
+                break
+            expired.append(day)
+        for day in expired:
+            del days[day]
+    pool_days = rollup["pool"]["day"]
+    # Built from raw history, the pool's days are in the order users were added
+    for day in [day for day in pool_days if day < since]:
+        del pool_days[day]
+
+
+# =============================================================================
+# READING
+# =============================================================================
+def period_starts(first_day, last_day, period):
+    """ISO start dates of the days or weeks from first_day through last_day (dates), oldest first."""
+    if period == "week":
+        first_day -= timedelta(days=first_day.weekday())
+        step = timedelta(weeks=1)
+    else:
+        step = timedelta(days=1)
+    starts = []
+    while first_day <= last_day:
+        starts.append(first_day.isoformat())
+        first_day += step
+    return starts
+
+
+def first_day(rollup):
+    """
+    The oldest day in the rollups as a date, or None when they are empty. Once old day
+    buckets are pruned, that is the Monday of the oldest week.
+    """
+    weeks = rollup["pool"]["week"]
+    if not weeks:
+        return None
+    oldest_week = date.fromisoformat(min(weeks))
+    days = rollup["pool"]["day"]
+    if days and date.fromisoformat(min(days)) - oldest_week < timedelta(weeks=1):
+        return date.fromisoformat(min(days))
+    return oldest_week
+
+
+def series(buckets, starts):
+    """Returns (ranges per start, average speed per start) for buckets of one user or the pool."""
+    ranges, speeds = [], []
+    for start in starts:
+        bucket = buckets.get(start)
+        ranges.append(bucket[0] if bucket else 0)
+        speeds.append(bucket[1] / bucket[2] if bucket and bucket[2] else 0)
+    return ranges, speeds
+
+
+def active_users(rollup, since):
+    """
+    Number of users with speed samples on or after the ISO date since. Buckets are stored
+    in time order, so only each user's recent end is read. Weeks are checked too, for
+    dates before the kept day buckets (since is a Monday for weekly charts).
+    """
+    return sum(
+        1 for user_rollup in rollup["users"].values()
+        if has_speed_since(user_rollup["day"], since) or has_speed_since(user_rollup["week"], since)
+    )
+
+
+def has_speed_since(buckets, since):
+    for start in reversed(buckets):
+        if start < since:
+            return False
+        if buckets[start][2]:
+            return True
+    return False
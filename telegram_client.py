@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2025 Emil Norrhage. All rights reserved.
+#
+# This file is part of Hunters Stats Bot.
+#
+# Licensed under the Mozilla Public License 2.0 (MPL-2.0); you may use, modify, and distribute
+# this file freely as long as you comply with the terms of the MPL-2.0.
+# You can obtain a copy of the License at:
+# http://mozilla.org/MPL/2.0/.
+#
+# Author: Emil Norrhage <emil@norrhage.se>
+#
+# I kindly grant permission to anyone to use these files as they wish.
+
+
+
+import os
+import json
+import time
+import hashlib
+import contextlib
+import logging
+import threading
+from collections import OrderedDict
+import requests
+from requests.adapters import HTTPAdapter
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+TELEGRAM_API_BASE = "https://api.telegram.org"
+DEFAULT_TIMEOUT = 30            # Seconds per HTTP request
+DEFAULT_MAX_RETRIES = 4         # Retries after the first attempt
+DEFAULT_BACKOFF = 1.0           # First retry delay in seconds, doubled on every retry
+MAX_BACKOFF = 30.0              # Upper bound for the exponential backoff
+MAX_RETRY_AFTER = 120           # Give up instead of waiting longer than this on a 429
+DEFAULT_CHAT_INTERVAL = 1.0     # Minimum seconds between messages to the same chat
+MAX_ALBUM_SIZE = 10             # Telegram accepts 2-10 photos per sendMediaGroup
+DEFAULT_FILE_ID_CACHE_SIZE = 500  # Uploaded images remembered by content hash
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# ERRORS
+# =============================================================================
+class TelegramError(Exception):
+    """Raised when a Bot API call fails after all retries, or is rejected outright."""
+
+    def __init__(self, description, error_code=None, retry_after=None):
+        super().__init__(f"{error_code}: {description}" if error_code else description)
+        self.description = description
+        self.error_code = error_code
+        self.retry_after = retry_after
+
+# =============================================================================
+# FILE ID CACHE
+# =============================================================================
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+class FileIdCache:
+    """
+    Persistent map from an image's SHA-256 to the file_id Telegram returned for it,
+    so identical images can be sent again by reference instead of being re-uploaded.
+    Entries are kept in LRU order and trimmed to max_entries. Saving merges with what
+    is on disk, so several processes can share one cache file.
+    """
+
+    def __init__(self, path, max_entries=DEFAULT_FILE_ID_CACHE_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = self._load()
+        self._discarded = set()   # Digests to delete from the file on the next save
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                return OrderedDict((digest, file_id) for digest, file_id in json.load(f))
+        except FileNotFoundError:
+            return OrderedDict()
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable file_id cache {self.path}: {e}")
+            return OrderedDict()
+
+    def get(self, digest):
+        with self._lock:
+            file_id = self._entries.get(digest)
+            if file_id is not None:
+                self._entries.move_to_end(digest)
+            return file_id
+
+    def put(self, digest, file_id):
+        with self._lock:
+            self._entries[digest] = file_id
+            self._entries.move_to_end(digest)
+            self._discarded.discard(digest)
+            self._save_locked()
+
+    def discard(self, digest):
+        with self._lock:
+            self._entries.pop(digest, None)
+            self._discarded.add(digest)
+            self._save_locked()
+
+    def _save_locked(self):
+        merged = self._load()
+        for digest in list(merged):
+            if digest in self._entries or digest in self._discarded:
+                del merged[digest]
+        merged.update(self._entries)
+        while len(merged) > self.max_entries:
+            merged.popitem(last=False)
+        self._entries = merged
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(list(merged.items()), f)
+            os.replace(tmp_path, self.path)
+            self._discarded.clear()
+        except OSError as e:
+            logger.warning(f"Failed to save file_id cache {self.path}: {e}")
+
+def largest_photo_file_id(message):
+    """Returns the file_id of the largest size Telegram stored for a sent photo."""
+    sizes = (message or {}).get("photo") or []
+    return sizes[-1]["file_id"] if sizes else None
+
+# =============================================================================
+# CLIENT
+# =============================================================================
+class TelegramClient:
+    """
+    Small Bot API client shared by the Telegram scripts.
+    - One keep-alive requests.Session, so a report reuses its TLS connection.
+    - Retries network errors (any requests exception) and 5xx with exponential backoff, and 429s
+      after the retry_after that Telegram asks for. Other 4xx errors are not retried.
+    - Spaces out messages to the same chat by chat_interval seconds to stay below
+      Telegram's per-chat limits. Safe to use from several threads.
+    - With a FileIdCache, photos that were uploaded before are sent by file_id, and an
+      image being sent to several chats at once is uploaded only once.
+    """
+
+    def __init__(self, token, api_base=TELEGRAM_API_BASE, timeout=DEFAULT_TIMEOUT,
+                 max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF,
+                 chat_interval=DEFAULT_CHAT_INTERVAL, file_id_cache=None):
+        self.token = token
+        self.file_id_cache = file_id_cache
+        self.api_base = api_base.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.chat_interval = chat_interval
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=16)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._chat_lock = threading.Lock()
+        self._chat_next_send = {}
+        self._uploads_lock = threading.Lock()
+        self._uploads = {}
+
+    def call(self, method, params=None, files=None, timeout=None, chat_id=None):
+        """
+        Calls a Bot API method and returns its "result".
+        Pass chat_id for methods that post to a chat so they are rate limited per chat.
+        Raises TelegramError once the retry budget is spent.
+        """
+        url = f"{self.api_base}/bot{self.token}/{method}"
+        timeout = timeout or self.timeout
+        delay = self.backoff
+        for attempt in range(self.max_retries + 1):
+            if chat_id is not None:
+                self._wait_for_chat(chat_id)
+
+            try:
+                response = self.session.post(url, data=params, files=files, timeout=timeout)
+            except requests.RequestException as e:
+                # Connection errors and timeouts, but also a response cut off mid-body
+                # (ChunkedEncodingError, ContentDecodingError): all worth another attempt
+                error = TelegramError(str(e))
+                wait = delay
+            else:
+                try:
+                    body = response.json()
+                except ValueError:
+                    body = {"ok": False, "error_code": response.status_code, "description": response.text[:200]}
+                if body.get("ok"):
+                    return body.get("result")
+
+                retry_after = (body.get("parameters") or {}).get("retry_after")
+                error = TelegramError(body.get("description", "Unknown error"),
+                                      body.get("error_code", response.status_code), retry_after)
+                if response.status_code == 429 and retry_after is not None:
+                    if retry_after > MAX_RETRY_AFTER:
+                        raise error
+                    wait = retry_after
+                    if chat_id is not None:
+                        self._delay_chat(chat_id, retry_after)
+                elif response.status_code >= 500:
+                    wait = delay
+                else:
+                    raise error
+
+            if attempt == self.max_retries:
+                raise error
+            logger.warning(f"Telegram {method} failed ({error}), retrying in {wait:.1f}s "
+                           f"(attempt {attempt + 1}/{self.max_retries})")
+            time.sleep(wait)
+            delay = min(delay * 2, MAX_BACKOFF)
+
+    def get_updates(self, offset=None, timeout=30):
+        """Long-polls for new updates. The HTTP timeout leaves headroom over the poll timeout."""
+        params = {"timeout": timeout}
+        if offset is not None:
+            params["offset"] = offset
+        return self.call("getUpdates", params, timeout=timeout + 10) or []
+
+    def set_webhook(self, url, secret_token=None, allowed_updates=None, max_connections=None):
+        """
+        Makes Telegram POST updates to url instead of queueing them for getUpdates.
+        Telegram sends secret_token in the X-Telegram-Bot-Api-Secret-Token header.
+        """
+        params = {"url": url}
+        if secret_token:
+            params["secret_token"] = secret_token
+        if allowed_updates is not None:
+            params["allowed_updates"] = json.dumps(allowed_updates)
+        if max_connections:
+            params["max_connections"] = max_connections
+        return self.call("setWebhook", params)
+
+    def delete_webhook(self):
+        return self.call("deleteWebhook")
+
+    def send_message(self, chat_id, text, thread_id=None, parse_mode=None):
+        params = {"chat_id": chat_id, "text": text}
+        if thread_id is not None:
+            params["message_thread_id"] = thread_id
+        if parse_mode:
+            params["parse_mode"] = parse_mode
+        return self.call("sendMessage", params, chat_id=chat_id)
+
+    def send_photo(self, chat_id, png, caption="", thread_id=None, parse_mode=None, filename="chart.png"):
+        """
+        Sends PNG bytes as a photo. If the same bytes were uploaded before, the cached
+        file_id is sent instead; a rejected file_id falls back to a normal upload.
+        """
+        params = {"chat_id": chat_id, "caption": caption}
+        if thread_id is not None:
+            params["message_thread_id"] = thread_id
+        if parse_mode:
+            params["parse_mode"] = parse_mode
+
+        if not self.file_id_cache:
+            return self._upload_photo(chat_id, params, png, filename, None)
+        digest = content_hash(png)
+        result = self._send_cached_photo(chat_id, params, digest)
+        if result is None:
+            with self._single_flight([digest]):
+                # Another thread may have uploaded the same image while we waited
+                result = self._send_cached_photo(chat_id, params, digest)
+                if result is None:
+                    result = self._upload_photo(chat_id, params, png, filename, digest)
+        return result
+
+    def _send_cached_photo(self, chat_id, params, digest):
+        """Sends the photo by its cached file_id. Returns None if there is none or it was rejected."""
+        file_id = self.file_id_cache.get(digest)
+        if not file_id:
+            return None
+        try:
+            return self.call("sendPhoto", dict(params, photo=file_id), chat_id=chat_id)
+        except TelegramError as e:
+            if e.error_code != 400:
+                raise
+            logger.warning(f"Cached file_id was rejected ({e}), uploading again")
+            self.file_id_cache.discard(digest)
+            return None
+
+    def _upload_photo(self, chat_id, params, png, filename, digest):
+        files = {"photo": (filename, png, "image/png")}
+        result = self.call("sendPhoto", params, files=files, chat_id=chat_id)
+        uploaded_id = largest_photo_file_id(result)
+        if digest and uploaded_id:
+            self.file_id_cache.put(digest, uploaded_id)
+        return result
+
+    def send_media_group(self, chat_id, photos, thread_id=None, parse_mode=None):
+        """
+        Sends 2-10 (png, caption) pairs as one album. All photos are uploaded in a single
+        multipart request and Telegram keeps them in the given order. Photos with a cached
+        file_id are sent by reference instead.
+        """
+        if not self.file_id_cache:
+            return self._send_media_group(chat_id, photos, [None] * len(photos), [None] * len(photos),
+                                          thread_id, parse_mode)
+        digests = [content_hash(png) for png, _ in photos]
+        result = self._send_cached_media_group(chat_id, photos, digests, thread_id, parse_mode, require_all=True)
+        if result is None:
+            with self._single_flight(digests):
+                result = self._send_cached_media_group(chat_id, photos, digests, thread_id, parse_mode)
+                if result is None:
+                    result = self._send_media_group(chat_id, photos, [None] * len(photos), digests,
+                                                    thread_id, parse_mode)
+        return result
+
+    def _send_cached_media_group(self, chat_id, photos, digests, thread_id, parse_mode, require_all=False):
+        """
+        Sends the album using every cached file_id and uploading the rest. Returns None if
+        no file_id is cached (or not all of them, with require_all) or one was rejected.
+        """
+        file_ids = [self.file_id_cache.get(d) for d in digests]
+        if not any(file_ids) or (require_all and not all(file_ids)):
+            return None
+        try:
+            return self._send_media_group(chat_id, photos, file_ids, digests, thread_id, parse_mode)
+        except TelegramError as e:
+            if e.error_code != 400:
+                raise
+            logger.warning(f"Cached file_id in album was rejected ({e}), uploading again")
+            for digest, file_id in zip(digests, file_ids):
+                if file_id:
+                    self.file_id_cache.discard(digest)
+            return None
+
+    def _send_media_group(self, chat_id, photos, file_ids, digests, thread_id, parse_mode):
+        media = []
+        files = {}
+        for i, ((png, caption), file_id) in enumerate(zip(photos, file_ids)):
+            if file_id:
+                entry = {"type": "photo", "media": file_id}
+            else:
+                name = f"photo{i}"
+                entry = {"type": "photo", "media": f"attach://{name}"}
+                files[name] = (f"{name}.png", png, "image/png")
+            if caption:
+                entry["caption"] = caption
+                if parse_mode:
+                    entry["parse_mode"] = parse_mode
+            media.append(entry)
+        params = {"chat_id": chat_id, "media": json.dumps(media)}
+        if thread_id is not None:
+            params["message_thread_id"] = thread_id
+        result = self.call("sendMediaGroup", params, files=files or None, chat_id=chat_id)
+
+        if self.file_id_cache:
+            for digest, file_id, message in zip(digests, file_ids, result or []):
+                uploaded_id = largest_photo_file_id(message)
+                if not file_id and uploaded_id:
+                    self.file_id_cache.put(digest, uploaded_id)
+        return result
+
+    @contextlib.contextmanager
+    def _single_flight(self, digests):
+        """
+        Lets one thread at a time upload a given image. Threads sending the same bytes to
+        other chats wait here until that upload is done, then reuse its file_id. Digests
+        are claimed in sorted order, so threads claiming overlapping albums cannot deadlock.
+        """
+        claimed = []
+        try:
+            for digest in sorted(set(digests)):
+                while True:
+                    with self._uploads_lock:
+                        done = self._uploads.get(digest)
+                        if done is None:
+                            self._uploads[digest] = threading.Event()
+                            claimed.append(digest)
+                            break
+                    done.wait()
+            yield
+        finally:
+            with self._uploads_lock:
+                for digest in claimed:
+                    self._uploads.pop(digest).set()
+
+    # -------------------------------------------------------------------------
+    # Per-chat rate limiting
+    # -------------------------------------------------------------------------
+    def _wait_for_chat(self, chat_id):
+        """Reserves the next send slot for chat_id and sleeps until it is due."""
+        key = str(chat_id)
+        with self._chat_lock:
+            now = time.monotonic()
+            slot = max(now, self._chat_next_send.get(key, 0))
+            self._chat_next_send[key] = slot + self.chat_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def _delay_chat(self, chat_id, seconds):
+        """Pushes back every pending send to chat_id after Telegram asked us to slow down."""
+        key = str(chat_id)
+        with self._chat_lock:
+            self._chat_next_send[key] = max(self._chat_next_send.get(key, 0), time.monotonic() + seconds)
+
+# =============================================================================
+# REPORT ITEMS
+# =============================================================================
+# A report is a list of items, each a dict:
+#   {"type": "text",  "text": str}
+#   {"type": "photo", "png": payload, "caption": str}
+#   {"type": "album", "photos": [(payload, caption), ...]}
+# A payload is PNG bytes, None (skipped), or a concurrent.futures.Future that resolves
+# to either, e.g. a chart that is still rendering in a process pool. telegram_outbox
+# stores the items and sends them with send_item once their payloads are resolved.
+
+def send_item(client, chat_id, item, thread_id=None, parse_mode=None):
+    """
+    Sends one item whose payloads are already PNG bytes (or None, skipped).
+    Albums larger than MAX_ALBUM_SIZE are split, and a lone photo is sent with sendPhoto.
+    """
+    if item["type"] == "text":
+        client.send_message(chat_id, item["text"], thread_id=thread_id, parse_mode=parse_mode)
+    elif item["type"] == "photo":
+        if item["png"]:
+            client.send_photo(chat_id, item["png"], caption=item.get("caption", ""),
+                              thread_id=thread_id, parse_mode=parse_mode)
+    elif item["type"] == "album":
+        photos = [(png, caption) for png, caption in item["photos"] if png]
+        for start in range(0, len(photos), MAX_ALBUM_SIZE):
+            chunk = photos[start:start + MAX_ALBUM_SIZE]
+            if len(chunk) == 1:
+                client.send_photo(chat_id, chunk[0][0], caption=chunk[0][1],
+                                  thread_id=thread_id, parse_mode=parse_mode)
+            else:
+                client.send_media_group(chat_id, chunk, thread_id=thread_id, parse_mode=parse_mode)
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2025 Emil Norrhage. All rights reserved.
+#
+# This file is part of Hunters Stats Bot.
+#
+# Licensed under the Mozilla Public License 2.0 (MPL-2.0); you may use, modify, and distribute
+# this file freely as long as you comply with the terms of the MPL-2.0.
+# You can obtain a copy of the License at:
+# http://mozilla.org/MPL/2.0/.
+#
+# Author: Emil Norrhage <emil@norrhage.se>
+#
+# I kindly grant permission to anyone to use these files as they wish.
+
+
+
+import json
+import time
+import fcntl
+import sqlite3
+import asyncio
+import logging
+import threading
+import functools
+import contextlib
+import concurrent.futures
+from telegram_client import MAX_ALBUM_SIZE, TelegramError, content_hash, send_item
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+DEFAULT_MAX_CONCURRENCY = 4         # Chats sent to at the same time
+DEFAULT_MAX_WAIT = 600              # Seconds drain() keeps retrying before leaving items for a later run
+DEFAULT_MAX_ATTEMPTS = 10           # Send attempts before an item is marked failed
+RETRY_BACKOFF = 5.0                 # First retry delay in seconds, doubled per attempt
+MAX_RETRY_BACKOFF = 600
+KEEP_DONE_SECONDS = 7 * 86400       # Sent and failed items are pruned after this long
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    chat_id TEXT NOT NULL,
+    thread_id TEXT,
+    parse_mode TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    done_at REAL
+);
+CREATE INDEX IF NOT EXISTS items_pending ON items (status, chat_id, thread_id, id);
+CREATE TABLE IF NOT EXISTS photos (
+    digest TEXT PRIMARY KEY,
+    png BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS item_photos (
+    item_id INTEGER NOT NULL,
+    digest TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS item_photos_item ON item_photos (item_id);
+"""
+
+# =============================================================================
+# OUTBOX
+# =============================================================================
+class Outbox:
+    """
+    Durable queue of outgoing Telegram items in a SQLite database.
+
+    Items use the report item dicts described in telegram_client. Each one is stored
+    under an idempotency key, so enqueuing the same report again after a crash does not
+    post it twice. Photos are stored once per content hash and shared between chats.
+    drain() delivers the items for every chat in enqueue order and keeps unsent ones for
+    the next run. Delivery is at-least-once: an item whose send succeeded just before
+    the process died is sent again.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    # -------------------------------------------------------------------------
+    # Producer side
+    # -------------------------------------------------------------------------
+    def enqueue(self, key, chat_id, thread_id, item, parse_mode=None):
+        """
+        Stores one item whose payloads are PNG bytes. Returns False if an item with
+        this idempotency key was already enqueued.
+        """
+        payload, photos = self._encode_item(item)
+        with self._changed:
+            with self._transaction():
+                cur = self._conn.execute(
+                    "INSERT OR IGNORE INTO items (idempotency_key, chat_id, thread_id, parse_mode, payload, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, str(chat_id), None if thread_id is None else str(thread_id), parse_mode,
+                     json.dumps(payload), time.time()))
+                if cur.rowcount == 0:
+                    return False
+                for digest, png in photos:
+                    self._conn.execute("INSERT OR IGNORE INTO photos (digest, png) VALUES (?, ?)", (digest, png))
+                    self._conn.execute("INSERT INTO item_photos (item_id, digest) VALUES (?, ?)", (cur.lastrowid, digest))
+            self._changed.notify_all()
+        return True
+
+    def enqueue_items(self, batch_id, targets, items, parse_mode=None, on_error=None):
+        """
+        Enqueues items for every (chat_id, thread_id) in targets, in order. Payloads that
+        are still rendering (futures) are waited for one by one, so earlier items can be
+        delivered by a running drain() in the meantime. Albums are stored in chunks of at
+        most MAX_ALBUM_SIZE. Idempotency keys are built from batch_id and each item's "key"
+        (its position in items if it has none), so enqueuing a batch again only adds the
+        items that are new, even when other items failed to render in either run.
+        """
+        for position, item in enumerate(items):
+            item_key = item.get("key", position)
+            def report(e, item=item):
+                if on_error:
+                    on_error(item, e)
+                else:
+                    logger.warning(f"Failed to prepare {item['type']} for the outbox: {e}")
+            parts = self._split_item(_resolve_item(item, report))
+            for part_index, part in enumerate(parts):
+                for chat_id, thread_id in targets:
+                    self.enqueue(f"{batch_id}/{chat_id}/{thread_id}/{item_key}/{part_index}",
+                                 chat_id, thread_id, part, parse_mode)
+
+    # -------------------------------------------------------------------------
+    # Delivery
+    # -------------------------------------------------------------------------
+    def drain(self, client, targets=None, closed=None, max_wait=DEFAULT_MAX_WAIT,
+              max_concurrency=DEFAULT_MAX_CONCURRENCY, on_error=None):
+        """
+        Sends pending items until none are left, each chat in order and up to
+        max_concurrency chats at a time. Chats with pending items from earlier runs are
+        included automatically. If closed (a threading.Event) is given, drain also waits
+        for items that are still being enqueued until it is set. Failed sends are retried
+        with backoff; whatever is still pending after max_wait seconds stays in the outbox.
+        Only one process drains an outbox at a time, so no item is sent twice; if another
+        one is draining already, this returns right away and leaves the items to it.
+        """
+        with self._drain_lock() as locked:
+            if not locked:
+                logger.info(f"Another process is draining {self.db_path}, leaving the items to it")
+                return
+            self._drain(client, targets, closed, max_wait, max_concurrency, on_error)
+
+    def _drain(self, client, targets, closed, max_wait, max_concurrency, on_error):
+        deadline = time.monotonic() + max_wait
+        targets = list(dict.fromkeys(
+            [(str(c), None if t is None else str(t)) for c, t in (targets or [])] + self._pending_targets()))
+        if not targets:
+            return
+
+        async def drain_all():
+            semaphore = asyncio.Semaphore(max_concurrency)
+            await asyncio.gather(*(
+                self._drain_chat(client, chat_id, thread_id, closed, deadline, semaphore, on_error)
+                for chat_id, thread_id in targets
+            ))
+        asyncio.run(drain_all())
+
+    async def _drain_chat(self, client, chat_id, thread_id, closed, deadline, semaphore, on_error):
+        loop = asyncio.get_running_loop()
+
+        def run(func, *args, **kwargs):
+            return loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+        while time.monotonic() < deadline:
+            row = await run(self._next_pending, chat_id, thread_id)
+            if row is None:
+                if closed is None or closed.is_set():
+                    return
+                await run(self._wait_for_items, min(1.0, deadline - time.monotonic()))
+                continue
+
+            item_id, parse_mode, payload, attempts, next_attempt_at = row
+            delay = next_attempt_at - time.time()
+            if delay > 0:
+                if time.monotonic() + delay > deadline:
+                    break
+                await asyncio.sleep(delay)
+                continue
+
+            async with semaphore:
+                try:
+                    item = await run(self._decode_item, item_id, payload)
+                    await run(send_item, client, chat_id, item, thread_id=thread_id, parse_mode=parse_mode)
+                except TelegramError as e:
+                    # Bad requests will not succeed on a retry (rate limits were already retried by the client)
+                    permanent = e.error_code is not None and 400 <= e.error_code < 500 and e.error_code != 429
+                    self._record_failure(item_id, attempts, e, permanent, on_error)
+                except Exception as e:
+                    self._record_failure(item_id, attempts, e, False, on_error)
+                else:
+                    self._mark_done(item_id, "sent")
+
+        remaining = await run(self._count_pending, chat_id, thread_id)
+        if remaining:
+            logger.warning(f"{remaining} outbox item(s) for {chat_id} left for a later run")
+
+    def wake(self):
+        """Wakes drain() loops waiting for items, e.g. after setting their closed event."""
+        with self._changed:
+            self._changed.notify_all()
+
+    def prune(self, keep_seconds=KEEP_DONE_SECONDS):
+        """Deletes sent and failed items older than keep_seconds and photos nothing refers to."""
+        cutoff = time.time() - keep_seconds
+        with self._lock, self._transaction():
+            self._conn.execute(
+                "DELETE FROM item_photos WHERE item_id IN "
+                "(SELECT id FROM items WHERE status != 'pending' AND done_at < ?)", (cutoff,))
+            self._conn.execute("DELETE FROM items WHERE status != 'pending' AND done_at < ?", (cutoff,))
+            self._conn.execute("DELETE FROM photos WHERE digest NOT IN (SELECT digest FROM item_photos)")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # -------------------------------------------------------------------------
+    # Storage helpers
+    # -------------------------------------------------------------------------
+    @contextlib.contextmanager
+    def _drain_lock(self):
+        # An advisory lock next to the database, released when the process exits
+        with open(f"{self.db_path}.lock", "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # The connection is in autocommit mode (isolation_level=None), where "with conn"
+        # commits nothing extra, so statements that belong together need an explicit
+        # transaction. Called with the lock held.
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    @staticmethod
+    def _split_item(item):
+        """Drops missing photos and splits albums into chunks Telegram accepts."""
+        if item["type"] == "photo":
+            return [item] if item["png"] else []
+        if item["type"] == "album":
+            photos = [(png, caption) for png, caption in item["photos"] if png]
+            chunks = [photos[i:i + MAX_ALBUM_SIZE] for i in range(0, len(photos), MAX_ALBUM_SIZE)]
+            return [{"type": "album", "photos": chunk} if len(chunk) > 1
+                    else {"type": "photo", "png": chunk[0][0], "caption": chunk[0][1]}
+                    for chunk in chunks]
+        return [item]
+
+    @staticmethod
+    def _encode_item(item):
+        if item["type"] == "photo":
+            digest = content_hash(item["png"])
+            return {"type": "photo", "digest": digest, "caption": item.get("caption", "")}, [(digest, item["png"])]
+        if item["type"] == "album":
+            photos = [(content_hash(png), png, caption) for png, caption in item["photos"]]
+            payload = {"type": "album", "photos": [[digest, caption] for digest, _, caption in photos]}
+            return payload, [(digest, png) for digest, png, _ in photos]
+        return {"type": "text", "text": item["text"]}, []
+
+    def _decode_item(self, item_id, payload):
+        item = json.loads(payload)
+        if item["type"] == "photo":
+            item["png"] = self._photo(item.pop("digest"))
+        elif item["type"] == "album":
+            item["photos"] = [(self._photo(digest), caption) for digest, caption in item["photos"]]
+        return item
+
+    def _photo(self, digest):
+        with self._lock:
+            row = self._conn.execute("SELECT png FROM photos WHERE digest = ?", (digest,)).fetchone()
+        if row is None:
+            raise LookupError(f"Photo {digest[:12]} is missing from the outbox")
+        return row[0]
+
+    def _pending_targets(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT DISTINCT chat_id, thread_id FROM items WHERE status = 'pending'").fetchall()
+
+    def _next_pending(self, chat_id, thread_id):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, parse_mode, payload, attempts, next_attempt_at FROM items "
+                "WHERE status = 'pending' AND chat_id = ? AND thread_id IS ? ORDER BY id LIMIT 1",
+                (chat_id, thread_id)).fetchone()
+
+    def _count_pending(self, chat_id, thread_id):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM items WHERE status = 'pending' AND chat_id = ? AND thread_id IS ?",
+                (chat_id, thread_id)).fetchone()[0]
+
+    def _wait_for_items(self, timeout):
+        with self._changed:
+            self._changed.wait(max(timeout, 0))
+
+    def _mark_done(self, item_id, status, error=None):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE items SET status = ?, last_error = ?, done_at = ? WHERE id = ?",
+                               (status, error, time.time(), item_id))
+
+    def _record_failure(self, item_id, attempts, error, permanent, on_error):
+        attempts += 1
+        if permanent or attempts >= DEFAULT_MAX_ATTEMPTS:
+            logger.warning(f"Giving up on outbox item {item_id} after {attempts} attempt(s): {error}")
+            self._mark_done(item_id, "failed", str(error))
+            if on_error:
+                on_error({"type": "outbox", "id": item_id}, error)
+            return
+        delay = min(RETRY_BACKOFF * (2 ** (attempts - 1)), MAX_RETRY_BACKOFF)
+        logger.warning(f"Outbox item {item_id} failed ({error}), retrying in {delay:.0f}s")
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE items SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                               (attempts, time.time() + delay, str(error), item_id))
+
+def _resolve_item(item, on_error):
+    """
+    Blocks until every payload of item is available and returns a copy holding the bytes.
+    Each payload is resolved on its own: one that failed to render becomes None and is
+    reported with on_error(exception), so the rest of an album is still sent.
+    """
+    def resolve(payload):
+        if not isinstance(payload, concurrent.futures.Future):
+            return payload
+        try:
+            return payload.result()
+        except Exception as e:
+            on_error(e)
+            return None
+
+    if item["type"] == "photo":
+        return dict(item, png=resolve(item["png"]))
+    if item["type"] == "album":
+        return dict(item, photos=[(resolve(payload), caption) for payload, caption in item["photos"]])
+    return item
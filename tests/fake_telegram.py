@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2025 Emil Norrhage. All rights reserved.
+#
+# This file is part of Hunters Stats Bot.
+#
+# Licensed under the Mozilla Public License 2.0 (MPL-2.0); you may use, modify, and distribute
+# this file freely as long as you comply with the terms of the MPL-2.0.
+# You can obtain a copy of the License at:
+# http://mozilla.org/MPL/2.0/.
+#
+# Author: Emil Norrhage <emil@norrhage.se>
+#
+# I kindly grant permission to anyone to use these files as they wish.
+
+# Minimal stand-in for the Telegram Bot API on localhost, for end-to-end checks of the
+# bots. Every call is recorded and answered with a plausible result; getUpdates hands
+# out FakeTelegram.updates. Point TelegramClient(api_base=...) at FakeTelegram.url.
+
+import json
+import threading
+import email.parser
+import email.policy
+from urllib.parse import parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class FakeTelegram:
+    def __init__(self):
+        self.calls = []       # (method, fields) in arrival order; uploaded files show up as their size
+        self.updates = []
+        self._lock = threading.Lock()
+        self._file_seq = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def methods(self, method):
+        """The fields of every recorded call of method."""
+        with self._lock:
+            return [fields for name, fields in self.calls if name == method]
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                method = self.path.rsplit("/", 1)[-1]
+                fields = parse_fields(self.headers.get("Content-Type", ""),
+                                      self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+                with fake._lock:
+                    fake.calls.append((method, fields))
+                    fake._file_seq += 1
+                    file_id = f"FILE{fake._file_seq}"
+
+                if method == "getUpdates":
+                    offset = int(fields.get("offset") or 0)
+                    result = [u for u in fake.updates if u["update_id"] >= offset]
+                elif method == "sendPhoto":
+                    result = {"message_id": len(fake.calls), "photo": [{"file_id": file_id, "width": 1280}]}
+                elif method in ("setWebhook", "deleteWebhook"):
+                    result = True
+                else:
+                    result = {"message_id": len(fake.calls)}
+                body = json.dumps({"ok": True, "result": result}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+def parse_fields(content_type, body):
+    """Decodes a JSON, form or multipart request body into a dict."""
+    if content_type.startswith("application/json"):
+        return json.loads(body or b"{}")
+    if content_type.startswith("multipart/form-data"):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+        fields = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            payload = part.get_payload(decode=True)
+            fields[name] = len(payload) if part.get_filename() else payload.decode()
+        return fields
+    return {k: v[0] for k, v in parse_qs(body.decode()).items()}
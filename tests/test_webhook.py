@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2025 Emil Norrhage. All rights reserved.
+#
+# This file is part of Hunters Stats Bot.
+#
+# Licensed under the Mozilla Public License 2.0 (MPL-2.0); you may use, modify, and distribute
+# this file freely as long as you comply with the terms of the MPL-2.0.
+# You can obtain a copy of the License at:
+# http://mozilla.org/MPL/2.0/.
+#
+# Author: Emil Norrhage <emil@norrhage.se>
+#
+# I kindly grant permission to anyone to use these files as they wish.
+
+# End-to-end check of the /stats bot's webhook mode against a local fake Telegram:
+# registration, secret checking, dropping redelivered update_ids and the reply path.
+#
+#   python -m unittest discover tests      (or: python -m pytest tests)
+
+import os
+import sys
+import json
+import time
+import types
+import socket
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import FakeTelegram
+from telegram_client import TelegramClient
+
+SECRET = "test-secret"
+OFFICIAL_CHAT_ID = "-1001"
+OFFICIAL_THREAD_ID = "7"
+USER = "BigHunter"
+
+
+def load_bot(storage_path):
+    """Imports Telegram-push-stats_daily.py with its storage under storage_path."""
+    path = os.path.join(ROOT, "Telegram-push-stats_daily.py")
+    with open(path) as f:
+        source = f.read().replace('"REPLACE_WITH_STORAGE_PATH"', repr(storage_path))
+    module = types.ModuleType("stats_bot")
+    module.__file__ = path
+    exec(compile(source, path, "exec"), module.__dict__)
+    return module
+
+
+def write_history(storage_path, days=3):
+    """A few days of hourly collector samples for USER and one other user."""
+    now = time.time()
+    data = {USER: [], "OtherUser": []}
+    for hour in range(days * 24, -1, -1):
+        ts = now - hour * 3600
+        data[USER].append([ts, 100000 + (days * 24 - hour) * 40, 55.0])
+        data["OtherUser"].append([ts, 5000 + (days * 24 - hour) * 3, 4.5])
+    with open(os.path.join(storage_path, "ranges_history.json"), "w") as f:
+        json.dump({"data": data, "tick": 1}, f)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class WebhookEndToEndTest(unittest.TestCase):
+    def setUp(self):
+        self.storage = tempfile.TemporaryDirectory()
+        write_history(self.storage.name)
+        self.telegram = FakeTelegram()
+
+        bot = self.bot = load_bot(self.storage.name)
+        bot.TELEGRAM = TelegramClient(bot.BOT_TOKEN, api_base=self.telegram.url, chat_interval=0, backoff=0.1)
+        bot.OFFICIAL_CHAT_ID = OFFICIAL_CHAT_ID
+        bot.OFFICIAL_THREAD_ID = OFFICIAL_THREAD_ID
+        bot.WEBHOOK_URL = "https://bot.example.invalid/telegram-webhook"
+        bot.WEBHOOK_SECRET = SECRET
+        bot.WEBHOOK_PORT = free_port()
+        bot.RENDER_WORKERS = 1
+        bot.WARM_TOP_USERS = 0
+
+    def tearDown(self):
+        self.telegram.close()
+        self.storage.cleanup()
+
+    def post(self, update, secret=SECRET, path=None):
+        """POSTs an update to the bot's webhook server and returns the HTTP status."""
+        url = f"http://{self.bot.WEBHOOK_HOST}:{self.bot.WEBHOOK_PORT}{path or self.bot.WEBHOOK_PATH}"
+        body = update if isinstance(update, bytes) else json.dumps(update).encode()
+        request = urllib.request.Request(url, data=body, headers={
+            "Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": secret})
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def wait_for(self, condition, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if condition():
+                return True
+            time.sleep(0.1)
+        return False
+
+    def test_webhook_mode(self):
+        statuses = {}
+
+        def stats_update(update_id, text, chat_id=-42):
+            return {"update_id": update_id, "message": {
+                "text": text, "chat": {"id": chat_id}, "from": {"id": update_id}}}
+
+        def client():
+            try:
+                if not self.wait_for(lambda: self.telegram.methods("setWebhook") and self.bot.WEBHOOK_STATE["loop"]):
+                    return
+                served.set()
+                statuses["bad secret"] = self.post(stats_update(1, f"/stats {USER}"), secret="wrong")
+                statuses["bad path"] = self.post(stats_update(2, f"/stats {USER}"), path="/elsewhere")
+                statuses["not json"] = self.post(b"{not json")
+                statuses["first"] = self.post(stats_update(3, f"/stats {USER}"))
+                statuses["redelivered"] = self.post(stats_update(3, f"/stats {USER}"))
+                self.wait_for(lambda: self.telegram.methods("sendPhoto"))
+                time.sleep(0.5)
+            finally:
+                self.bot.stop_webhook()
+
+        served = threading.Event()
+        thread = threading.Thread(target=client, daemon=True)
+        thread.start()
+        self.bot.run_webhook()
+        thread.join(5)
+        self.assertTrue(served.is_set(), "run_webhook returned without serving")
+
+        registration, = self.telegram.methods("setWebhook")
+        self.assertEqual(registration["url"], self.bot.WEBHOOK_URL)
+        self.assertEqual(registration["secret_token"], SECRET)
+
+        self.assertEqual(statuses, {"bad secret": 401, "bad path": 404, "not json": 400,
+                                    "first": 200, "redelivered": 200})
+
+        # Update 3 is handled once: one summary and one chart in the official thread, and
+        # one pointer there for the chat that asked. The rejected updates got no reply.
+        messages = self.telegram.methods("sendMessage")
+        summaries = [m for m in messages if m["chat_id"] == OFFICIAL_CHAT_ID]
+        redirects = [m for m in messages if m["chat_id"] == "-42"]
+        self.assertEqual(len(summaries), 1, messages)
+        self.assertIn(f"Stats for {USER}", summaries[0]["text"])
+        self.assertEqual(str(summaries[0]["message_thread_id"]), OFFICIAL_THREAD_ID)
+        self.assertEqual(len(redirects), 1, messages)
+
+        photo, = self.telegram.methods("sendPhoto")
+        self.assertEqual(photo["chat_id"], OFFICIAL_CHAT_ID)
+        self.assertEqual(photo["caption"], f"Stats for {USER} (Last 30 Days)")
+        self.assertGreater(photo["photo"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()